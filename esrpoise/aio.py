@@ -0,0 +1,143 @@
+"""
+aio.py
+------
+
+asyncio interface, to run optimisations and Xepr I/O from an event loop (e.g.
+alongside a GUI or monitoring coroutines) without blocking it.
+
+XeprAPI is not thread-safe: all the calls made through this module are run on
+a single dedicated I/O thread, which serialises them. An optimisation started
+with ``optimise_async()`` occupies the I/O thread until it ends, so that
+the other Xepr calls made from the event loop wait for it rather than
+interleaving with its acquisitions.
+
+SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import functools
+import threading
+from typing import Union
+
+from . import xepr_link
+from .main import optimise
+from .optpoise import OptimisationCancelled
+
+_IO_EXECUTOR = None
+_IO_LOCK = threading.Lock()
+
+
+def io_executor() -> ThreadPoolExecutor:
+    """
+    Return the executor of the I/O thread, created on first use.
+
+    Returns
+    -------
+    executor : concurrent.futures.ThreadPoolExecutor
+        Executor with a single worker thread, on which all the Xepr calls of
+        this module are run.
+    """
+    global _IO_EXECUTOR
+    with _IO_LOCK:
+        if _IO_EXECUTOR is None:
+            _IO_EXECUTOR = ThreadPoolExecutor(max_workers=1,
+                                              thread_name_prefix="xepr-io")
+        return _IO_EXECUTOR
+
+
+async def run_io(fn: callable, *args, **kwargs):
+    """
+    Run a function on the I/O thread and wait for its result without blocking
+    the event loop.
+
+    Parameters
+    ----------
+    fn : function
+        Function making Xepr calls, e.g. a function of xepr_link.
+    *args, **kwargs
+        Arguments passed to fn.
+
+    Returns
+    -------
+    Return value of fn.
+    """
+    loop = asyncio.get_running_loop()
+    # the context (e.g. the clock in use, cf. clock.py) is passed on
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(io_executor(), functools.partial(
+        context.run, fn, *args, **kwargs))
+
+
+async def load_exp(xepr, exp_file: str) -> None:
+    """
+    Awaitable version of xepr_link.load_exp().
+    """
+    await run_io(xepr_link.load_exp, xepr, exp_file)
+
+
+async def load_def(xepr, def_file: str) -> None:
+    """
+    Awaitable version of xepr_link.load_def().
+    """
+    await run_io(xepr_link.load_def, xepr, def_file)
+
+
+async def run2getdata_exp(xepr, SignalType: str = None,
+                          exp_name: str = None):
+    """
+    Awaitable version of xepr_link.run2getdata_exp().
+    """
+    return await run_io(xepr_link.run2getdata_exp, xepr,
+                        SignalType=SignalType, exp_name=exp_name)
+
+
+async def optimise_async(xepr, pars, init, lb, ub, tol,
+                         cost_function: Union[callable, list, dict],
+                         **kwargs):
+    """
+    Awaitable version of main.optimise(), run on the I/O thread.
+
+    The optimisation can be stopped by cancelling the task awaiting it: the
+    acquisition in progress is allowed to end, the optimisation stops before
+    the next one and asyncio.CancelledError is then raised. Unlike a
+    KeyboardInterrupt, this never interrupts Xepr in the middle of a call.
+
+    Parameters
+    ----------
+    xepr, pars, init, lb, ub, tol, cost_function
+        Cf. main.optimise().
+    **kwargs
+        Other keyword arguments passed to main.optimise().
+
+    Returns
+    -------
+    xbest : numpy.ndarray
+        Numpy array of best values found.
+    fbest : float
+        Value of the cost function at x = xbest.
+    message : str
+        A message indicating why the optimisation terminated.
+    """
+    # The run checks the event before each acquisition, so that the
+    # optimisation stops between two acquisitions.
+    cancel = threading.Event()
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    future = loop.run_in_executor(
+        io_executor(),
+        functools.partial(context.run, optimise, xepr, pars, init, lb, ub,
+                          tol, cost_function, cancel=cancel, **kwargs))
+    try:
+        # shield() so that cancelling the task does not abandon the future
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        cancel.set()
+        # wait for the current acquisition to end
+        try:
+            await asyncio.shield(future)
+        except OptimisationCancelled:
+            pass
+        raise
@@ -0,0 +1,333 @@
+"""
+archive.py
+----------
+
+Append-only archive of the traces acquired during an optimisation, so that a
+run can be re-analysed (e.g. with another cost function) without acquiring
+the data again.
+
+File format (little-endian): a file header made of the magic bytes
+``ESRARC02``, the length of a JSON header (uint32) and the JSON header
+(parameter names), padded to 8 bytes. It is followed by one record per
+acquisition: a 40-byte record header (magic ``ESRT``, complex flag, number of
+parameters, of points of ``data.O`` and of points of ``data.X``, timestamp,
+cost function value) followed by the parameter values (float64), ``data.O``
+flattened (complex128 or float64) and ``data.X`` (float64). ``data.X`` is
+stored with its own size, so that 2D datasets (of which ``X`` is the abscissa
+of the rows) are archived as well. A record interrupted by a crash is ignored
+by the reader.
+
+SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+
+import json
+import os
+import queue
+import struct
+import threading
+from typing import List, Union
+
+import numpy as np
+
+from .clock import get_clock
+from .costfunctions import batch, has_batch
+
+FILE_MAGIC = b"ESRARC02"
+RECORD_MAGIC = b"ESRT"
+RECORD_HEADER = struct.Struct("<4sB3xIII4xdd")
+
+
+class ArchiveError(RuntimeError):
+    pass
+
+
+class ArchiveWriter():
+    """
+    Stream the acquired traces to an archive file on a background thread.
+    """
+
+    def __init__(self, path: str, pars: List[str], chunk_size: int = 16,
+                 max_pending: int = 64, append: bool = False):
+        """
+        Initialise an ArchiveWriter object, creating the archive file.
+
+        Parameters
+        ----------
+        path : str
+            Path of the archive file. An existing file is overwritten, unless
+            append is True.
+        pars : list of str
+            Parameter names, in the order of the values passed to write().
+        chunk_size : int, default 16
+            Maximum number of records written between two fsync() calls. The
+            file is also synchronised whenever no record is waiting.
+        max_pending : int, default 64
+            Maximum number of records waiting to be written. write() blocks
+            when it is reached, which bounds the memory used.
+        append : bool, default False
+            Whether to append the records to an existing archive (with the
+            same parameters), e.g. to resume an interrupted scan. A record
+            interrupted by a crash is overwritten. The file is created if it
+            does not exist.
+        """
+        self.path = path
+        self.pars = list(pars)
+        self.chunk_size = chunk_size
+        self.nrecords = 0
+        self.error = None
+        self.queue = queue.Queue(maxsize=max_pending)
+
+        if append and os.path.exists(path):
+            reader = ArchiveReader(path)
+            if reader.pars != self.pars:
+                raise ArchiveError(f"{path} was recorded with parameters"
+                                   f" {reader.pars}, not {self.pars}.")
+            end = reader.end
+            del reader  # release the memory map
+            self.file = open(path, "r+b")
+            self.file.truncate(end)
+            self.file.seek(end)
+        else:
+            header = json.dumps({"pars": self.pars}).encode()
+            header += b" " * (-(len(FILE_MAGIC) + 4 + len(header)) % 8)
+            self.file = open(path, "wb")
+            self.file.write(FILE_MAGIC + struct.pack("<I", len(header))
+                            + header)
+        self.sync()
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, val: Union[list, np.ndarray], data, cf_val: float) -> None:
+        """
+        Queue a record for writing.
+
+        Parameters
+        ----------
+        val : list of floats or ndarray
+            Values of the parameters.
+        data : XeprAPI.Dataset
+            Acquired data, of which ``O`` (flattened) and ``X`` are archived.
+            They are copied before returning.
+        cf_val : float
+            Value of the cost function.
+        """
+        self.check()
+        val = np.asarray(val, dtype=float)
+        if val.size != len(self.pars):
+            raise ValueError("val should have one value per parameter.")
+        y = np.asarray(data.O)
+        y = y.astype(complex if np.iscomplexobj(y) else float).ravel()
+        x = np.asarray(data.X, dtype=float).ravel()
+        self.queue.put((get_clock().time(), val, y, x, float(cf_val)))
+
+    def run(self) -> None:
+        """
+        Write the queued records (run by the background thread).
+        """
+        unsynced = 0
+        while True:
+            record = self.queue.get()
+            if record is None:
+                break
+            if self.error is not None:
+                # keep draining so that write() never blocks forever
+                continue
+            try:
+                timestamp, val, y, x, cf_val = record
+                self.file.write(RECORD_HEADER.pack(
+                    RECORD_MAGIC, np.iscomplexobj(y), val.size, y.size,
+                    x.size, timestamp, cf_val))
+                for array in (val, y, x):
+                    self.file.write(array.astype(array.dtype.newbyteorder(
+                        "<")).tobytes())
+                self.nrecords += 1
+                unsynced += 1
+                if unsynced >= self.chunk_size or self.queue.empty():
+                    self.sync()
+                    unsynced = 0
+            except Exception as error:
+                self.error = error
+        if self.error is None and unsynced:
+            self.sync()
+
+    def sync(self) -> None:
+        """
+        Flush the written records to disk.
+        """
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def check(self) -> None:
+        """
+        Raise the error of the background thread, if any.
+        """
+        if self.error is not None:
+            raise ArchiveError(f"Archive writing failed: {self.error}")
+
+    def close(self) -> None:
+        """
+        Write the remaining records and close the file.
+        """
+        if self.file.closed:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        self.file.close()
+        self.check()
+
+
+class ArchivedData():
+    """
+    Trace read from an archive, with the same attributes of interest as
+    XeprAPI.Dataset. O and X are read-only memory-mapped arrays, O being
+    flattened.
+    """
+
+    def __init__(self, y: np.ndarray, x: np.ndarray):
+        # setattr() as pycodestyle objects to the XeprAPI attribute name
+        setattr(self, "O", y)
+        self.X = x
+
+
+class ArchiveReader():
+    """
+    Memory-mapped reader of an archive file: only the parameter values, cost
+    function values and timestamps are loaded, the traces are read from disk
+    when accessed.
+    """
+
+    def __init__(self, path: str):
+        """
+        Open an archive file.
+
+        Parameters
+        ----------
+        path : str
+            Path of the archive file.
+        """
+        self.path = path
+        self.buffer = np.memmap(path, dtype=np.uint8, mode="r")
+        if bytes(self.buffer[:len(FILE_MAGIC)]) != FILE_MAGIC:
+            raise ArchiveError(f"{path} is not an esrpoise archive.")
+        start = len(FILE_MAGIC) + 4
+        header_len = struct.unpack("<I", bytes(self.buffer[start - 4:start]))
+        header = json.loads(bytes(self.buffer[start:start + header_len[0]]))
+        self.pars = header["pars"]
+
+        # index the complete records
+        self.records = []
+        timestamps, costs = [], []
+        offset = start + header_len[0]
+        self.end = offset  # end of the last complete record
+        while offset + RECORD_HEADER.size <= self.buffer.size:
+            magic, is_complex, npars, npoints, nx, timestamp, cf_val = \
+                RECORD_HEADER.unpack(bytes(
+                    self.buffer[offset:offset + RECORD_HEADER.size]))
+            offset += RECORD_HEADER.size
+            end = offset + 8 * (npars + npoints * (2 if is_complex else 1)
+                                + nx)
+            if magic != RECORD_MAGIC or end > self.buffer.size:
+                break  # interrupted record
+            self.records.append((offset, bool(is_complex), npars, npoints,
+                                 nx))
+            timestamps.append(timestamp)
+            costs.append(cf_val)
+            offset = self.end = end
+
+        self.timestamps = np.array(timestamps)
+        self.costs = np.array(costs)
+        self.values = np.array(
+            [self._read(offset, "<f8", npars)
+             for offset, _, npars, _, _ in self.records]).reshape(
+                 len(self.records), len(self.pars))
+
+    def _read(self, offset: int, dtype: str, count: int) -> np.ndarray:
+        nbytes = count * np.dtype(dtype).itemsize
+        return self.buffer[offset:offset + nbytes].view(dtype)
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __getitem__(self, i: int) -> ArchivedData:
+        """
+        Trace of the i-th acquisition.
+        """
+        offset, is_complex, npars, npoints, nx = self.records[i]
+        offset += 8 * npars
+        y = self._read(offset, "<c16" if is_complex else "<f8", npoints)
+        offset += y.nbytes
+        return ArchivedData(y, self._read(offset, "<f8", nx))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def stack(self) -> np.ndarray:
+        """
+        Traces of all the records as a 2D array (one trace per row).
+
+        If all the records have the same size and type, the array is a
+        strided view of the memory-mapped file (no data is copied).
+
+        Returns
+        -------
+        traces : ndarray
+            Array of shape (n_records, n_points), of shape (0, 0) if the
+            archive is empty.
+        """
+        if len(self) == 0:
+            return np.empty((0, 0))
+        if len(set(record[1:] for record in self.records)) > 1:
+            traces = [self[i].O for i in range(len(self))]
+            if len(set(trace.size for trace in traces)) > 1:
+                raise ValueError("The archived traces have different sizes.")
+            return np.array(traces, dtype=complex)
+
+        _, is_complex, npars, npoints, _ = self.records[0]
+        dtype = np.dtype("<c16" if is_complex else "<f8")
+        first = self.records[0][0] + 8 * npars
+        stride = self.records[1][0] - self.records[0][0] if len(self) > 1 \
+            else 0
+        return np.ndarray((len(self), npoints), dtype=dtype,
+                          buffer=self.buffer, offset=first,
+                          strides=(stride, dtype.itemsize))
+
+    def reanalyse(self, cost_function: callable,
+                  chunk_size: int = 4096) -> np.ndarray:
+        """
+        Evaluate another cost function on all the archived traces.
+
+        If a batch version of the cost function has been registered (cf.
+        costfunctions.register_batch()), it is used on chunks of traces.
+
+        Parameters
+        ----------
+        cost_function : function
+            A function which takes the data object and returns a float.
+        chunk_size : int, default 4096
+            Number of traces evaluated at once, which bounds the memory used.
+
+        Returns
+        -------
+        cf_vals : ndarray
+            Value of the cost function for each record.
+        """
+        if len(self) == 0:
+            return np.array([])
+        try:
+            traces = self.stack()
+        except ValueError:
+            traces = None  # traces of different sizes
+        if traces is None or not has_batch(cost_function):
+            return np.array([cost_function(data) for data in self])
+        batch_function = batch(cost_function)
+        return np.concatenate([batch_function(traces[i:i + chunk_size])
+                               for i in range(0, len(self), chunk_size)])
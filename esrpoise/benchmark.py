@@ -0,0 +1,486 @@
+"""
+benchmark.py
+------------
+
+Benchmark of the optimisers on synthetic problems mimicking ESR optimisations
+(signal phase, nutation amplitude, field offset and correlated pulse
+parameters), with configurable noise and quantisation of the parameter values.
+
+For each problem, optimiser and random seed (which sets the initial point and
+the noise), the number of function evaluations needed to get within tolerance
+of the optimum is recorded, as well as the time the optimisation would take on
+the spectrometer (acquisitions, hardware settle times and compilations of the
+.def file), simulated with a virtual clock. Trials are spread over a process
+pool, and the results can be saved and compared with the results of another
+version, e.g.::
+
+    python -m esrpoise.benchmark --seeds 50 --save new.json --compare old.json
+
+SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+
+from abc import ABC, abstractmethod
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import json
+from typing import List
+
+import numpy as np
+
+from . import parameters, xepr_link
+from ._version import __version__
+from .clock import VirtualClock, get_clock, use_clock
+from .main import OPTIMISERS, ParameterSpace
+from .optpoise import RunContext, scale
+from .parameters import is_builtin
+
+
+class Problem(ABC):
+    """
+    Synthetic optimisation problem, whose cost function is minimal (-1 without
+    noise) at xopt. Subclasses implement response().
+    """
+
+    name = "problem"
+
+    def __init__(self, lb, ub, tol, xopt, noise: float = 0.002,
+                 quantum=None, spread: float = 0.25, acq_time: float = 1.0,
+                 pars: List[str] = None, compilation_time: float = None):
+        """
+        Initialise a Problem object.
+
+        Parameters
+        ----------
+        lb, ub, tol : list of float
+            Lower bounds, upper bounds and optimisation tolerances for each
+            parameter.
+        xopt : list of float
+            Position of the optimum.
+        noise : float, default 0.002
+            Standard deviation of the Gaussian noise added to the cost
+            function, relative to the signal at the optimum.
+        quantum : list of float, default None
+            Step to which each parameter value is rounded before evaluation,
+            as done by the spectrometer. None for no quantisation.
+        spread : float, default 0.25
+            The initial points are drawn uniformly within spread * (ub - lb)
+            of the optimum (and within bounds), like a reasonable initial
+            guess.
+        acq_time : float, default 1.0
+            Simulated duration of an acquisition (s).
+        pars : list of str, default None
+            Xepr parameter mimicked by each parameter: built-in parameters
+            (cf. parameters.BUILTIN_PARAMETERS), whose settle time is waited
+            after they change, or .def file variables, which are compiled
+            when they change. All .def file variables if None.
+        compilation_time : float, default None
+            Duration of a compilation (s), xepr_link.COMPILATION_TIME if
+            None.
+        """
+        self.lb = np.asarray(lb, dtype=float)
+        self.ub = np.asarray(ub, dtype=float)
+        self.tol = np.asarray(tol, dtype=float)
+        self.xopt = np.asarray(xopt, dtype=float)
+        self.noise = noise
+        self.quantum = None if quantum is None \
+            else np.asarray(quantum, dtype=float)
+        self.spread = spread
+        self.acq_time = acq_time
+        self.pars = [f"p{i}" for i in range(self.lb.size)] if pars is None \
+            else list(pars)
+        self.compilation_time = xepr_link.COMPILATION_TIME \
+            if compilation_time is None else compilation_time
+
+    @abstractmethod
+    def response(self, x: np.ndarray) -> float:
+        """
+        Noiseless cost function.
+        """
+
+    def cost(self, x: np.ndarray, rng: np.random.Generator) -> float:
+        """
+        Cost function for the (quantised) parameter values x, with noise.
+        """
+        if self.quantum is not None:
+            x = np.round(x / self.quantum) * self.quantum
+        return self.response(x) + self.noise * rng.standard_normal()
+
+    def setup_time(self, changed: List[int]) -> float:
+        """
+        Time (s) taken to apply new values of some parameters (indices), as
+        in main.param_set(): the built-in parameters settle simultaneously,
+        and a change of .def file variables compiles the .def and .exp files.
+        """
+        names = [self.pars[i] for i in changed]
+        duration = max([parameters.BUILTIN_PARAMETERS[name].settle_time
+                        for name in names if is_builtin(name)], default=0.)
+        if not all(is_builtin(name) for name in names):
+            duration += 2 * self.compilation_time
+        return duration
+
+    def initial_point(self, rng: np.random.Generator) -> np.ndarray:
+        """
+        Random initial point.
+        """
+        half_width = self.spread * (self.ub - self.lb)
+        return rng.uniform(np.maximum(self.lb, self.xopt - half_width),
+                           np.minimum(self.ub, self.xopt + half_width))
+
+    def within_tol(self, x: np.ndarray) -> bool:
+        """
+        Whether x is within tolerance of the optimum.
+        """
+        return bool(np.all(np.abs(x - self.xopt) <= self.tol))
+
+
+class PhaseProblem(Problem):
+    """
+    Signal phase (deg): the real part of the signal varies sinusoidally.
+    """
+
+    name = "phase"
+
+    def __init__(self, noise: float = 0.002, quantise: bool = True):
+        super().__init__([0], [360], [5], [137.4], noise,
+                         [1] if quantise else None, pars=["SignalPhase"])
+
+    def response(self, x):
+        return -np.cos(np.radians(x[0] - self.xopt[0]))
+
+
+class NutationProblem(Problem):
+    """
+    Pulse amplitude (%): the echo follows the nutation of the magnetisation,
+    with a 90 degree flip angle at xopt.
+    """
+
+    name = "nutation"
+
+    def __init__(self, noise: float = 0.002, quantise: bool = True):
+        super().__init__([0], [100], [2], [41.3], noise,
+                         [0.049] if quantise else None, pars=["BrXAmp"])
+
+    def response(self, x):
+        return -np.sin(np.pi / 2 * x[0] / self.xopt[0])
+
+
+class FieldOffsetProblem(Problem):
+    """
+    Field position (G): Lorentzian line centred on xopt, with flat tails.
+    """
+
+    name = "field"
+
+    def __init__(self, noise: float = 0.002, quantise: bool = True,
+                 width: float = 4):
+        super().__init__([3450], [3530], [0.5], [3491.37], noise,
+                         [0.05] if quantise else None, pars=["CenterField"])
+        self.width = width
+
+    def response(self, x):
+        return -1 / (1 + ((x[0] - self.xopt[0]) / self.width) ** 2)
+
+
+class PulseProblem(Problem):
+    """
+    Correlated pulse parameters (e.g. lengths and amplitudes of several
+    pulses, as .def file variables): Gaussian peak with a rotated, elongated
+    shape.
+    """
+
+    def __init__(self, ndim: int = 2, noise: float = 0.002,
+                 quantise: bool = True):
+        self.name = f"pulse{ndim}d"
+        super().__init__([0] * ndim, [100] * ndim, [2] * ndim,
+                         np.linspace(35, 65, ndim) + 0.3, noise,
+                         [0.1] * ndim if quantise else None)
+        # fixed random rotation, so that the problem is the same each time
+        rotation, _ = np.linalg.qr(
+            np.random.default_rng(ndim).standard_normal((ndim, ndim)))
+        widths = np.where(np.arange(ndim) % 2, 8, 20)
+        self.hessian = rotation @ np.diag(1 / widths ** 2) @ rotation.T
+
+    def response(self, x):
+        dx = x - self.xopt
+        return -np.exp(-0.5 * dx @ self.hessian @ dx)
+
+
+def default_problems(noise: float = 0.002,
+                     quantise: bool = True) -> List[Problem]:
+    """
+    Return the default set of benchmark problems.
+    """
+    return [PhaseProblem(noise, quantise),
+            NutationProblem(noise, quantise),
+            FieldOffsetProblem(noise, quantise),
+            PulseProblem(2, noise, quantise),
+            PulseProblem(3, noise, quantise),
+            PulseProblem(4, noise, quantise)]
+
+
+def run_trial(problem: Problem, optimiser: str, seed: int,
+              maxfev: int = 0, nfactor: int = 10) -> dict:
+    """
+    Run one optimisation of a problem.
+
+    Parameters
+    ----------
+    problem : Problem
+        Problem to optimise.
+    optimiser : str
+        Optimiser name (cf. main.OPTIMISERS).
+    seed : int
+        Seed of the initial point and of the noise.
+    maxfev : int, default 0
+        Maximum number of function evaluations. The default of '0' sets this
+        to 500 times the number of parameters.
+    nfactor : int, default 10
+        Initial search region relative to tols.
+
+    Returns
+    -------
+    trial : dict
+        Problem and optimiser names, seed, number of function evaluations
+        ("nfev"), number of function evaluations until a point within
+        tolerance of the optimum was first evaluated ("fevals_to_tol", None
+        if never), whether the best point found is within tolerance
+        ("success"), simulated wall time ("wall_time", s, including the
+        settle and compilation waits) and optimiser message.
+    """
+    rng = np.random.default_rng(seed)
+    lb, ub, tol = problem.lb, problem.ub, problem.tol
+    if maxfev <= 0:
+        maxfev = 500 * lb.size
+    x0 = problem.initial_point(rng)
+    hit = []
+    applied = [None] * lb.size  # values set, as strings rounded to tol
+
+    space = ParameterSpace(problem.pars, lb, ub, tol)
+
+    def cost(x, *args):
+        val = space.unscale(x)
+        if optimiser in ["nm", "snm", "mds"] and not space.in_bounds(val):
+            return np.inf
+        if not hit and problem.within_tol(val):
+            hit.append(run.calls + 1)
+        # only the changed parameters are set (cf. main.ParamState)
+        val_str = space.format(val)
+        changed = [i for i, v_str in enumerate(val_str)
+                   if v_str != applied[i]]
+        applied[:] = val_str
+        clock = get_clock()
+        clock.sleep(problem.setup_time(changed))
+        clock.sleep(problem.acq_time)
+        return problem.cost(val, rng)
+
+    run = RunContext(cost)
+
+    scaled_x0, scaled_lb, scaled_ub, scaled_xtol = scale(
+        x0, lb, ub, tol, scaleby="tols")
+    trial = dict(problem=problem.name, optimiser=optimiser, seed=seed)
+    clock = VirtualClock()
+    try:
+        with use_clock(clock):
+            opt_result = OPTIMISERS[optimiser](
+                run, scaled_x0, scaled_xtol, scaled_lb, scaled_ub,
+                maxfev=maxfev, nfactor=nfactor)
+        xbest = space.unscale(opt_result.xbest)
+        trial["success"] = problem.within_tol(xbest)
+        trial["message"] = opt_result.message
+    except Exception as error:
+        trial["success"] = False
+        trial["message"] = f"{type(error).__name__}: {error}"
+    trial["nfev"] = run.calls
+    trial["fevals_to_tol"] = hit[0] if hit else None
+    trial["wall_time"] = clock.elapsed
+    return trial
+
+
+def run_benchmark(problems: List[Problem] = None,
+                  optimisers: List[str] = None,
+                  seeds=range(20),
+                  maxfev: int = 0,
+                  nfactor: int = 10,
+                  max_workers: int = None) -> List[dict]:
+    """
+    Run every optimiser on every problem for each seed.
+
+    Parameters
+    ----------
+    problems : list of Problem, default None
+        Problems to optimise, default_problems() if None.
+    optimisers : list of str, default None
+        Optimiser names, all the optimisers of main.OPTIMISERS if None.
+    seeds : iterable of int, default range(20)
+        Seeds of the trials.
+    maxfev, nfactor : int
+        Cf. run_trial().
+    max_workers : int, default None
+        Number of worker processes (the number of processors if None). 0 to
+        run the trials in the current process.
+
+    Returns
+    -------
+    trials : list of dict
+        Result of each trial (cf. run_trial()).
+    """
+    if problems is None:
+        problems = default_problems()
+    if optimisers is None:
+        optimisers = list(OPTIMISERS)
+    tasks = [(problem, optimiser, seed, maxfev, nfactor)
+             for problem in problems for optimiser in optimisers
+             for seed in seeds]
+    if max_workers == 0:
+        return [run_trial(*task) for task in tasks]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(run_trial, *zip(*tasks),
+                                 chunksize=max(1, len(tasks) // 64)))
+
+
+def tail(values: np.ndarray, q: float) -> float:
+    """
+    q-quantile of values without interpolation (values may be infinite).
+    """
+    values = np.sort(values)
+    return values[max(0, int(np.ceil(q * values.size)) - 1)]
+
+
+def summarise(trials: List[dict], q: float = 0.9) -> dict:
+    """
+    Statistics of the trials of each problem and optimiser.
+
+    Parameters
+    ----------
+    trials : list of dict
+        Results of the trials.
+    q : float, default 0.9
+        Quantile used for the tail of the number of function evaluations.
+
+    Returns
+    -------
+    summary : dict
+        For each "problem/optimiser" key, a dictionary with the number of
+        trials, the median and q-quantile of the number of function
+        evaluations to tolerance (infinite when the optimum was not reached),
+        the success rate and the median simulated wall time.
+    """
+    groups = dict()
+    for trial in trials:
+        key = f"{trial['problem']}/{trial['optimiser']}"
+        groups.setdefault(key, []).append(trial)
+    summary = dict()
+    for key, group in groups.items():
+        fevals = np.array([np.inf if t["fevals_to_tol"] is None
+                           else t["fevals_to_tol"] for t in group])
+        summary[key] = {
+            "ntrials": len(group),
+            "median_fevals_to_tol": float(tail(fevals, 0.5)),
+            "tail_fevals_to_tol": float(tail(fevals, q)),
+            "success_rate": float(np.mean([t["success"] for t in group])),
+            "median_wall_time": float(np.median([t["wall_time"]
+                                                 for t in group])),
+        }
+    return summary
+
+
+def report(summary: dict) -> None:
+    """
+    Print a summary table.
+    """
+    fmt = "{:20s}  {:>10s}  {:>10s}  {:>8s}  {:>10s}"
+    print(fmt.format("problem/optimiser", "median", "tail", "success",
+                     "wall time"))
+    print("-" * 66)
+    fmt = "{:20s}  {:>10.0f}  {:>10.0f}  {:>8.0%}  {:>9.0f}s"
+    for key, stats in summary.items():
+        print(fmt.format(key, stats["median_fevals_to_tol"],
+                         stats["tail_fevals_to_tol"], stats["success_rate"],
+                         stats["median_wall_time"]))
+
+
+def save_results(trials: List[dict], path: str) -> None:
+    """
+    Save the trials and their summary to a JSON file.
+    """
+    # infinite values are not valid JSON
+    summary = {key: {name: None if value == np.inf else value
+                     for name, value in stats.items()}
+               for key, stats in summarise(trials).items()}
+    with open(path, "w") as f:
+        json.dump({"version": __version__,
+                   "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                   "trials": trials,
+                   "summary": summary}, f, indent=1)
+
+
+def load_results(path: str) -> List[dict]:
+    """
+    Load the trials saved by save_results().
+    """
+    with open(path, "r") as f:
+        return json.load(f)["trials"]
+
+
+def compare(trials: List[dict], reference: List[dict],
+            rtol: float = 0.1) -> List[str]:
+    """
+    Compare trials with reference trials (e.g. of a previous version).
+
+    Parameters
+    ----------
+    trials, reference : list of dict
+        Results of the trials.
+    rtol : float, default 0.1
+        Relative increase of the median or tail number of function
+        evaluations to tolerance, or decrease of the success rate, above
+        which a regression is reported.
+
+    Returns
+    -------
+    regressions : list of str
+        Description of each regression.
+    """
+    summary, ref_summary = summarise(trials), summarise(reference)
+    regressions = []
+    for key in summary.keys() & ref_summary.keys():
+        stats, ref_stats = summary[key], ref_summary[key]
+        for name in ["median_fevals_to_tol", "tail_fevals_to_tol"]:
+            if stats[name] > (1 + rtol) * ref_stats[name]:
+                regressions.append(f"{key}: {name} {ref_stats[name]:.0f} ->"
+                                   f" {stats[name]:.0f}")
+        if stats["success_rate"] < (1 - rtol) * ref_stats["success_rate"]:
+            regressions.append(f"{key}: success_rate"
+                               f" {ref_stats['success_rate']:.0%} ->"
+                               f" {stats['success_rate']:.0%}")
+    return sorted(regressions)
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--seeds", type=int, default=20,
+                        help="number of seeds per problem and optimiser")
+    parser.add_argument("--optimisers", nargs="+", default=None)
+    parser.add_argument("--noise", type=float, default=0.002)
+    parser.add_argument("--no-quantise", action="store_true")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--save", help="JSON file to save the results to")
+    parser.add_argument("--compare", help="JSON file of reference results")
+    args = parser.parse_args(argv)
+
+    trials = run_benchmark(default_problems(args.noise, not args.no_quantise),
+                           args.optimisers, range(args.seeds),
+                           max_workers=args.workers)
+    report(summarise(trials))
+    if args.save is not None:
+        save_results(trials, args.save)
+    if args.compare is not None:
+        regressions = compare(trials, load_results(args.compare))
+        print("\n".join(["", "Regressions:"] + regressions
+                        if regressions else ["", "No regression."]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+callbacks.py
+------------
+
+Helpers for user defined callback functions (cf. ``examples/callback.py``).
+
+A callback which modifies pulse shapes usually does two things: synthesise the
+shapes in Python, and send them to Xepr. ``PrefetchCallback`` splits a
+callback into these two steps so that the synthesis for the points which the
+optimiser is likely to request next can be carried out on a worker thread,
+while Xepr is acquiring the current point.
+
+SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+
+class PrefetchCallback():
+    """
+    Callback whose expensive preparation step can be run in advance.
+
+    An instance can be passed directly as the ``callback`` argument of
+    ``optimise()``. With the Nelder-Mead optimisers ("nm" and "snm"), the
+    candidates for the next evaluation (reflection, expansion and
+    contractions, or the points of a shrunk simplex) are then prepared on a
+    worker thread while the current point is acquired, and used immediately
+    when the optimiser asks for them.
+
+    The worker threads are only stopped by close(), which should be called
+    once the callback is no longer needed (the pending syntheses are
+    cancelled at the end of each optimisation).
+    """
+
+    def __init__(self, synthesise: callable, apply: callable,
+                 max_workers: int = 1):
+        """
+        Initialise a PrefetchCallback object.
+
+        Parameters
+        ----------
+        synthesise : function
+            Function ``synthesise(pars_dict, *callback_args)`` which prepares
+            the callback artefacts (e.g. pulse shapes) and returns them. It is
+            run on a worker thread, so it must not communicate with Xepr.
+        apply : function
+            Function ``apply(artefacts, pars_dict, *callback_args)`` which
+            sends the artefacts returned by ``synthesise`` to Xepr (e.g.
+            writes the shape files and loads them with
+            ``xepr_link.load_shp()``).
+        max_workers : int, default 1
+            Number of worker threads used for synthesis.
+        """
+        self.synthesise = synthesise
+        self.apply = apply
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.pending = {}
+        self.hits = 0    # calls which used prefetched artefacts
+        self.misses = 0  # calls which had to synthesise synchronously
+
+    @staticmethod
+    def key(pars_dict: dict) -> tuple:
+        """
+        Hashable key identifying a set of parameter values.
+        """
+        return tuple(sorted((par, float(val))
+                            for par, val in pars_dict.items()))
+
+    def __call__(self, pars_dict: dict, *args) -> None:
+        future = self.pending.pop(self.key(pars_dict), None)
+        if future is not None:
+            # Waits if the synthesis is still running, and re-raises any
+            # exception raised in the worker thread.
+            artefacts = future.result()
+            self.hits += 1
+        else:
+            artefacts = self.synthesise(pars_dict, *args)
+            self.misses += 1
+        self.apply(artefacts, pars_dict, *args)
+
+    def prefetch(self, pars_dicts: List[dict], *args) -> None:
+        """
+        Start the synthesis for a list of parameter values which are likely
+        to be requested next. Previously prefetched values which are not in
+        the list are discarded.
+
+        Parameters
+        ----------
+        pars_dicts : list of dict
+            Parameter values, in the same format as passed to the callback.
+        *args
+            Arguments for the callback function.
+        """
+        pending = {}
+        for pars_dict in pars_dicts:
+            key = self.key(pars_dict)
+            if key in pending:
+                continue
+            future = self.pending.pop(key, None)
+            if future is None:
+                future = self.executor.submit(self.synthesise,
+                                              dict(pars_dict), *args)
+            pending[key] = future
+        # stale predictions
+        for future in self.pending.values():
+            future.cancel()
+        self.pending = pending
+
+    def discard(self) -> None:
+        """
+        Discard all prefetched artefacts, cancelling the pending syntheses.
+        Called by optimise() at the end of each run.
+        """
+        for future in self.pending.values():
+            future.cancel()
+        self.pending = {}
+
+    def close(self) -> None:
+        """
+        Discard all prefetched artefacts and stop the worker threads. Must be
+        called once the callback is no longer used.
+        """
+        self.discard()
+        self.executor.shutdown(wait=True)
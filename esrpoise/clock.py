@@ -0,0 +1,119 @@
+"""
+clock.py
+--------
+
+Clock used for all the waits and timers of esrpoise (compilation waits in
+``xepr_link``, acquisition time of the simulated backend, timing of
+``optimise()``...).
+
+The real clock is used by default. A ``VirtualClock`` can be installed instead,
+e.g. to run a simulated optimisation at CPU speed while still estimating the
+time it would take on the spectrometer::
+
+    with use_clock(VirtualClock()) as clock:
+        optimise(SimulatedXepr(response, acq_time=2), ...)
+    print(clock.elapsed)
+
+The clock is installed for the current thread only, so that concurrent runs
+(e.g. benchmark trials or optimisations in threads) can each use their own.
+
+SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+import threading
+import time
+
+
+class Clock():
+    """
+    Real clock.
+    """
+
+    def time(self) -> float:
+        """
+        Current time (s since the epoch).
+        """
+        return time.time()
+
+    def now(self) -> datetime:
+        """
+        Current local date and time.
+        """
+        return datetime.fromtimestamp(self.time())
+
+    def sleep(self, duration: float) -> None:
+        """
+        Wait for duration (s).
+        """
+        time.sleep(duration)
+
+
+class VirtualClock(Clock):
+    """
+    Clock whose time only advances when sleep() (or advance()) is called, which
+    returns immediately.
+    """
+
+    def __init__(self, start: float = None):
+        """
+        Initialise a VirtualClock object.
+
+        Parameters
+        ----------
+        start : float, default None
+            Initial time (s since the epoch). Current time if None.
+        """
+        self.start = time.time() if start is None else start
+        self.elapsed = 0.
+        self.lock = threading.Lock()
+
+    def time(self) -> float:
+        return self.start + self.elapsed
+
+    def sleep(self, duration: float) -> None:
+        self.advance(duration)
+
+    def advance(self, duration: float) -> None:
+        """
+        Advance the time by duration (s).
+        """
+        with self.lock:
+            self.elapsed += max(duration, 0)
+
+
+# The clock is local to each thread (and asyncio task), so that a clock
+# installed by one run does not affect the runs in other threads.
+_CLOCK = ContextVar("clock", default=Clock())
+
+
+def get_clock() -> Clock:
+    """
+    Return the clock in use in the current thread (or asyncio task).
+    """
+    return _CLOCK.get()
+
+
+def set_clock(clock: Clock = None) -> None:
+    """
+    Install a clock in the current thread (or asyncio task), or the real
+    clock if clock is None.
+    """
+    _CLOCK.set(Clock() if clock is None else clock)
+
+
+@contextmanager
+def use_clock(clock: Clock):
+    """
+    Context manager installing a clock temporarily in the current thread (or
+    asyncio task). Functions run on other threads with
+    contextvars.copy_context().run (as done by aio.run_io()) use it too.
+    """
+    token = _CLOCK.set(clock)
+    try:
+        yield clock
+    finally:
+        _CLOCK.reset(token)
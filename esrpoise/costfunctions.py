@@ -11,6 +11,12 @@ Cost functions must be defined as:
 - returning a float, which corresponds to how 'bad' the data is. The worse the
 data, the larger the return value should be.
 
+The cost functions below also accept a ``DatasetView``, which fetches the
+trace from Xepr once and caches the quantities derived from it (magnitude,
+spectrum, baseline), so that they are computed only once per acquisition
+even if several cost functions are evaluated (``optimise()`` passes such a
+view to the cost function).
+
 SPDX-License-Identifier: GPL-3.0-or-later
 
 """
@@ -18,13 +24,120 @@ SPDX-License-Identifier: GPL-3.0-or-later
 import numpy as np
 
 
+class DatasetView():
+    """
+    View of a dataset, with the trace fetched once and lazily cached derived
+    quantities.
+
+    The attributes ``O`` and ``X`` are available as for XeprAPI.Dataset (with
+    the original dtype, and writable), and the other attributes are looked up
+    on the wrapped dataset. The built-in cost functions use ``trace``, a
+    read-only contiguous complex copy of ``O``, and the cached quantities
+    derived from it.
+    """
+
+    def __init__(self, data, baseline_fraction: float = 0.1):
+        """
+        Initialise a DatasetView object.
+
+        Parameters
+        ----------
+        data : XeprAPI.Dataset
+            data retrieved from Xepr
+        baseline_fraction : float, default 0.1
+            Fraction of the points, at each end of the trace, used to compute
+            the baseline.
+        """
+        self.data = data
+        self.baseline_fraction = baseline_fraction
+        # fetch the trace once (each access to data.O may query Xepr)
+        # setattr() as pycodestyle objects to the XeprAPI attribute name
+        setattr(self, "O", data.O)
+        self.X = data.X
+        self.cache = dict()
+
+    def __getattr__(self, name: str):
+        # only called for attributes not found on the view
+        if name == "data":
+            raise AttributeError(name)
+        return getattr(self.data, name)
+
+    def cached(self, name: str, compute: callable) -> np.ndarray:
+        """
+        Return a derived quantity, computing it on first access.
+        """
+        if name not in self.cache:
+            value = compute()
+            if isinstance(value, np.ndarray):
+                value.flags.writeable = False
+            self.cache[name] = value
+        return self.cache[name]
+
+    @property
+    def trace(self) -> np.ndarray:
+        """
+        Complex trace (read-only contiguous copy of O, computed once).
+        """
+        # a copy, so that O itself stays writable
+        return self.cached("trace", lambda: np.array(
+            getattr(self, "O"), dtype=complex, order="C"))
+
+    @property
+    def real(self) -> np.ndarray:
+        """
+        Real part of the trace (view, no copy).
+        """
+        return self.trace.real
+
+    @property
+    def imag(self) -> np.ndarray:
+        """
+        Imaginary part of the trace (view, no copy).
+        """
+        return self.trace.imag
+
+    @property
+    def magnitude(self) -> np.ndarray:
+        """
+        Magnitude of the trace.
+        """
+        return self.cached("magnitude", lambda: np.abs(self.trace))
+
+    @property
+    def spectrum(self) -> np.ndarray:
+        """
+        Spectrum (FFT of the trace).
+        """
+        return self.cached("spectrum", lambda: np.fft.fft(self.trace))
+
+    @property
+    def baseline(self) -> complex:
+        """
+        Mean of the trace over the first and last baseline_fraction of its
+        points.
+        """
+        def compute():
+            n = max(1, int(self.trace.size * self.baseline_fraction))
+            return np.mean(np.concatenate([self.trace[:n], self.trace[-n:]]))
+        return self.cached("baseline", compute)
+
+
+def as_view(data) -> DatasetView:
+    """
+    Return data as a DatasetView (data itself if it is one already).
+    """
+    if isinstance(data, DatasetView):
+        return data
+    return DatasetView(data)
+
+
 # spectrum
 def spectrum(data):
     """Compute a spectrum from Xepr standard time domain data.
 
     Parameters
     ----------
-    data : XeprAPI.Dataset
+    data : XeprAPI.Dataset or DatasetView
         data retrieved from Xepr
 
     Returns
@@ -32,9 +145,7 @@ def spectrum(data):
     spectrum : ndarray
         spectrum computed from time domain data
     """
-    spectrum = np.fft.fft(data.O.real + 1j * data.O.imag)
-
-    return spectrum
+    return as_view(data).spectrum
 
 
 def minabsint(data):
@@ -87,7 +198,9 @@ def zerorealint(data):
     possible. This works by summation, so dispersion-mode peaks will not
     contribute to this cost function (as they add to zero).
     """
-    return np.abs(np.sum(np.fft(data.O.real)))
+    data = as_view(data)
+    return np.abs(np.sum(data.cached("spectrum_real",
+                                     lambda: np.fft.fft(data.real))))
 
 
 def zeroimagint(data):
@@ -95,7 +208,9 @@ def zeroimagint(data):
     Try to get the intensity of the imaginary spectrum to be as close to zero
     as possible.
     """
-    return np.abs(np.sum(np.fft(data.O.imag)))
+    data = as_view(data)
+    return np.abs(np.sum(data.cached("spectrum_imag",
+                                     lambda: np.fft.fft(data.imag))))
 
 
 # echo
@@ -103,7 +218,7 @@ def minabsint_echo(data):
     """
     Minimise the absolute (magnitude-mode) intensity of the echo.
     """
-    return np.sum(np.abs(data.O.real + 1j * data.O.imag))
+    return np.sum(as_view(data).magnitude)
 
 
 def maxabsint_echo(data):
@@ -117,7 +232,7 @@ def minrealint_echo(data):
     """
     Minimise the maximum intensity of the real part of the echo.
     """
-    return np.sum(data.O.real)
+    return np.sum(as_view(data).real)
 
 
 def maxrealint_echo(data):
@@ -131,7 +246,7 @@ def minimagint_echo(data):
     """
     Minimise the maximum intensity of the imaginary part of the echo.
     """
-    return np.sum(data.O.imag)
+    return np.sum(as_view(data).imag)
 
 
 def maximagint_echo(data):
@@ -146,7 +261,7 @@ def zerorealint_echo(data):
     Try to get the intensity of the real part of the echo to be as close to
     zero as possible.
     """
-    return np.abs(np.sum(data.O.real))
+    return np.abs(np.sum(as_view(data).real))
 
 
 def zeroimagint_echo(data):
@@ -154,7 +269,7 @@ def zeroimagint_echo(data):
     Try to get the intensity of the imaginary part of the echo to be as close
     to zero as possible.
     """
-    return np.abs(np.sum(data.O.imag))
+    return np.abs(np.sum(as_view(data).imag))
 
 
 def maxrealint_plus_zeroimagint_echo(data):
@@ -162,6 +277,7 @@ def maxrealint_plus_zeroimagint_echo(data):
     Try to get the intensity of the imaginary part of the echo to be as close
     to zero as possible.
     """
+    data = as_view(data)
     return maxrealint_echo(data)+zeroimagint_echo(data)
 
 
@@ -169,7 +285,7 @@ def minabsmax_echo(data):
     """
     Minimise the absolute (magnitude-mode) maximum of the echo.
     """
-    return np.max(np.abs(data.O.real + 1j * data.O.imag))
+    return np.max(as_view(data).magnitude)
 
 
 def maxabsmax_echo(data):
@@ -183,7 +299,7 @@ def minrealmax_echo(data):
     """
     Minimise the maximum of the real part of the echo.
     """
-    return np.max(data.O.real)
+    return np.max(as_view(data).real)
 
 
 def maxrealmax_echo(data):
@@ -197,7 +313,7 @@ def minimagmax_echo(data):
     """
     Minimise the maximum of the imaginary part of the echo.
     """
-    return np.max(data.O.imag)
+    return np.max(as_view(data).imag)
 
 
 def maximagmax_echo(data):
@@ -213,4 +329,580 @@ def max_n2p(data):
     Maximise n2p parameter for DEER trace.
     Data should contain the 2 points of interest in position 0 and 1.
     """
-    return -np.abs(data.O.real[0]-data.O.real[1])
+    data = as_view(data)
+    return -np.abs(data.real[0]-data.real[1])
+
+
+# reference data
+def reference_cost(reference, dt: float = None, upsampling: int = 8,
+                   zero_fill: int = 8) -> callable:
+    """
+    Return a cost function comparing the data with reference data.
+
+    Everything which only depends on the reference (normalisation,
+    interpolation indices and weights for a given trace length) is computed
+    once, so that each evaluation only processes the trace.
+
+    Parameters
+    ----------
+    reference : ndarray
+        Either an array of shape (n, 2), whose columns are frequency offsets
+        (Hz) and target spectrum intensities (e.g. a field sweep converted to
+        frequencies), or a 1D array containing the target echo.
+    dt : float, default None
+        Time resolution of the traces (s). Required for a target spectrum.
+    upsampling : int, default 8
+        Target spectrum only: factor by which the echo is linearly
+        interpolated before its first-order phase correction (i.e. its
+        truncation at its maximum).
+    zero_fill : int, default 8
+        Target spectrum only: zero-filling factor of the echo before its
+        Fourier transform.
+
+    Returns
+    -------
+    cost_function : function
+        Cost function returning the norm of the difference between the
+        processed data and the normalised reference. Its attribute
+        ``process`` is the function returning the processed data (spectrum
+        on the frequencies of the reference, or echo with the phase of the
+        reference).
+
+    Notes
+    -----
+    For a target spectrum, the spectrum is computed from the echo
+    interpolated by ``upsampling`` and truncated at its maximum (its second
+    point being halved to avoid a baseline offset). It is then phased to
+    maximise its real part (zero-order phase correction), normalised to its
+    maximum and interpolated at the frequencies of the reference, which is
+    normalised to its maximum too.
+
+    For a target echo, the echo and the reference are normalised to their
+    maximum magnitude, and the echo is phased to match the reference.
+    """
+    reference = np.asarray(reference)
+
+    if reference.ndim == 1:
+        ref_echo = reference.astype(complex) / np.max(np.abs(reference))
+
+        def process(data):
+            echo = as_view(data).trace
+            if echo.size != ref_echo.size:
+                raise ValueError("The trace and the reference echo should"
+                                 " have the same length.")
+            echo = echo / np.max(np.abs(echo))
+            return echo * np.exp(1j * np.angle(np.vdot(echo, ref_echo)))
+
+        def cost_function(data):
+            return np.linalg.norm(ref_echo - process(data))
+        cost_function.process = process
+        return cost_function
+
+    if dt is None:
+        raise ValueError("dt is required to compare with a target spectrum.")
+    ref_x = np.asarray(reference[:, 0], dtype=float)
+    ref_y = np.asarray(reference[:, 1], dtype=float)
+    ref_y = ref_y / np.max(ref_y)
+    sf = upsampling / dt  # sampling frequency of the upsampled echo
+    grids = dict()  # trace length -> interpolation indices and weights
+
+    def linear_weights(positions, size):
+        positions = np.clip(positions, 0, size - 1)
+        k = np.minimum(positions.astype(int), max(size - 2, 0))
+        return k, positions - k
+
+    def upsampling_grid(n):
+        key = ("upsampling", n)
+        if key not in grids:
+            grids[key] = linear_weights(
+                np.linspace(0, n - 1, upsampling * n), n)
+        return grids[key]
+
+    def spectrum_grid(m):
+        # positions of the reference frequencies in the spectrum of the
+        # truncated echo (m points, zero-filled), whose frequency axis is
+        # np.linspace(-sf / 2, sf / 2, zero_fill * m)
+        key = ("spectrum", m)
+        if key not in grids:
+            size = zero_fill * m
+            grids[key] = linear_weights(
+                (ref_x + sf / 2) / sf * (size - 1), size)
+        return grids[key]
+
+    def interpolate(y, grid):
+        k, w = grid
+        if y.size == 1:
+            return np.full(k.size, y[0])
+        return y[k] * (1 - w) + y[k + 1] * w
+
+    def process(data):
+        echo = interpolate(as_view(data).trace,
+                           upsampling_grid(as_view(data).trace.size))
+        echo = echo[np.argmax(np.abs(echo)):]
+        echo[1:2] /= 2
+        spec = np.fft.fftshift(np.fft.fft(echo, n=zero_fill * echo.size))
+        # zero-order phase maximising the real part
+        spec = np.real(spec * np.exp(-1j * np.angle(np.sum(spec))))
+        spec = spec / np.max(spec)
+        return interpolate(spec, spectrum_grid(echo.size))
+
+    def cost_function(data):
+        return np.linalg.norm(ref_y - process(data))
+    cost_function.process = process
+    return cost_function
+
+
+# echo window and matched filter
+def detect_echo_window(data, threshold: float = 0.5,
+                       margin: float = 1.0) -> slice:
+    """
+    Detect the echo in a trace.
+
+    The echo is the contiguous region around the maximum of the magnitude
+    (after baseline subtraction) where the magnitude is above threshold times
+    its maximum, extended on each side by margin times its width.
+
+    Parameters
+    ----------
+    data : XeprAPI.Dataset, DatasetView or ndarray
+        Data (or trace) containing the echo.
+    threshold : float, default 0.5
+        Fraction of the maximum magnitude defining the echo (0.5 for its full
+        width at half maximum).
+    margin : float, default 1.0
+        Extension of the window on each side, relative to the echo width.
+
+    Returns
+    -------
+    window : slice
+        Indices of the echo window.
+    """
+    if isinstance(data, np.ndarray):
+        data = Trace(data, None)
+    data = as_view(data)
+    magnitude = np.abs(data.trace - data.baseline)
+    imax = np.argmax(magnitude)
+    below = magnitude < threshold * magnitude[imax]
+    before = np.flatnonzero(below[:imax])
+    after = np.flatnonzero(below[imax:])
+    start = before[-1] + 1 if before.size else 0
+    stop = imax + after[0] if after.size else magnitude.size
+    extension = int(np.ceil(margin * (stop - start)))
+    return slice(max(0, start - extension),
+                 min(magnitude.size, stop + extension))
+
+
+class EchoWindowIntegral():
+    """
+    Cost function integrating the echo over its window only, so that the noise
+    outside of the echo does not contribute to the cost function.
+
+    The window is detected on the reference echo if given, otherwise on the
+    first trace evaluated, and then kept for the whole run (optimise() calls
+    reset() at the start of each run), e.g.::
+
+        optimise(..., cost_function=EchoWindowIntegral("real"), ...)
+    """
+
+    def __init__(self, part: str = "real", window: slice = None,
+                 reference=None, threshold: float = 0.5,
+                 margin: float = 1.0):
+        """
+        Initialise an EchoWindowIntegral object.
+
+        Parameters
+        ----------
+        part : str from {"real", "abs"}, default "real"
+            Part of the echo integrated (the cost function is minus the
+            integral, i.e. the integral is maximised).
+        window : slice, default None
+            Indices of the echo window, detected if None.
+        reference : XeprAPI.Dataset, DatasetView or ndarray, default None
+            Echo on which the window is detected.
+        threshold, margin : float
+            Cf. detect_echo_window().
+        """
+        if part not in ["real", "abs"]:
+            raise ValueError(f"Invalid part {part} specified. Allowed values"
+                             " are: ['real', 'abs']")
+        self.part = part
+        self.threshold = threshold
+        self.margin = margin
+        if window is None and reference is not None:
+            window = detect_echo_window(reference, threshold, margin)
+        self.fixed_window = window
+        self.window = window
+
+    def reset(self) -> None:
+        """
+        Forget the window detected on the first trace of the previous run
+        (a window given or detected on the reference echo is kept).
+        """
+        self.window = self.fixed_window
+
+    def detect(self, trace: np.ndarray) -> slice:
+        if self.window is None:
+            self.window = detect_echo_window(trace, self.threshold,
+                                             self.margin)
+        return self.window
+
+    def integrate(self, traces: np.ndarray) -> np.ndarray:
+        if self.part == "real":
+            return np.sum(traces.real, axis=-1)
+        return np.sum(np.abs(traces), axis=-1)
+
+    def __call__(self, data) -> float:
+        trace = as_view(data).trace
+        return -self.integrate(trace[self.detect(trace)])
+
+    def batch(self, traces) -> np.ndarray:
+        traces = stack(traces)
+        return -self.integrate(traces[:, self.detect(traces[0])])
+
+
+class MatchedFilter():
+    """
+    Cost function maximising the output of a matched filter, i.e. the
+    projection of the trace on a template of the echo (which is the linear
+    filter maximising the signal-to-noise ratio for a known echo shape).
+
+    The template is the reference echo if given, otherwise the first trace
+    evaluated, restricted to its echo window, and is kept for the whole run
+    (optimise() calls reset() at the start of each run), e.g.::
+
+        optimise(..., cost_function=MatchedFilter(), ...)
+    """
+
+    def __init__(self, reference=None, phase_sensitive: bool = True,
+                 threshold: float = 0.5, margin: float = 1.0):
+        """
+        Initialise a MatchedFilter object.
+
+        Parameters
+        ----------
+        reference : XeprAPI.Dataset, DatasetView or ndarray, default None
+            Reference echo.
+        phase_sensitive : bool, default True
+            If True, the real part of the filter output is maximised, i.e. the
+            echo is also optimised to be in phase with the template.
+            Otherwise, its magnitude is maximised.
+        threshold, margin : float
+            Cf. detect_echo_window(), used to restrict the template to the
+            echo window.
+        """
+        self.phase_sensitive = phase_sensitive
+        self.threshold = threshold
+        self.margin = margin
+        self.template = None
+        if reference is not None:
+            if not isinstance(reference, np.ndarray):
+                reference = as_view(reference).trace
+            self.set_template(np.asarray(reference, dtype=complex))
+        self.reference_template = self.template
+
+    def reset(self) -> None:
+        """
+        Forget the template taken from the first trace of the previous run
+        (the template of the reference echo is kept).
+        """
+        self.template = self.reference_template
+
+    def set_template(self, trace: np.ndarray) -> None:
+        """
+        Compute the template (unit norm) from an echo.
+        """
+        view = as_view(Trace(trace, None))
+        window = detect_echo_window(view, self.threshold, self.margin)
+        template = np.zeros(trace.size, dtype=complex)
+        template[window] = trace[window] - view.baseline
+        norm = np.linalg.norm(template)
+        if norm == 0:
+            raise ValueError("The echo used as template is zero: it cannot"
+                             " be normalised.")
+        self.template = template / norm
+
+    def filter(self, traces: np.ndarray) -> np.ndarray:
+        if self.template is None:
+            self.set_template(np.atleast_2d(traces)[0])
+        output = traces @ self.template.conj()
+        return output.real if self.phase_sensitive else np.abs(output)
+
+    def __call__(self, data) -> float:
+        return -self.filter(as_view(data).trace)
+
+    def batch(self, traces) -> np.ndarray:
+        return -self.filter(stack(traces))
+
+
+# several objectives
+class MultiObjective():
+    """
+    Cost function scoring each trace with several cost functions, and
+    returning a weighted sum of the scores (scalarised objective).
+
+    The scores of every point acquired during an optimisation are stored
+    (cf. record()), so that several tuning questions can be answered from one
+    acquisition campaign, e.g. with pareto_front().
+    """
+
+    def __init__(self, cost_functions, weights=None):
+        """
+        Initialise a MultiObjective object.
+
+        Parameters
+        ----------
+        cost_functions : list of functions or dict
+            Cost functions, or dictionary of cost functions with their names
+            as keys.
+        weights : list of float, default None
+            Weight of each cost function in the scalarised objective. All
+            equal to 1 if None.
+        """
+        if isinstance(cost_functions, dict):
+            self.names = list(cost_functions.keys())
+            self.cost_functions = list(cost_functions.values())
+        else:
+            self.cost_functions = list(cost_functions)
+            self.names = [getattr(cf, "__name__", type(cf).__name__)
+                          for cf in self.cost_functions]
+        if weights is None:
+            weights = np.ones(len(self.cost_functions))
+        self.weights = np.asarray(weights, dtype=float)
+        if self.weights.size != len(self.cost_functions):
+            raise ValueError("weights should have one value per cost"
+                             " function.")
+        self.last_scores = None
+        self.points = []
+        self.scores = []
+
+    def __repr__(self):
+        return f"MultiObjective({dict(zip(self.names, self.weights))})"
+
+    def reset(self) -> None:
+        """
+        Forget the recorded points, and reset the cost functions which
+        support it (called by optimise() at the start of each run).
+        """
+        for cf in self.cost_functions:
+            if hasattr(cf, "reset"):
+                cf.reset()
+        self.last_scores = None
+        self.points = []
+        self.scores = []
+
+    def evaluate(self, data) -> np.ndarray:
+        """
+        Scores of the data for each cost function.
+        """
+        data = as_view(data)
+        return np.array([cf(data) for cf in self.cost_functions],
+                        dtype=float)
+
+    def __call__(self, data) -> float:
+        self.last_scores = self.evaluate(data)
+        return float(self.weights @ self.last_scores)
+
+    def record(self, val) -> None:
+        """
+        Store the scores of the last evaluation with the corresponding
+        parameter values.
+        """
+        self.points.append(np.array(val, dtype=float))
+        self.scores.append(self.last_scores)
+
+    def pareto_front(self):
+        """
+        Approximate Pareto front: the recorded points which are not dominated
+        by any other recorded point (i.e. no other point is at least as good
+        for all the cost functions and better for one).
+
+        Returns
+        -------
+        points : ndarray
+            Parameter values of the non-dominated points, one per row.
+        scores : ndarray
+            Their scores, one column per cost function.
+        """
+        points, scores = np.array(self.points), np.array(self.scores)
+        # In lexicographic order, a point can only be dominated by points
+        # before it, which are compared with the front found so far.
+        front = []
+        for i in np.lexsort(scores.T[::-1]):
+            others = scores[front]
+            if not np.any(np.all(others <= scores[i], axis=1)
+                          & np.any(others < scores[i], axis=1)):
+                front.append(i)
+        return points[front], scores[front]
+
+    def best(self, name) -> np.ndarray:
+        """
+        Recorded point with the best score for one of the cost functions.
+
+        Parameters
+        ----------
+        name : str or int
+            Name or index of the cost function.
+        """
+        i = self.names.index(name) if isinstance(name, str) else name
+        return self.points[int(np.argmin(np.array(self.scores)[:, i]))]
+
+
+# batch versions
+def stack(traces) -> np.ndarray:
+    """
+    Return traces as a 2D complex array (one trace per row).
+
+    Parameters
+    ----------
+    traces : array_like or list of datasets
+        Traces of the same length, either as an array of shape (n_traces,
+        n_points) or as a list of datasets (or DatasetView).
+
+    Returns
+    -------
+    traces : ndarray
+        Complex array of shape (n_traces, n_points).
+    """
+    if isinstance(traces, (list, tuple)) and traces and \
+            hasattr(traces[0], "O"):
+        traces = [as_view(data).trace for data in traces]
+    return np.atleast_2d(np.asarray(traces, dtype=complex))
+
+
+def spectra(traces) -> np.ndarray:
+    """
+    Spectra of stacked traces, computed with one batched FFT.
+    """
+    return np.fft.fft(stack(traces), axis=1)
+
+
+BATCH_COST_FUNCTIONS = dict()
+
+
+def register_batch(cost_function: callable):
+    """
+    Decorator registering the batch version of a cost function, e.g.::
+
+        def my_cf(data):
+            return -np.max(data.O.real)
+
+        @register_batch(my_cf)
+        def my_cf_batch(traces):
+            return -np.max(traces.real, axis=1)
+
+    Parameters
+    ----------
+    cost_function : function
+        Cost function taking one dataset and returning a float.
+
+    Returns
+    -------
+    decorator : function
+        Decorator registering a function which takes a complex array of shape
+        (n_traces, n_points) and returns an array of n_traces cost function
+        values.
+    """
+    def decorator(batch_function):
+        BATCH_COST_FUNCTIONS[cost_function] = batch_function
+        return batch_function
+    return decorator
+
+
+def batch(cost_function: callable) -> callable:
+    """
+    Return the batch version of a cost function.
+
+    If none has been registered and the cost function has no ``batch``
+    method, the returned function evaluates the cost function on each trace
+    in turn.
+
+    Parameters
+    ----------
+    cost_function : function
+        Cost function taking one dataset and returning a float.
+
+    Returns
+    -------
+    batch_function : function
+        Function which takes the traces (cf. stack()) and returns an array of
+        cost function values.
+    """
+    if has_batch(cost_function):
+        batch_function = BATCH_COST_FUNCTIONS.get(
+            cost_function, getattr(cost_function, "batch", None))
+        return lambda traces: np.asarray(batch_function(stack(traces)),
+                                         dtype=float)
+
+    def loop(traces):
+        traces = stack(traces)
+        x = np.arange(traces.shape[1], dtype=float)
+        return np.array([cost_function(DatasetView(Trace(trace, x)))
+                         for trace in traces], dtype=float)
+    return loop
+
+
+def has_batch(cost_function: callable) -> bool:
+    """
+    Whether a cost function has a batch version, either registered or as its
+    ``batch`` method.
+    """
+    return (cost_function in BATCH_COST_FUNCTIONS
+            or callable(getattr(cost_function, "batch", None)))
+
+
+class Trace():
+    """
+    Minimal dataset holding one trace.
+    """
+
+    def __init__(self, y: np.ndarray, x: np.ndarray):
+        # setattr() as pycodestyle objects to the XeprAPI attribute name
+        setattr(self, "O", y)
+        self.X = x
+
+
+def register_negated(cost_function: callable, negated: callable) -> None:
+    """
+    Register the batch version of negated(data) = -cost_function(data).
+    """
+    register_batch(negated)(
+        lambda traces: -BATCH_COST_FUNCTIONS[cost_function](traces))
+
+
+register_batch(minabsint)(
+    lambda traces: np.sum(np.abs(spectra(traces)), axis=1))
+register_batch(minrealint)(
+    lambda traces: np.sum(spectra(traces).real, axis=1))
+register_batch(minimagint)(
+    lambda traces: np.sum(spectra(traces).imag, axis=1))
+register_batch(zerorealint)(
+    lambda traces: np.abs(np.sum(np.fft.fft(traces.real, axis=1), axis=1)))
+register_batch(zeroimagint)(
+    lambda traces: np.abs(np.sum(np.fft.fft(traces.imag, axis=1), axis=1)))
+register_batch(minabsint_echo)(
+    lambda traces: np.sum(np.abs(traces), axis=1))
+register_batch(minrealint_echo)(lambda traces: np.sum(traces.real, axis=1))
+register_batch(minimagint_echo)(lambda traces: np.sum(traces.imag, axis=1))
+register_batch(zerorealint_echo)(
+    lambda traces: np.abs(np.sum(traces.real, axis=1)))
+register_batch(zeroimagint_echo)(
+    lambda traces: np.abs(np.sum(traces.imag, axis=1)))
+register_batch(maxrealint_plus_zeroimagint_echo)(
+    lambda traces: (-np.sum(traces.real, axis=1)
+                    + np.abs(np.sum(traces.imag, axis=1))))
+register_batch(minabsmax_echo)(lambda traces: np.max(np.abs(traces), axis=1))
+register_batch(minrealmax_echo)(lambda traces: np.max(traces.real, axis=1))
+register_batch(minimagmax_echo)(lambda traces: np.max(traces.imag, axis=1))
+register_batch(max_n2p)(
+    lambda traces: -np.abs(traces.real[:, 0] - traces.real[:, 1]))
+for _cf, _negated in [(minabsint, maxabsint),
+                      (minrealint, maxrealint),
+                      (minimagint, maximagint),
+                      (minabsint_echo, maxabsint_echo),
+                      (minrealint_echo, maxrealint_echo),
+                      (minimagint_echo, maximagint_echo),
+                      (minabsmax_echo, maxabsmax_echo),
+                      (minrealmax_echo, maxrealmax_echo),
+                      (minimagmax_echo, maximagmax_echo)]:
+    register_negated(_cf, _negated)
+del _cf, _negated
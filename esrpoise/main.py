@@ -8,15 +8,34 @@ SPDX-License-Identifier: GPL-3.0-or-later
 
 """
 
-from datetime import datetime
+from decimal import Decimal
+from functools import lru_cache
+import threading
+
 import numpy as np
 
-from .optpoise import (scale, unscale, deco_count,
-                       nelder_mead, multid_search, pybobyqa_interface,
-                       brute_force)
+from .optpoise import (MAGIC_TOL, scale, RunContext,
+                       nelder_mead, surrogate_nelder_mead, multid_search,
+                       pybobyqa_interface, brute_force)
 from . import xepr_link
+from .clock import get_clock
+from .costfunctions import DatasetView, MultiObjective
+from .parameters import is_builtin, set_parameters, Quantisation
+from .pipeline import PipelinedEvaluator
 from typing import List, Union
 
+# Optimisation functions. optpoise implements a PyBOBYQA interface so that the
+# returned result has the same attributes as our other optimisers.
+OPTIMISERS = {"nm": nelder_mead,
+              "snm": surrogate_nelder_mead,
+              "mds": multid_search,
+              "bobyqa": pybobyqa_interface,
+              "brute": brute_force,
+              }
+
+# Run contexts of the optimisations in progress, per thread (cf. current_run())
+_RUNS = threading.local()
+
 
 def optimise(xepr,
              pars: List[str],
@@ -24,14 +43,20 @@ def optimise(xepr,
              lb: Union[list, np.ndarray],
              ub: Union[list, np.ndarray],
              tol: Union[list, np.ndarray],
-             cost_function: callable,
+             cost_function: Union[callable, list, dict],
              exp_file: str = None,
              def_file: str = None,
              optimiser: str = "bobyqa",
              maxfev: int = 0,
              nfactor: int = 10,
              callback: callable = None,
-             callback_args: tuple = None) -> None:
+             callback_args: tuple = None,
+             optimiser_kwargs: dict = None,
+             param_state=None,
+             pipeline: bool = False,
+             archive=None,
+             readback=False,
+             cancel=None) -> None:
     """
     Run an optimisation.
 
@@ -51,26 +76,69 @@ def optimise(xepr,
         Upper bounds for each parameter.
     tol : list of float
         Optimisation tolerances for each parameter.
-    cost_function : function
-        A function which takes the data object and returns a float.
+    cost_function : function, list of functions or dict
+        A function which takes the data object and returns a float. The data
+        object is a costfunctions.DatasetView of the Xepr dataset.
+        Several cost functions (or a dictionary of named cost functions) can
+        be given: each trace is then scored by all of them and the sum of the
+        scores is minimised. Pass a costfunctions.MultiObjective instead to
+        use other weights, or to access the parameter values and scores of
+        every point acquired after the run (e.g. the approximate Pareto
+        front, with its pareto_front() method).
     exp_file : str, default None
         Experiment file (.exp) path to be used for the experiment in Xepr.
         Required to modify parameters in .def file.
     def_file : str, default None
         Definition file (.exp) path to be used for the experiment in Xepr.
         Required to modify parameters in .def file.
-    optimiser : str from {"nm", "mds", "bobyqa", "brute"}, default "nm"
+    optimiser : {"nm", "snm", "mds", "bobyqa", "brute"}, default "bobyqa"
         Optimisation algorithm to use. The options correspond to Nelder-Mead,
-        multidimensional search, BOBYQA, and brute-force search respectively.
+        surrogate-assisted Nelder-Mead, multidimensional search, BOBYQA, and
+        brute-force search respectively. "bobyqa" requires the optional
+        Py-BOBYQA package (``esrpoise[bobyqa]``).
     maxfev : int, default 0
         Maximum number of spectra to acquire during the optimisation. The
         default of '0' sets this to 500 times the number of parameters.
     nfactor : int, default 10
         Initial search region relative to tols
     callback : function, default None
-        User defined function called when setting up parameters.
+        User defined function called when setting up parameters. If it has a
+        ``prefetch`` method (cf. callbacks.PrefetchCallback) and a
+        Nelder-Mead optimiser is used, the likely next parameter values are
+        passed to it before each acquisition.
     callback_args : tuple, default None
         Arguments for callback function
+    optimiser_kwargs : dict, default None
+        Additional keyword arguments passed to the optimisation function, e.g.
+        ``{"confidence": 3}`` to tune the surrogate model confidence threshold
+        of the "snm" optimiser.
+    param_state : ParamState, default None
+        Record of the parameter values applied in Xepr, so that unchanged
+        values are not sent again. A new one is created if None. Pass the same
+        instance to e.g. a shapes.ShapeManager with automatic AWG reset so
+        that the parameters can be restored after a reset.
+    pipeline : bool, default False
+        Only used with the brute-force optimiser. Whether to evaluate the
+        points with pipeline.PipelinedEvaluator, i.e. to overlap the cost
+        function evaluation and logging of each point, as well as the .def
+        file edits of the next point, with the acquisition.
+    archive : archive.ArchiveWriter, default None
+        If given, every acquired trace is streamed to it with the parameter
+        values and the cost function value, so that the run can be analysed
+        again later (cf. archive.ArchiveReader). It is not closed at the end
+        of the optimisation.
+    readback : bool or parameters.Quantisation, default False
+        Whether to read back the built-in parameter values applied by Xepr
+        after rounding them to the hardware resolution. The quantisation of
+        each parameter is then learned, and points which map to a hardware
+        setting already acquired are not acquired again (the cost function
+        value of that setting is reused). A parameters.Quantisation object
+        can be passed to reuse what was learned in previous optimisations.
+        Not used with pipeline=True.
+    cancel : threading.Event, default None
+        Event which, once set (e.g. from another thread), stops the
+        optimisation before the next acquisition by raising
+        optpoise.OptimisationCancelled.
 
     Returns
     -------
@@ -87,26 +155,29 @@ def optimise(xepr,
     To quit the optimisation, simply type 'ctlr+C' in the terminal.
     It is recommended to do so during an acquisition phase of Xepr to avoid
     Xepr crashes.
+    aio.optimise_async() runs the optimisation from an event loop, where
+    cancelling it waits for the current acquisition to end.
 
     Note once the optimisation is done, the best parameters found are set up in
     Xepr but the experiment is not run.
     """
     # Get start time
-    tic = datetime.now()
-
-    # Choose the optimisation function. optpoise implements a PyBOBYQA
-    # interface so that the returned result has the same attributes as our
-    # other optimisers.
-    optimfndict = {"nm": nelder_mead,
-                   "mds": multid_search,
-                   "bobyqa": pybobyqa_interface,
-                   "brute": brute_force,
-                   }
+    tic = get_clock().now()
+
+    # Several cost functions evaluated on each trace
+    if isinstance(cost_function, (list, tuple, dict)):
+        cost_function = MultiObjective(cost_function)
+    # state kept by the cost function from a previous run (e.g. the window of
+    # EchoWindowIntegral detected on its first trace) does not apply
+    if hasattr(cost_function, "reset"):
+        cost_function.reset()
+
+    # Choose the optimisation function.
     try:
-        optimfn = optimfndict[optimiser.lower()]
+        optimfn = OPTIMISERS[optimiser.lower()]
     except KeyError:
         raise ValueError(f"Invalid optimiser {optimiser} specified."
-                         f" Allowed values are: {list(optimfndict.keys())}")
+                         f" Allowed values are: {list(OPTIMISERS.keys())}")
 
     # Scale the initial values and tolerances
     npars = len(pars)
@@ -121,11 +192,12 @@ def optimise(xepr,
         raise ValueError("pars and tol should have the same length.")
     scaled_x0, scaled_lb, scaled_ub, scaled_xtol = scale(init, lb, ub, tol,
                                                          scaleby="tols")
+    space = ParameterSpace(pars, lb, ub, tol)
 
     # Some logging
     print("\n")
     print("=" * 60)
-    print(datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    print(get_clock().now().strftime("%Y-%m-%d %H:%M:%S"))
     fmt = "{:25s} - {}"
     print(fmt.format("Optimisation parameters", pars))
     print(fmt.format("Cost function", cost_function))
@@ -141,32 +213,116 @@ def optimise(xepr,
 
     # Set up optimisation arguments. Basically, this needs to be everything
     # that acquire_esr() uses apart from x itself.
+    if param_state is None:
+        param_state = ParamState()
+    quantisation = None
+    if readback:
+        quantisation = Quantisation() if readback is True else readback
+        # the learned quantisation is kept, but the cost function values are
+        # only valid for this run
+        quantisation.costs = dict()
+        quantisation.hits = 0
     optimargs = (cost_function, pars, lb, ub, tol, optimiser,
                  xepr, exp_file, def_file,
-                 callback, callback_args)
-
-    # Carry out the optimisation
-    acquire_esr.calls = 0  # ensures that each optim starts from 0
-    opt_result = optimfn(acquire_esr, scaled_x0, scaled_xtol,
-                         scaled_lb, scaled_ub,
-                         args=optimargs, maxfev=maxfev, nfactor=nfactor)
-    best_values = unscale(opt_result.xbest, lb, ub, tol, scaleby="tols")
+                 callback, callback_args, param_state, archive, space,
+                 quantisation)
+
+    # Carry out the optimisation. The run state (number of experiments,
+    # budget, history) is held by a new RunContext rather than by
+    # acquire_esr(), so that concurrent optimisations do not interfere.
+    run = RunContext(acquire_esr, maxfev=maxfev, cancel=cancel)
+    if optimiser_kwargs is None:
+        optimiser_kwargs = {}
+    optimiser_kwargs = dict(optimiser_kwargs)
+
+    # Callbacks which support it (e.g. callbacks.PrefetchCallback) prepare
+    # the next likely Nelder-Mead candidates while the current one is being
+    # acquired.
+    if hasattr(callback, "prefetch") and optimiser.lower() in ["nm", "snm"]:
+        def prefetch(xs):
+            vals = space.unscale(xs)
+            # out of bounds values are never acquired
+            pars_dicts = [dict(zip(pars, val))
+                          for val in vals[space.in_bounds(vals)]]
+            if callback_args is None:
+                callback.prefetch(pars_dicts)
+            else:
+                callback.prefetch(pars_dicts, *callback_args)
+        optimiser_kwargs.setdefault("prefetch", prefetch)
+
+    # The brute-force points are known in advance: their acquisition can be
+    # pipelined.
+    if pipeline and optimiser.lower() == "brute":
+        def_pars = [i for i, par in enumerate(pars)
+                    if '&' not in par and not is_builtin(par)]
+
+        def setup(val):
+            # the whole grid is one batch: check before each acquisition
+            run.check_cancelled()
+            param_set(xepr, pars, val, tol, exp_file, def_file,
+                      callback, callback_args, param_state, space)
+
+        def stage(val):
+            # write the .def file in advance, compiled by setup()
+            if def_pars and def_file is not None:
+                val_str = space.format(val)
+                xepr_link.modif_def(None, def_file,
+                                    [pars[i] for i in def_pars],
+                                    [val_str[i] for i in def_pars])
+
+        def record(val, data, cf_val):
+            log_values(val, tol, cf_val)
+            if isinstance(cost_function, MultiObjective):
+                cost_function.record(val)
+            if archive is not None:
+                archive.write(val, data, cf_val)
+
+        evaluator = PipelinedEvaluator(xepr, setup, cost_function,
+                                       stage=stage, record=record)
+
+        def batch_cf(xs):
+            vals = list(space.unscale(xs))
+            cf_vals = evaluator.evaluate(vals)
+            for x, cf_val in zip(xs, cf_vals):
+                run.record(x, cf_val)
+            return cf_vals
+        optimiser_kwargs.setdefault("batch_cf", batch_cf)
+    previous_run = current_run()
+    _RUNS.current = run
+    try:
+        opt_result = optimfn(run, scaled_x0, scaled_xtol,
+                             scaled_lb, scaled_ub,
+                             args=optimargs, maxfev=maxfev, nfactor=nfactor,
+                             **optimiser_kwargs)
+    finally:
+        _RUNS.current = previous_run
+        # the remaining predictions are stale
+        if "prefetch" in optimiser_kwargs and hasattr(callback, "discard"):
+            callback.discard()
+    best_values = space.unscale(opt_result.xbest)
 
     # set up optimal parameters values
     param_set(xepr, pars, best_values, tol,
-              exp_file, def_file, callback, callback_args)
+              exp_file, def_file, callback, callback_args, param_state, space)
 
     # final logging
-    toc = datetime.now()
+    toc = get_clock().now()
     time_taken = str(toc - tic).split(".")[0]  # remove microseconds
 
     fmt = "{:27s} - {}"
 
     print('-' * 40)
     print()
-    print(fmt.format("Best values found", round2tol_str(best_values, tol)))
+    print(fmt.format("Best values found", space.format(best_values)))
     print(fmt.format("Cost function at minimum", opt_result.fbest))
-    print(fmt.format("Number of experiments ran", acquire_esr.calls))
+    if quantisation is None:
+        print(fmt.format("Number of experiments ran", run.calls))
+    else:
+        print(fmt.format("Number of experiments ran",
+                         run.calls - quantisation.hits))
+        print(fmt.format("Number of cached settings", quantisation.hits))
+    if optimiser.lower() == "snm":
+        print(fmt.format("Number of skipped experiments", opt_result.nskip))
     print(fmt.format("Total time taken", time_taken))
     print(fmt.format("Optimisation message", opt_result.message))
     print("=" * 60)
@@ -179,7 +335,20 @@ def optimize(*args, **kwargs):
     return optimise(*args, **kwargs)
 
 
-@deco_count
+def current_run():
+    """
+    Run context of the optimisation in progress in the calling thread, e.g. to
+    access the number of experiments ran (``current_run().calls``) from a
+    callback function.
+
+    Returns
+    -------
+    run : optpoise.RunContext or None
+        Run context, or None if no optimisation is in progress.
+    """
+    return getattr(_RUNS, "current", None)
+
+
 def acquire_esr(x: np.ndarray,
                 cost_function: callable,
                 pars: Union[list, np.ndarray],
@@ -191,7 +360,11 @@ def acquire_esr(x: np.ndarray,
                 exp_file: str = None,
                 def_file: str = None,
                 callback: callable = None,
-                callback_args: tuple = None) -> float:
+                callback_args: tuple = None,
+                param_state=None,
+                archive=None,
+                space=None,
+                quantisation=None) -> float:
     """
     This is the function which is actually passed to the optimisation function
     as the "cost function", and is responsible for triggering acquisition in
@@ -222,9 +395,10 @@ def acquire_esr(x: np.ndarray,
         Upper bounds for each parameter.
     tol : list of float
         Optimisation tolerances for each parameter.
-    optimiser : str from {"nm", "mds", "bobyqa", "brute"}, default "nm"
-        Optimisation algorithm to use. The options correspond to Nelder-Mead,
-        multidimensional search, BOBYQA, and brute-force search respectively.
+    optimiser : str from {"nm", "snm", "mds", "bobyqa", "brute"}
+        Optimisation algorithm used. The options correspond to Nelder-Mead,
+        surrogate-assisted Nelder-Mead, multidimensional search, BOBYQA, and
+        brute-force search respectively.
     xepr : instance of XeprAPI.Xepr
         The instantiated Xepr object.
     cost_function : function
@@ -239,6 +413,17 @@ def acquire_esr(x: np.ndarray,
         User defined function called when setting up parameters.
     callback_args: tuple, default None
         Arguments for callback function
+    param_state : ParamState, default None
+        Record of the parameter values applied in Xepr.
+    archive : archive.ArchiveWriter, default None
+        Archive to which the acquired trace is written.
+    space : ParameterSpace, default None
+        Precomputed scaling and rounding of the parameters. Created from
+        pars, lb, ub and tol if None.
+    quantisation : parameters.Quantisation, default None
+        If given, the built-in parameter values applied by Xepr are read back
+        and learned, and the cost function value of an effective setting
+        already acquired is returned without acquiring it again.
 
     Returns
     -------
@@ -247,7 +432,9 @@ def acquire_esr(x: np.ndarray,
     """
 
     # Unscale values for acquisition.
-    unscaled_val = unscale(x, lb, ub, tol, scaleby="tols")
+    if space is None:
+        space = ParameterSpace(pars, lb, ub, tol)
+    unscaled_val = space.unscale(x)
 
     # Enforce constraints on optimisation. This doesn't need to be done for
     # BOBYQA, because we pass the `bounds` parameter, which automatically stops
@@ -256,34 +443,87 @@ def acquire_esr(x: np.ndarray,
     # inaccuracy sometimes it tries to sample a point that is *just*
     # outside of the bounds (see foroozandehgroup/nmrpoise#39).  Instead, we
     # should just let it evaluate the point as usual.
-    if (optimiser in ["nm", "mds"] and
-            (np.any(unscaled_val < lb) or np.any(unscaled_val > ub))):
+    if optimiser in ["nm", "snm", "mds"] and not space.in_bounds(unscaled_val):
         # Set the value of the cost function to infinity.
         cf_val = np.inf
 
         # Return immediately.
         return cf_val
 
+    if quantisation is not None:
+        # hardware setting predicted from the learned quantisation
+        val_str = space.format(unscaled_val)
+        requested = {par: float(v_str) for par, v_str in zip(pars, val_str)
+                     if is_builtin(par)}
+        setting = quantisation.setting(pars, val_str,
+                                       quantisation.snap(requested))
+        if setting in quantisation.costs:
+            quantisation.hits += 1
+            cf_val = quantisation.costs[setting]
+            log_values(unscaled_val, tol, cf_val)
+            return cf_val
+
     # set parameters values
     param_set(xepr, pars, unscaled_val, tol,
-              exp_file, def_file, callback, callback_args)
-
-    # record data
-    data = xepr_link.run2getdata_exp(xepr)
+              exp_file, def_file, callback, callback_args, param_state, space)
+
+    if quantisation is not None:
+        # hardware setting actually applied
+        effective = quantisation.read(
+            xepr, requested,
+            None if param_state is None else param_state.exp_name)
+        setting = quantisation.setting(pars, val_str, effective)
+        if setting in quantisation.costs:
+            quantisation.hits += 1
+            cf_val = quantisation.costs[setting]
+            log_values(unscaled_val, tol, cf_val)
+            return cf_val
+        unscaled_val = np.array([effective.get(par, val) for par, val
+                                 in zip(pars, unscaled_val)])
+
+    # record data (fetched once, cf. costfunctions.DatasetView)
+    data = DatasetView(xepr_link.run2getdata_exp(xepr))
 
     # evaluate the cost function
     cf_val = cost_function(data)
+    if quantisation is not None:
+        quantisation.costs[setting] = cf_val
+    if isinstance(cost_function, MultiObjective):
+        cost_function.record(unscaled_val)
 
     # log
-    fstr = "{:^10.4f}  " * (len(x) + 1)  # Format string for logging
-
-    # print values sent to Xepr
-    print(fstr.format(*np.array(
-        round2tol_str(unscaled_val, tol)).astype(np.float), cf_val))
+    log_values(unscaled_val, tol, cf_val)
+    if archive is not None:
+        archive.write(unscaled_val, data, cf_val)
 
     return cf_val
 
 
+def log_values(val: Union[list, np.ndarray],
+               tol: Union[list, np.ndarray],
+               cf_val: float) -> None:
+    """
+    Print the values sent to Xepr and the corresponding cost function value.
+
+    Parameters
+    ----------
+    val : list of floats or ndarray
+        values of the parameters
+    tol : list of float
+        Optimisation tolerances for each parameter.
+    cf_val : float
+        Value of the cost function.
+
+    Returns
+    -------
+    None
+    """
+    fstr = "{:^10.4f}  " * (len(val) + 1)  # Format string for logging
+
+    # print values sent to Xepr
+    print(fstr.format(*snap2tol(val, tol), cf_val))
+
+
 def param_set(xepr,
               pars: List[str],
               val: Union[list, np.ndarray],
@@ -291,7 +531,9 @@ def param_set(xepr,
               exp_file: str = None,
               def_file: str = None,
               callback: callable = None,
-              callback_args: tuple = None) -> None:
+              callback_args: tuple = None,
+              param_state=None,
+              space=None) -> None:
     """
     Set a variety of parameters in Xepr.
 
@@ -317,6 +559,12 @@ def param_set(xepr,
         User defined function called when setting up parameters.
     callback_args : tuple, default None
         Arguments for callback function
+    param_state : ParamState, default None
+        Record of the values already applied in Xepr. If given, built-in and
+        .def file parameters whose values have not changed are not sent to
+        Xepr again.
+    space : ParameterSpace, default None
+        Precomputed rounding of the parameters, used instead of tol if given.
 
     Returns
     -------
@@ -325,11 +573,15 @@ def param_set(xepr,
 
     # convert parameters values to string with the same number of decimals as
     # tolerances
-    val_str = round2tol_str(val, tol)
+    if space is None:
+        val_str = round2tol_str(val, tol)
+    else:
+        val_str = space.format(val)
 
     def_modif = False
     pars_def = list()
     val_str_def = list()
+    builtin_values = dict()
 
     for par, v_str in zip(pars, val_str):
         # Remark:
@@ -341,49 +593,14 @@ def param_set(xepr,
             if callback is None:
                 raise TypeError('callback should not be None if user '
                                 'parameters (name starting with &) are used.')
+            continue
 
-        # Xepr parameters: Bridge - Receiver Unit
-        elif par == "VideoGain":
-            # Video gain (dB), 0 to 48 (1MHz bandwidth),min tolerance of 6
-            xepr.XeprCmds.aqParSet("AcqHidden", "ftBridge.VideoGain", v_str)
-        elif par == "Attenuation":
-            # High power attenuation (dB), ,min tolerance of 0.01
-            xepr.XeprCmds.aqParSet("AcqHidden", "ftBridge.Attenuation", v_str)
-        elif par == "SignalPhase":
-            # Signal phse (~0.129deg), min tolerance of 1
-            xepr.XeprCmds.aqParSet("AcqHidden", "cwBridge.SignalPhase", v_str)
-        elif par == "TMLevel":
-            # Transmitter level (%), min tolerance of 0.049
-            xepr.XeprCmds.aqParSet("AcqHidden", "ftBridge.TMLevel", v_str)
-
-        # Xepr parameters: Bridge - MPFU control
-        # (%), 0 to 100, rounded in Xepr to closest 0.049
-        # (approximately, not linear)
-        elif par == "BrXPhase":  # +<x> Phase
-            xepr.XeprCmds.aqParSet("AcqHidden", "ftBridge.BrXPhase", v_str)
-        elif par == "BrXAmp":  # +<x> Amplitude
-            xepr.XeprCmds.aqParSet("AcqHidden", "ftBridge.BrXAmp", v_str)
-        elif par == "BrYPhase":  # +<y> Phase
-            xepr.XeprCmds.aqParSet("AcqHidden", "ftBridge.BrYPhase", v_str)
-        elif par == "BrYAmp":  # +<y> Amplitude
-            xepr.XeprCmds.aqParSet("AcqHidden", "ftBridge.BrYAmp", v_str)
-        elif par == "BrMinXPhase":  # -<x> Phase
-            xepr.XeprCmds.aqParSet("AcqHidden", "ftBridge.BrMinXPhase", v_str)
-        elif par == "BrMinXAmp":  # -<x> Amplitude
-            xepr.XeprCmds.aqParSet("AcqHidden", "ftBridge.BrMinXAmp", v_str)
-        elif par == "BrMinYPhase":  # -<y> Phase
-            xepr.XeprCmds.aqParSet("AcqHidden", "ftBridge.BrMinYPhase", v_str)
-        elif par == "BrMinYAmp":  # -<y> Amplitude
-            xepr.XeprCmds.aqParSet("AcqHidden", "ftBridge.BrMinYAmp", v_str)
-
-        # Xepr parameters: FT EPR Parameters
-        elif par == "CenterField":
-            # Field Position (G), variation around expected value, min
-            # tolerance of 0.05
-            curr_exp = xepr.XeprExperiment()
-            expt_name = curr_exp.aqGetExpName()
-            xepr.XeprCmds.aqParSet(
-                expt_name, "fieldCtrl.CenterField", v_str)
+        if param_state is not None and not param_state.changed(par, v_str):
+            continue
+
+        # Xepr parameters: built-in, set together below
+        if is_builtin(par):
+            builtin_values[par] = v_str
 
         # Xepr parameters: .def file
         else:
@@ -392,6 +609,30 @@ def param_set(xepr,
             pars_def.append(par)
             val_str_def.append(v_str)
 
+    if def_modif:
+        if def_file is None:
+            raise ValueError('Some parameters are considered .def file '
+                             'parameters. The file path def_file is '
+                             'required to modify them.')
+        if exp_file is None:
+            raise ValueError('Some parameters are considered .def file '
+                             'parameters. The experiment file path '
+                             'exp_file is required to modify them.')
+
+    # The values are only recorded in param_state once they have been
+    # applied, so that they are sent again if anything fails.
+
+    # set built-in parameters
+    if builtin_values:
+        if param_state is None:
+            set_parameters(xepr, builtin_values)
+        else:
+            # cache the name of the current experiment
+            param_state.exp_name = set_parameters(xepr, builtin_values,
+                                                  param_state.exp_name)
+            for par, v_str in builtin_values.items():
+                param_state.record(par, v_str)
+
     # set user parameters
     if callback is not None:
         # user parameters grouped in a dictionary
@@ -402,18 +643,105 @@ def param_set(xepr,
 
     # set parameters in definition file
     if def_modif:
-
-        if def_file is None:
-            raise ValueError('Some parameters are considered .def file '
-                             'parameters. The file path def_file is '
-                             'required to modify them.')
         xepr_link.modif_def(xepr, def_file, pars_def, val_str_def)
-
-        if exp_file is None:
-            raise ValueError('Some parameters are considered .def file '
-                             'parameters. The experiment file path '
-                             'exp_file is required to modify them.')
         xepr_link.load_exp(xepr, exp_file)
+        if param_state is not None:
+            for par, v_str in zip(pars_def, val_str_def):
+                param_state.record(par, v_str)
+
+
+class ParamState():
+    """
+    Record of the parameter values applied in Xepr (dirty tracking).
+
+    Passed to param_set(), it avoids sending unchanged values to Xepr again.
+    After an experiment reset (cf. xepr_link.reset_exp()), restore() applies
+    the recorded built-in parameters values again. The name of the current
+    experiment is also cached, so that it is queried only once.
+    """
+
+    def __init__(self):
+        self.applied = dict()  # parameter name -> value string
+        self.exp_name = None   # name of the current experiment, once queried
+
+    def changed(self, par: str, v_str: str) -> bool:
+        """
+        Whether v_str differs from the value last applied for par.
+        """
+        return self.applied.get(par) != v_str
+
+    def record(self, par: str, v_str: str) -> None:
+        """
+        Record that v_str has been applied for par.
+        """
+        self.applied[par] = v_str
+
+    def invalidate(self) -> None:
+        """
+        Forget all applied values, so that they are all sent to Xepr again on
+        the next call to param_set(), and the name of the current experiment.
+        """
+        self.applied.clear()
+        self.exp_name = None
+
+    def restore(self, xepr) -> None:
+        """
+        Apply all the recorded built-in parameter values in Xepr again. The
+        .def file parameters are restored by reloading the .def file, which
+        contains the values last applied.
+        """
+        self.exp_name = set_parameters(
+            xepr, {par: v_str for par, v_str in self.applied.items()
+                   if is_builtin(par)}, self.exp_name)
+
+
+@lru_cache(maxsize=64)
+def _tol_grid(tols: tuple) -> tuple:
+    """
+    Tolerances as integer multiples of a power of ten (10**-decimals), with
+    the corresponding formatters, cached per set of tolerances.
+    """
+    tol = np.array(tols, dtype=float)
+    decimals = np.array([tol_decimals(t) for t in tols], dtype=int)
+    power = 10.0 ** decimals
+    quanta = np.round(tol * power)
+    formatters = tuple(f"{{:.{d}f}}".format for d in decimals)
+    return tol, quanta, power, formatters
+
+
+def tol_decimals(tol: float) -> int:
+    """
+    Number of decimals of a tolerance, e.g. 3 for 0.049, 5 for 1e-5 and 0 for
+    1e6.
+    """
+    # repr() gives the shortest decimal string which round-trips
+    exponent = Decimal(repr(float(tol))).normalize().as_tuple().exponent
+    return max(0, -exponent)
+
+
+def snap2tol(values: Union[list, np.ndarray],
+             tols: Union[list, np.ndarray]) -> np.ndarray:
+    """
+    Round values to closest multiple of tolerance (vectorised).
+
+    Parameters
+    ----------
+    values : list or ndarray
+        values to round, with one value per tolerance along the last axis
+        (e.g. one point per row)
+    tols : list or ndarray
+        values tolerances
+
+    Returns
+    -------
+    ndarray
+        rounded values, each being the float closest to the decimal multiple
+        of its tolerance (e.g. 0.147 rather than 3 * 0.049)
+    """
+    tol, quanta, power, _ = _tol_grid(tuple(tols))
+    # + 0.0 turns -0.0 into 0.0
+    return np.round(np.asarray(values, dtype=float) / tol) * quanta / power \
+        + 0.0
 
 
 def round2tol_str(values: Union[list, np.ndarray],
@@ -431,23 +759,84 @@ def round2tol_str(values: Union[list, np.ndarray],
     Returns
     -------
     values_str :
-        rounded values as a list of strings
+        rounded values as a list of strings, with the same number of decimals
+        as the tolerances
     """
+    formatters = _tol_grid(tuple(tols))[3]
+    return [fmt(val) for fmt, val in zip(formatters, snap2tol(values, tols))]
 
-    values_str = list()
-    for val, tol in zip(values, tols):
 
-        # round to tolerance multiple
-        val = tol * np.round(val / tol)
-        tol_str = str(tol)
+class ParameterSpace():
+    """
+    Parameters of an optimisation, with their bounds and tolerances.
 
-        if '.' not in tol_str:  # integer case # tol.is_integer()
-            values_str.append(str(int(val)))
-        elif tol.is_integer():  # float which is an integer case
-            values_str.append(str(int(val)))
-        else:  # float case
-            decimal_nb = len(tol_str[tol_str.index('.'):-1])
-            # round to same number of decimal numbers
-            values_str.append(str(np.round(val, decimal_nb)))
+    The affine transform between the unscaled values and the values seen by
+    the optimisers (scaled by tols, cf. optpoise.scale()) and the rounding
+    to the tolerances are precomputed once per run, and vectorised so that
+    many points (e.g. of a brute-force grid) can be processed at once.
+    """
 
-    return values_str
+    def __init__(self,
+                 pars: List[str],
+                 lb: Union[list, np.ndarray],
+                 ub: Union[list, np.ndarray],
+                 tol: Union[list, np.ndarray]):
+        """
+        Initialise a ParameterSpace object.
+
+        Parameters
+        ----------
+        pars : list of str
+            Parameter names.
+        lb : list of float
+            Lower bounds for each parameter.
+        ub : list of float
+            Upper bounds for each parameter.
+        tol : list of float
+            Optimisation tolerances for each parameter.
+        """
+        self.pars = list(pars)
+        self.lb, self.ub, self.tol = (np.array(a, dtype=float)
+                                      for a in (lb, ub, tol))
+        if not (len(self.pars) == self.lb.size == self.ub.size
+                == self.tol.size):
+            raise ValueError("pars, lb, ub and tol should have the same"
+                             " length.")
+        self.tols = tuple(self.tol)
+        # unscaled value = lb + step * scaled value
+        self.step = self.tol / MAGIC_TOL
+        _, self.quanta, self.power, self.formatters = _tol_grid(self.tols)
+
+    def scale(self, val: Union[list, np.ndarray]) -> np.ndarray:
+        """
+        Scale values by tols, as optpoise.scale(scaleby="tols").
+        """
+        return (np.asarray(val, dtype=float) - self.lb) / self.step
+
+    def unscale(self, x: Union[list, np.ndarray]) -> np.ndarray:
+        """
+        Unscale values scaled by tols, as optpoise.unscale(scaleby="tols").
+        x can contain several points (one per row).
+        """
+        return np.asarray(x, dtype=float) * self.step + self.lb
+
+    def in_bounds(self, val: Union[list, np.ndarray]):
+        """
+        Whether unscaled values are within the bounds (one bool per point).
+        """
+        val = np.asarray(val, dtype=float)
+        return np.all((val >= self.lb) & (val <= self.ub), axis=-1)
+
+    def snap(self, val: Union[list, np.ndarray]) -> np.ndarray:
+        """
+        Round values to closest multiple of tolerance, cf. snap2tol().
+        """
+        return np.round(np.asarray(val, dtype=float) / self.tol) \
+            * self.quanta / self.power + 0.0
+
+    def format(self, val: Union[list, np.ndarray]) -> List[str]:
+        """
+        Values of one point rounded to the tolerances as strings, cf.
+        round2tol_str().
+        """
+        return [fmt(v) for fmt, v in zip(self.formatters, self.snap(val))]
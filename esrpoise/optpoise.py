@@ -8,11 +8,10 @@ SPDX-License-Identifier: GPL-3.0-or-later
 """
 
 import itertools
-from functools import wraps
+from functools import update_wrapper
 from warnings import warn
 
 import numpy as np
-import pybobyqa as pb
 
 from typing import Union
 
@@ -237,6 +236,83 @@ class Simplex():
             self.x[i] = self.x[0] - (self.x[i] - self.x[0])/2
 
 
+class QuadraticSurrogate():
+    """
+    Local quadratic model of all the cost function values evaluated so far.
+
+    For each prediction, a full quadratic is fitted (by least squares) to the
+    points nearest to the candidate, and the residuals of the fit are used to
+    estimate the uncertainty of the prediction.
+    """
+
+    def __init__(self, N: int, nlocal: int = None):
+        """
+        Initialise a QuadraticSurrogate object.
+
+        Parameters
+        ----------
+        N : int
+            Number of optimisation parameters.
+        nlocal : int, optional
+            Number of nearest points used for each local fit. Defaults to
+            twice the number of coefficients of a quadratic in N dimensions.
+        """
+        self.N = N
+        # constant + linear + (upper triangle of) quadratic coefficients
+        self.ncoef = (N + 1) * (N + 2) // 2
+        self.nlocal = 2 * self.ncoef if nlocal is None else nlocal
+        self.xs, self.fs = [], []
+
+    def add(self, x: np.ndarray, f: float):
+        """
+        Add an evaluated point to the model. Non-finite cost function values
+        (e.g. out-of-bounds points) are not used for fitting.
+        """
+        if np.isfinite(f):
+            self.xs.append(np.array(x, dtype=float))
+            self.fs.append(f)
+
+    def features(self, dx: np.ndarray) -> np.ndarray:
+        """
+        Quadratic design matrix for the displacements dx (one row per point).
+        """
+        iu = np.triu_indices(self.N)
+        quad = (dx[:, :, np.newaxis] * dx[:, np.newaxis, :])[:, iu[0], iu[1]]
+        return np.hstack([np.ones((dx.shape[0], 1)), dx, quad])
+
+    def predict(self, x: np.ndarray):
+        """
+        Predict the cost function at x.
+
+        Returns
+        -------
+        mean : float
+            Predicted value of the cost function (nan if there are not yet
+            enough points for a fit).
+        sigma : float
+            Standard uncertainty of the prediction (inf if there are not yet
+            enough points for a fit).
+        """
+        # At least two residual degrees of freedom are needed to estimate the
+        # uncertainty.
+        if len(self.fs) < self.ncoef + 2:
+            return np.nan, np.inf
+        xs, fs = np.array(self.xs), np.array(self.fs)
+        # Centre the model on x, so that the prediction is the constant term.
+        dx = xs - x
+        nearest = np.argsort(np.sum(dx ** 2, axis=1))[:self.nlocal]
+        A = self.features(dx[nearest])
+        coef, _, rank, _ = np.linalg.lstsq(A, fs[nearest], rcond=None)
+        if rank < self.ncoef:
+            return np.nan, np.inf
+        dof = len(nearest) - self.ncoef
+        s2 = np.sum((A @ coef - fs[nearest]) ** 2) / dof
+        # Leverage of the prediction point, i.e. [(A^T A)^-1]_00 since the
+        # features of x itself are [1, 0, ..., 0].
+        leverage = np.linalg.pinv(A.T @ A)[0, 0]
+        return coef[0], np.sqrt(s2 * (1 + leverage))
+
+
 # Custom exceptions.
 class MaxFevalsReached(Exception):
     pass
@@ -246,51 +322,76 @@ class MaxItersReached(Exception):
     pass
 
 
-def deco_count(fn):
+class OptimisationCancelled(Exception):
+    pass
+
+
+class RunContext():
     """
-    Decorator which counts the number of times a function has been called, as
-    long as the function does not return np.inf. This makes sure that
-    acquire_esr.calls is not incremented when an out-of-bounds value is
-    "sampled".
+    State of one optimisation run, passed to the optimiser as the cost
+    function: it evaluates the wrapped function and holds the number of
+    evaluations (the 'calls' attribute read by the optimisers), the budget
+    and the history of the evaluated points.
+
+    As a new RunContext is created for each run, several optimisations can run
+    concurrently in the same process (e.g. simulated ones in threads).
     """
-    @wraps(fn)
-    def counter(*args, **kwargs):
-        result = fn(*args, **kwargs)
-        if result != np.inf:
-            counter.calls += 1
+
+    def __init__(self, fn: callable, maxfev: int = 0, cancel=None):
+        """
+        Initialise a RunContext object.
+
+        Parameters
+        ----------
+        fn : function
+            Cost function of the run, taking the point to evaluate and the
+            optimiser args.
+        maxfev : int, default 0
+            Maximum number of function evaluations, after which
+            MaxFevalsReached is raised. 0 means no limit.
+        cancel : threading.Event, default None
+            Event which, once set, stops the run before the next evaluation
+            (OptimisationCancelled is raised).
+        """
+        self.fn = fn
+        self.maxfev = maxfev
+        self.cancel = cancel
+        self.calls = 0
+        self.history = []
+        # (the attributes of fn, e.g. of a wrapped RunContext, are not copied)
+        update_wrapper(self, fn, updated=())
+
+    def __call__(self, x: np.ndarray, *args, **kwargs) -> float:
+        self.check_cancelled()
+        if self.exhausted:
+            raise MaxFevalsReached
+        result = self.fn(x, *args, **kwargs)
+        self.record(x, result)
         return result
-    counter.calls = 0
-    return counter
 
+    def record(self, x: np.ndarray, f: float) -> None:
+        """
+        Count an evaluation made outside of __call__() (e.g. by a batch
+        evaluation). np.inf values (out-of-bounds points, which are not
+        acquired) are not counted.
+        """
+        if f != np.inf:
+            self.calls += 1
+            self.history.append((np.array(x, dtype=float), f))
+
+    def check_cancelled(self) -> None:
+        """
+        Raise OptimisationCancelled if the run has been cancelled.
+        """
+        if self.cancel is not None and self.cancel.is_set():
+            raise OptimisationCancelled("Optimisation cancelled.")
 
-def deco_maxfev(maxfev):
-    """
-    Decorator factory which returns a decorator that causes a function to raise
-    MaxFevalsReached if its number of calls is greater than maxfev.
-
-    Decorate with @deco_maxfev(MAXFEVS), or in order to set maxfev dynamically
-    (as is needed in POISE), do it using cf = deco_maxfev(MAXFEVS)(cf).
-
-    Note that we need to re-apply the counter on the counted_cf() function.
-    If we don't do this, then the *inner* function (i.e. "fn") will have a
-    'calls' attribute, but the *outer* function will not. So if we decorate a
-    cost function with cf = deco_maxfev(MAXFEVS)(cf), cf.calls will stop to
-    work. By re-applying the counter on the outside function, we make sure that
-    the decorated function always has a valid 'calls' attribute.
-    """
-    def decorator(fn):
-        @wraps(fn)
-        def counted_cf(*args, **kwargs):
-            if fn.calls >= maxfev:
-                raise MaxFevalsReached
-            else:
-                result = fn(*args, **kwargs)
-                if result != np.inf:
-                    counted_cf.calls += 1
-                return result
-        counted_cf.calls = 0
-        return counted_cf
-    return decorator
+    @property
+    def exhausted(self) -> bool:
+        """
+        Whether the budget of function evaluations has been used.
+        """
+        return self.maxfev > 0 and self.calls >= self.maxfev
 
 
 class OptResult:
@@ -316,7 +417,10 @@ def nelder_mead(cf: callable,
                 maxfev: int = 0,
                 simplex_method: str = "spendley",
                 seed=None,
-                nfactor: int = 10):
+                nfactor: int = 10,
+                surrogate: bool = False,
+                confidence: float = 2.0,
+                prefetch: callable = None):
     """
     Nelder-Mead optimiser, as described in Section 8.1 of Kelley, "Iterative
     Methods for Optimization".
@@ -326,8 +430,9 @@ def nelder_mead(cf: callable,
     cf : function
         The cost function. For POISE, this means acquire_esr(), not the
         user-defined cost function. However in general, this can be any cost
-        function. The cost function *must* be decorated with deco_count() (for
-        POISE, this is already done).
+        function (for POISE, a RunContext wrapping acquire_esr()). Its
+        evaluations are counted, and limited to maxfev, by wrapping it in a
+        RunContext.
     x0 : ndarray or list
         Initial point for optimisation. This should already be scaled.
     xtol : ndarray or list
@@ -354,6 +459,24 @@ def nelder_mead(cf: callable,
         Ratio of initial simplex length to the tolerance (i.e. this guides how
         large the initial search region is). Note that this is applied to all
         parameters at once.
+    surrogate : bool, default False
+        Whether to maintain a local quadratic model of all evaluations (see
+        QuadraticSurrogate). Reflection, expansion and contraction points
+        which the model confidently predicts to be rejected are then decided
+        without evaluating the cost function.
+    confidence : float, default 2.0
+        Only used if surrogate is True. Number of standard uncertainties by
+        which the predicted cost function must exceed the acceptance
+        threshold for a point to be rejected without evaluation. Larger
+        values skip fewer evaluations, but are less likely to make a wrong
+        decision.
+    prefetch : function, optional
+        Function called with a list of (scaled) points which are likely to be
+        evaluated next: the initial simplex, then at the start of each
+        iteration the reflection, expansion and contraction points, and the
+        points of a shrunk simplex. This allows expensive preparation of the
+        next points (e.g. pulse shape synthesis in a callback) to run while
+        the current point is being acquired.
 
     Returns
     -------
@@ -366,6 +489,8 @@ def nelder_mead(cf: callable,
                                 the specific context of ESR optimisation, this
                                 is in general not equal to the number of
                                 experiments acquired.
+            nskip (int)       : Number of evaluations skipped thanks to the
+                                surrogate model (0 if surrogate is False).
             simplex (ndarray) : (N+1, N)-sized matrix of the final simplex.
             fvals (ndarray)   : List of corresponding cost functions at each
                                 point of the simplex.
@@ -390,8 +515,8 @@ def nelder_mead(cf: callable,
     maxiter = 500 * N
     if maxfev <= 0:
         maxfev = 500 * N
-    # Decorate the cost function to raise MaxFevalsReached
-    cf = deco_maxfev(maxfev)(cf)
+    # Count the evaluations, and raise MaxFevalsReached after maxfev
+    cf = RunContext(cf, maxfev=maxfev)
 
     # Check length of xtol
     if len(x0) != len(xtol):
@@ -414,10 +539,41 @@ def nelder_mead(cf: callable,
     mu_r = 1       # Reflect parameter
     mu_e = 2       # Expansion parameter
 
-    # Helper function.
+    # Surrogate model of the cost function, and number of skipped evaluations.
+    model = QuadraticSurrogate(N) if surrogate else None
+    nskip = 0
+
+    # Helper functions.
     def xnew(mu, sim):
         return ((1 + mu) * sim.xbar()) - (mu * sim.xworst())
 
+    def announce(xs):
+        if prefetch is not None:
+            prefetch(xs)
+
+    def evaluate(x):
+        f = cf(x, *args)
+        if model is not None:
+            model.add(x, f)
+        return f
+
+    def rejected(x, fref):
+        """
+        Whether the surrogate model confidently predicts that the cost
+        function at x is not lower than fref, in which case x does not need to
+        be evaluated. Out-of-bounds points are never skipped, since they do
+        not require any acquisition.
+        """
+        nonlocal nskip
+        if (model is None
+                or np.any(x < scaled_lb) or np.any(x > scaled_ub)):
+            return False
+        mean, sigma = model.predict(x)
+        if mean - confidence * sigma >= fref:
+            nskip += 1
+            return True
+        return False
+
     def converged(sim, xtol):
         """
         Convergence criteria. To be converged, each dimension of the simplex
@@ -439,8 +595,9 @@ def nelder_mead(cf: callable,
     try:
         # Evaluate the cost function for the initial simplex.
         # Steps 1 and 2 in Algorithm 8.1.1
+        announce(list(sim.x))
         for i in range(N + 1):
-            sim.f[i] = cf(sim.x[i], *args)
+            sim.f[i] = evaluate(sim.x[i])
             # Sort simplex
             sim.sort()
 
@@ -458,9 +615,17 @@ def nelder_mead(cf: callable,
 
             # Step 3(a)
             x_r = xnew(mu_r, sim)  # shorthand for x(mu_r)
-            f_r = cf(x_r, *args)
-            iter_xs.append(x_r)
-            iter_fs.append(f_r)
+            # The simplex has just been updated (or evaluated): the
+            # reflection is known, and the next point is either the
+            # expansion or one of the contractions, depending on f_r.
+            announce([x_r] + [xnew(mu, sim) for mu in (mu_e, mu_oc, mu_ic)])
+            if rejected(x_r, sim.f[N]):
+                # Skip straight to the inside contraction, Step 3(e).
+                f_r = np.inf
+            else:
+                f_r = evaluate(x_r)
+                iter_xs.append(x_r)
+                iter_fs.append(f_r)
 
             # Step 3(b): Reflect (+ 3g if needed)
             if sim.f[0] <= f_r and f_r < sim.f[N - 1]:
@@ -471,9 +636,12 @@ def nelder_mead(cf: callable,
             # Step 3(c): Expand (+ 3g if needed)
             if f_r < sim.f[0]:
                 x_e = xnew(mu_e, sim)
-                f_e = cf(x_e, *args)
-                iter_xs.append(x_e)
-                iter_fs.append(f_e)
+                if rejected(x_e, f_r):
+                    f_e = np.inf
+                else:
+                    f_e = evaluate(x_e)
+                    iter_xs.append(x_e)
+                    iter_fs.append(f_e)
                 if f_e < f_r:
                     sim.replace_worst(x_e, f_e)
                 else:
@@ -484,9 +652,12 @@ def nelder_mead(cf: callable,
             # Step 3(d): Outside contraction (+ 3f and 3g if needed)
             if sim.f[N - 1] <= f_r and f_r < sim.f[N]:
                 x_oc = xnew(mu_oc, sim)
-                f_c = cf(x_oc, *args)
-                iter_xs.append(x_oc)
-                iter_fs.append(f_c)
+                if rejected(x_oc, f_r):
+                    f_c = np.inf
+                else:
+                    f_c = evaluate(x_oc)
+                    iter_xs.append(x_oc)
+                    iter_fs.append(f_c)
                 if f_c <= f_r:
                     sim.replace_worst(x_oc, f_c)
                     sim.sort()  # Step 3(g)
@@ -495,17 +666,21 @@ def nelder_mead(cf: callable,
                     if cf.calls >= maxfev - N:             # Step 3(f)
                         raise MaxFevalsReached
                     sim.shrink()
+                    announce(list(sim.x[1:]))
                     for i in range(1, N + 1):
-                        sim.f[i] = cf(sim.x[i], *args)
+                        sim.f[i] = evaluate(sim.x[i])
                     sim.sort()  # Step 3(g)
                     continue
 
             # Step 3(e): Inside contraction (+ 3f and 3g if needed)
             if f_r >= sim.f[N]:
                 x_ic = xnew(mu_ic, sim)
-                f_c = cf(x_ic, *args)
-                iter_xs.append(x_ic)
-                iter_fs.append(f_c)
+                if rejected(x_ic, sim.f[N]):
+                    f_c = np.inf
+                else:
+                    f_c = evaluate(x_ic)
+                    iter_xs.append(x_ic)
+                    iter_fs.append(f_c)
                 if f_c < sim.f[N]:
                     sim.replace_worst(x_ic, f_c)
                     sim.sort()  # Step 3(g)
@@ -514,8 +689,9 @@ def nelder_mead(cf: callable,
                     if cf.calls >= maxfev - N:             # Step 3(f)
                         raise MaxFevalsReached
                     sim.shrink()
+                    announce(list(sim.x[1:]))
                     for i in range(1, N + 1):
-                        sim.f[i] = cf(sim.x[i], *args)
+                        sim.f[i] = evaluate(sim.x[i])
                     sim.sort()  # Step 3(g)
                     continue
         # END while loop
@@ -535,11 +711,36 @@ def nelder_mead(cf: callable,
         xbest, fbest = sim.x[0], sim.f[0]
 
     return OptResult(xbest=xbest, fbest=fbest,
-                     niter=niter, nfev=cf.calls,
+                     niter=niter, nfev=cf.calls, nskip=nskip,
                      simplex=sim.x, fvals=sim.f,
                      message=message)
 
 
+def surrogate_nelder_mead(cf: callable,
+                          x0: Union[list, np.ndarray],
+                          xtol: Union[list, np.ndarray],
+                          scaled_lb: np.ndarray,
+                          scaled_ub: np.ndarray,
+                          args: tuple = (),
+                          maxfev: int = 0,
+                          simplex_method: str = "spendley",
+                          seed=None,
+                          nfactor: int = 10,
+                          confidence: float = 2.0,
+                          prefetch: callable = None):
+    """
+    Surrogate-assisted Nelder-Mead optimiser. This is simply nelder_mead()
+    with surrogate=True; see nelder_mead() for a description of the
+    parameters and of the returned OptResult. The number of evaluations
+    skipped thanks to the surrogate model is stored as OptResult.nskip.
+    """
+    return nelder_mead(cf, x0, xtol, scaled_lb, scaled_ub, args=args,
+                       maxfev=maxfev, simplex_method=simplex_method,
+                       seed=seed, nfactor=nfactor,
+                       surrogate=True, confidence=confidence,
+                       prefetch=prefetch)
+
+
 def multid_search(cf: callable,
                   x0: Union[list, np.ndarray],
                   xtol: Union[list, np.ndarray],
@@ -559,8 +760,9 @@ def multid_search(cf: callable,
     cf : function
         The cost function. For POISE, this means acquire_esr(), not the
         user-defined cost function. However in general, this can be any cost
-        function. The cost function *must* be decorated with deco_count() (for
-        POISE, this is already done).
+        function (for POISE, a RunContext wrapping acquire_esr()). Its
+        evaluations are counted, and limited to maxfev, by wrapping it in a
+        RunContext.
     x0 : ndarray or list
         Initial point for optimisation. This should already be scaled.
     xtol : ndarray or list
@@ -615,8 +817,8 @@ def multid_search(cf: callable,
     maxiter = 500 * N
     if maxfev <= 0:
         maxfev = 500 * N
-    # Decorate cost function so that it raises MaxFevalsReached.
-    cf = deco_maxfev(maxfev)(cf)
+    # Count the evaluations, and raise MaxFevalsReached after maxfev
+    cf = RunContext(cf, maxfev=maxfev)
 
     # Check length of xtol
     if len(x0) != len(xtol):
@@ -786,6 +988,15 @@ def pybobyqa_interface(cf: callable,
                                 experiments acquired.
             message (str)     : Message indicating reason for termination.
     """
+    # Py-BOBYQA is imported on first use, as it pulls in scipy, and is an
+    # optional dependency.
+    try:
+        import pybobyqa as pb
+    except ImportError as e:
+        raise ImportError("Py-BOBYQA is required for the 'bobyqa' optimiser, "
+                          "install it with 'python -m pip install "
+                          "esrpoise[bobyqa]'") from e
+
     x0 = np.asfarray(x0).flatten()
     # Calculate maxfev
     N = x0.size
@@ -831,7 +1042,8 @@ def brute_force(cf: callable,
                 scaled_ub: np.ndarray,
                 args: tuple = (),
                 maxfev: int = 0,
-                nfactor: float = None):
+                nfactor: float = None,
+                batch_cf: callable = None):
     """
     Brute force solver. Evaluate equally spaced points on an n-dimensional
     grid and returns the best of these.
@@ -858,6 +1070,11 @@ def brute_force(cf: callable,
         Maximum number of function evaluations. Defaults to 0, i.e. no limit.
     nfactor : float, default None
         Not applicable, ignored.
+    batch_cf : function, optional
+        Function which takes an array of points (one per row) and returns
+        the cost function at each point. If given, it is used instead of cf
+        to evaluate all the points at once (e.g. with
+        pipeline.PipelinedEvaluator).
 
     Returns
     -------
@@ -891,12 +1108,26 @@ def brute_force(cf: callable,
              " that each element of xtol cleanly divides the corresponding"
              " element of (ub - lb).")
 
+    # Evaluate all the points at once
+    if batch_cf is not None:
+        xs = np.array(list(itertools.product(*linspaces)))
+        message = MESSAGE_OPT_SUCCESS
+        if maxfev > 0 and len(xs) > maxfev:
+            xs = xs[:maxfev]
+            message = MESSAGE_OPT_MAXFEV_REACHED
+        fs = np.asarray(batch_cf(xs), dtype=float)
+        ibest = np.argmin(fs)
+        return OptResult(xbest=xs[ibest], fbest=fs[ibest],
+                         niter=len(fs), nfev=len(fs),
+                         message=message)
+
     # Evaluate cost function at every element of the Cartesian product of
     # linspaces
+    cf = RunContext(cf, maxfev=maxfev)
     fbest, xbest = np.inf, None
     for x in itertools.product(*linspaces):
         x = np.array(x)
-        if maxfev > 0 and cf.calls >= maxfev:
+        if cf.exhausted:
             message = MESSAGE_OPT_MAXFEV_REACHED
             break
         f = cf(x, *args)
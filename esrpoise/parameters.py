@@ -0,0 +1,375 @@
+"""
+parameters.py
+-------------
+
+Registry of the built-in Xepr parameters which can be optimised directly
+(i.e. without a .def file or a callback), with their location in Xepr and
+their hardware characteristics.
+
+Other parameters (e.g. of another bridge) can be declared with
+``register_parameter()`` before calling ``optimise()``::
+
+    register_parameter("ELDORFreqStart", "ftEpr.ELDORFreqStart",
+                       layer=None, min_step=1e-6)
+
+SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+
+import bisect
+from typing import Dict, List, NamedTuple
+from warnings import warn
+
+from .clock import get_clock
+
+# Polling of the monitored values (cf. settle())
+POLL_INTERVAL = 0.2  # s
+POLL_TIMEOUT = 10    # s
+
+
+class BuiltinParameter(NamedTuple):
+    """
+    Metadata of a built-in Xepr parameter.
+
+    Attributes
+    ----------
+    name : str
+        Name used in optimise(), e.g. "Attenuation".
+    path : str
+        Xepr parameter, e.g. "ftBridge.Attenuation".
+    layer : str or None
+        Xepr experiment (layer) holding the parameter, e.g. "AcqHidden" for
+        the bridge parameters. None for the current experiment.
+    min_step : float or None
+        Smallest change the hardware can apply (i.e. minimum sensible
+        tolerance), None if unknown.
+    settle_time : float
+        Time (s) the hardware needs to settle after the parameter changed.
+    monitor : str or None
+        Monitored value of the current experiment (e.g. "FrequencyMon"),
+        polled after settle_time until it is stable. None for no polling.
+    monitor_tol : float
+        Maximum change of the monitored value between two polls for it to be
+        considered stable.
+    """
+    name: str
+    path: str
+    layer: str = "AcqHidden"
+    min_step: float = None
+    settle_time: float = 0.
+    monitor: str = None
+    monitor_tol: float = 0.
+
+
+BUILTIN_PARAMETERS: Dict[str, BuiltinParameter] = {}
+
+
+def register_parameter(name: str, path: str, layer: str = "AcqHidden",
+                       min_step: float = None, settle_time: float = 0.,
+                       monitor: str = None,
+                       monitor_tol: float = 0.) -> BuiltinParameter:
+    """
+    Declare a built-in parameter, or replace the declaration of an existing
+    one.
+
+    Parameters
+    ----------
+    name : str
+        Name used in optimise(). It should not contain '&' (user parameters).
+    path : str
+        Xepr parameter, e.g. "ftBridge.Attenuation".
+    layer : str or None, default "AcqHidden"
+        Xepr experiment (layer) holding the parameter, None for the current
+        experiment.
+    min_step : float, default None
+        Smallest change the hardware can apply, None if unknown.
+    settle_time : float, default 0
+        Time (s) the hardware needs to settle after the parameter changed.
+    monitor : str, default None
+        Monitored value of the current experiment (e.g. "FrequencyMon"),
+        polled after settle_time until it is stable.
+    monitor_tol : float, default 0
+        Maximum change of the monitored value between two polls for it to be
+        considered stable.
+
+    Returns
+    -------
+    BuiltinParameter
+        The registered parameter.
+    """
+    if "&" in name:
+        raise ValueError("Built-in parameter names cannot contain '&'.")
+    par = BuiltinParameter(name, path, layer, min_step, settle_time,
+                           monitor, monitor_tol)
+    BUILTIN_PARAMETERS[name] = par
+    return par
+
+
+def is_builtin(name: str) -> bool:
+    """
+    Whether name is a registered built-in parameter.
+    """
+    return name in BUILTIN_PARAMETERS
+
+
+def experiment_name(xepr) -> str:
+    """
+    Name of the current Xepr experiment.
+    """
+    return xepr.XeprExperiment().aqGetExpName()
+
+
+def set_parameters(xepr, values: dict, exp_name: str = None,
+                   wait: bool = True) -> str:
+    """
+    Set several built-in parameters in Xepr.
+
+    Each parameter is sent with its own aqParSet call: XeprAPI has no command
+    setting several parameters at once, and Xepr applies each aqParSet to
+    the hardware immediately (there is no deferred refresh to share). What
+    is shared is the name of the current experiment, queried at most once
+    (if needed and not given), and the wait for the parameters to settle,
+    done once for all of them (cf. settle()).
+
+    Parameters
+    ----------
+    xepr : instance of XeprAPI.Xepr
+        The instantiated Xepr object.
+    values : dict
+        Value (str) of each built-in parameter, keyed by name.
+    exp_name : str, default None
+        Name of the current experiment, e.g. cached by main.ParamState.
+    wait : bool, default True
+        Whether to wait for the parameters to settle.
+
+    Returns
+    -------
+    exp_name : str or None
+        Name of the current experiment: exp_name, or the name queried if it
+        was needed (so that it can be cached).
+    """
+    pars = []
+    for name in values:
+        try:
+            pars.append(BUILTIN_PARAMETERS[name])
+        except KeyError:
+            raise ValueError(f"{name} is not a built-in parameter.")
+
+    for par, v_str in zip(pars, values.values()):
+        layer = par.layer
+        if layer is None:
+            if exp_name is None:
+                exp_name = experiment_name(xepr)
+            layer = exp_name
+        # aqParSet does not accept numpy strings
+        xepr.XeprCmds.aqParSet(layer, par.path, str(v_str))
+    if wait:
+        settle(xepr, list(values))
+    return exp_name
+
+
+def settle(xepr, names: List[str]) -> None:
+    """
+    Wait for the hardware to settle after built-in parameters changed.
+
+    The parameters settle simultaneously: the longest of their settle times
+    is waited, then their monitored values are polled every POLL_INTERVAL
+    until two successive values differ by at most monitor_tol (a warning is
+    issued after POLL_TIMEOUT).
+
+    Parameters
+    ----------
+    xepr : instance of XeprAPI.Xepr
+        The instantiated Xepr object.
+    names : list of str
+        Names of the built-in parameters which changed.
+
+    Returns
+    -------
+    None
+    """
+    pars = [BUILTIN_PARAMETERS[name] for name in names]
+    clock = get_clock()
+    settle_time = max([par.settle_time for par in pars], default=0)
+    if settle_time > 0:
+        clock.sleep(settle_time)
+
+    monitors = {par.monitor: par.monitor_tol for par in pars
+                if par.monitor is not None}
+    if not monitors:
+        return
+    experiment = xepr.XeprExperiment()
+
+    def read():
+        return {monitor: float(experiment[monitor].value)
+                for monitor in monitors}
+
+    previous = read()
+    deadline = clock.time() + POLL_TIMEOUT
+    while True:
+        clock.sleep(POLL_INTERVAL)
+        current = read()
+        if all(abs(current[monitor] - previous[monitor]) <= tol
+               for monitor, tol in monitors.items()):
+            return
+        if clock.time() >= deadline:
+            warn(f"{list(monitors)} not stable after {POLL_TIMEOUT} s.")
+            return
+        previous = current
+
+
+def read_parameters(xepr, names: List[str], exp_name: str = None) -> dict:
+    """
+    Read back the values of built-in parameters applied by Xepr.
+
+    Parameters
+    ----------
+    xepr : instance of XeprAPI.Xepr
+        The instantiated Xepr object.
+    names : list of str
+        Names of the built-in parameters.
+    exp_name : str, default None
+        Name of the current experiment, queried if needed and None.
+
+    Returns
+    -------
+    values : dict
+        Value (float) of each parameter, keyed by name.
+    """
+    experiments = dict()
+    values = dict()
+    for name in names:
+        par = BUILTIN_PARAMETERS[name]
+        layer = par.layer
+        if layer is None:
+            if exp_name is None:
+                exp_name = experiment_name(xepr)
+            layer = exp_name
+        if layer not in experiments:
+            experiments[layer] = xepr.XeprExperiment(layer)
+        values[name] = float(experiments[layer][par.path].value)
+    return values
+
+
+class Quantisation():
+    """
+    Quantisation of the built-in parameters by the hardware (e.g. the MPFU
+    amplitudes and phases are rounded by Xepr to about 0.049%, non-linearly),
+    learned from the values read back from Xepr.
+
+    The quantisers are assumed to be monotonic: a requested value lying
+    between two requested values which gave the same effective value is
+    predicted to give it too. The cost function values are cached by
+    effective setting (cf. main.acquire_esr()), so that requested values
+    which map to the same hardware setting are only acquired once.
+    """
+
+    def __init__(self):
+        self.requested = dict()  # name -> sorted requested values
+        self.effective = dict()  # name -> corresponding effective values
+        self.costs = dict()      # effective setting -> cost function value
+        self.hits = 0            # evaluations answered from self.costs
+
+    def learn(self, name: str, requested: float, effective: float) -> None:
+        """
+        Record the effective value of a requested value.
+        """
+        requested_values = self.requested.setdefault(name, [])
+        effective_values = self.effective.setdefault(name, [])
+        i = bisect.bisect_left(requested_values, requested)
+        if i < len(requested_values) and requested_values[i] == requested:
+            effective_values[i] = effective
+        else:
+            requested_values.insert(i, requested)
+            effective_values.insert(i, effective)
+
+    def predict(self, name: str, requested: float) -> float:
+        """
+        Predicted effective value of a requested value, None if unknown.
+        """
+        requested_values = self.requested.get(name, [])
+        effective_values = self.effective.get(name, [])
+        i = bisect.bisect_left(requested_values, requested)
+        if i < len(requested_values) and requested_values[i] == requested:
+            return effective_values[i]
+        if 0 < i < len(requested_values) and \
+                effective_values[i - 1] == effective_values[i]:
+            return effective_values[i]
+        return None
+
+    def snap(self, values: dict) -> dict:
+        """
+        Predicted effective values (None if unknown) of requested values
+        keyed by parameter name.
+        """
+        return {name: self.predict(name, value)
+                for name, value in values.items()}
+
+    def read(self, xepr, values: dict, exp_name: str = None) -> dict:
+        """
+        Read back the effective values of the requested values just applied
+        (keyed by parameter name), and learn them.
+        """
+        effective = read_parameters(xepr, list(values), exp_name)
+        for name, value in values.items():
+            self.learn(name, value, effective[name])
+        return effective
+
+    def setting(self, pars: List[str], val_str: List[str],
+                effective: dict):
+        """
+        Key of an effective setting for the cost function cache: effective
+        values of the built-in parameters and values of the other
+        parameters. None if an effective value is unknown.
+        """
+        setting = []
+        for par, v_str in zip(pars, val_str):
+            if par in effective:
+                if effective[par] is None:
+                    return None
+                setting.append(effective[par])
+            else:
+                setting.append(v_str)
+        return tuple(setting)
+
+
+# Bridge - Receiver Unit
+# Video gain (dB), 0 to 48 (1MHz bandwidth)
+register_parameter("VideoGain", "ftBridge.VideoGain", min_step=6,
+                   settle_time=0.1)
+# High power attenuation (dB)
+register_parameter("Attenuation", "ftBridge.Attenuation", min_step=0.01,
+                   settle_time=0.1)
+# Signal phase (~0.129 deg)
+register_parameter("SignalPhase", "cwBridge.SignalPhase", min_step=1)
+# Transmitter level (%)
+register_parameter("TMLevel", "ftBridge.TMLevel", min_step=0.049)
+
+# Bridge - MPFU control
+# (%), 0 to 100, rounded in Xepr to closest 0.049 (approximately, not linear)
+# +<x> Phase
+register_parameter("BrXPhase", "ftBridge.BrXPhase", min_step=0.049)
+# +<x> Amplitude
+register_parameter("BrXAmp", "ftBridge.BrXAmp", min_step=0.049)
+# +<y> Phase
+register_parameter("BrYPhase", "ftBridge.BrYPhase", min_step=0.049)
+# +<y> Amplitude
+register_parameter("BrYAmp", "ftBridge.BrYAmp", min_step=0.049)
+# -<x> Phase
+register_parameter("BrMinXPhase", "ftBridge.BrMinXPhase", min_step=0.049)
+# -<x> Amplitude
+register_parameter("BrMinXAmp", "ftBridge.BrMinXAmp", min_step=0.049)
+# -<y> Phase
+register_parameter("BrMinYPhase", "ftBridge.BrMinYPhase", min_step=0.049)
+# -<y> Amplitude
+register_parameter("BrMinYAmp", "ftBridge.BrMinYAmp", min_step=0.049)
+
+# FT EPR Parameters
+# Field position (G), variation around expected value
+register_parameter("CenterField", "fieldCtrl.CenterField", layer=None,
+                   min_step=0.05, settle_time=1)
+
+# Bridge - Microwave frequency (GHz), polled until the frequency counter is
+# stable to 1 kHz
+register_parameter("Frequency", "cwBridge.Frequency", settle_time=1,
+                   monitor="FrequencyMon", monitor_tol=1e-6)
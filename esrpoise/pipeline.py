@@ -0,0 +1,128 @@
+"""
+pipeline.py
+-----------
+
+Pipelined evaluation of a sequence of points known in advance (e.g. the grid
+of the brute-force optimiser).
+
+Instead of strictly alternating parameter setup, acquisition, cost function
+evaluation and logging, ``PipelinedEvaluator`` starts each acquisition without
+waiting for it to finish. While the spectrometer acquires point k, the cost
+function and logging of point k-1 run on a worker thread, and the file edits
+for point k+1 are prepared, so that the total time approaches the pure
+acquisition time.
+
+SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+from typing import List
+
+import numpy as np
+
+from . import xepr_link
+from .costfunctions import DatasetView
+
+
+class DataSnapshot():
+    """
+    Copy of the data of an acquisition, which is not modified by the next
+    acquisitions (unlike the dataset object returned by XeprAPI). It has the
+    same attributes of interest as XeprAPI.Dataset.
+    """
+
+    def __init__(self, data):
+        # setattr() as pycodestyle objects to the XeprAPI attribute name
+        setattr(self, "O", np.array(data.O))
+        self.X = np.array(data.X)
+
+
+class PipelinedEvaluator():
+    """
+    Evaluate the cost function for a sequence of points, overlapping the
+    acquisition of each point with the processing of the previous one.
+    """
+
+    def __init__(self, xepr, setup: callable, cost_function: callable,
+                 stage: callable = None, record: callable = None,
+                 poll_interval: float = 0.01):
+        """
+        Initialise a PipelinedEvaluator object.
+
+        Parameters
+        ----------
+        xepr : instance of XeprAPI.Xepr
+            The instantiated Xepr object.
+        setup : function
+            Function ``setup(point)`` which sets the parameter values of a
+            point in Xepr (e.g. main.param_set()).
+        cost_function : function
+            A function which takes the data object and returns a float. It is
+            run on a worker thread.
+        stage : function, default None
+            Function ``stage(point)`` which prepares the setup of a point
+            while the previous point is being acquired (e.g. writes the .def
+            file without compiling it). It must not modify the running
+            experiment.
+        record : function, default None
+            Function ``record(point, data, cf_val)`` called on the worker
+            thread after the cost function, in the order of the points (e.g.
+            logging, persistence of the data).
+        poll_interval : float, default 0.01
+            Time between two checks of the experiment state (s).
+        """
+        self.xepr = xepr
+        self.setup = setup
+        self.cost_function = cost_function
+        self.stage = stage
+        self.record = record
+        self.poll_interval = poll_interval
+
+    def score(self, point: np.ndarray, data: DatasetView) -> float:
+        """
+        Evaluate the cost function for a point and record it.
+        """
+        cf_val = self.cost_function(data)
+        if self.record is not None:
+            self.record(point, data, cf_val)
+        return cf_val
+
+    def evaluate(self, points: List[np.ndarray]) -> List[float]:
+        """
+        Acquire the data and evaluate the cost function for each point.
+
+        Parameters
+        ----------
+        points : list of ndarray
+            Parameter values of each point, as passed to setup().
+
+        Returns
+        -------
+        cf_vals : list of float
+            Value of the cost function for each point.
+        """
+        futures = []
+        # A single worker keeps the processing (and logging) in order.
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            for k, point in enumerate(points):
+                self.setup(point)
+                xepr_link.run_exp(self.xepr)
+
+                # while the spectrometer is acquiring
+                if self.stage is not None and k + 1 < len(points):
+                    self.stage(points[k + 1])
+                # (the previous point is being processed by the worker)
+
+                xepr_link.wait_exp(self.xepr, self.poll_interval)
+                data = DatasetView(DataSnapshot(xepr_link.get_data(self.xepr)))
+                # (in the context of the caller, e.g. its clock)
+                futures.append(executor.submit(
+                    contextvars.copy_context().run, self.score, point, data))
+
+                # raise errors from the worker without waiting for the end
+                if k > 0 and futures[k - 1].done():
+                    futures[k - 1].result()
+
+            return [future.result() for future in futures]
@@ -0,0 +1,187 @@
+"""
+replay.py
+---------
+
+Offline replay of recorded acquisitions (cf. archive.py): ``ReplayXepr`` can be
+passed instead of the XeprAPI.Xepr object to ``optimise()``, and answers each
+acquisition with the recorded trace nearest to the parameters set, or with a
+multilinear interpolation of the traces of a brute-force grid. Optimisers,
+tolerances and cost functions can then be compared without spectrometer time.
+
+SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+
+import itertools
+
+import numpy as np
+
+from .archive import ArchiveReader
+from .parameters import BUILTIN_PARAMETERS
+from .simulator import SimulatedDataset, SimulatedXepr
+
+
+class ReplayXepr(SimulatedXepr):
+    """
+    Simulated Xepr backend returning recorded traces.
+    """
+
+    def __init__(self, archive, method: str = "nearest",
+                 exp_name: str = "AWGTransient", acq_time: float = 0):
+        """
+        Initialise a ReplayXepr object.
+
+        Parameters
+        ----------
+        archive : str or archive.ArchiveReader
+            Archive (or path of the archive file) of the recorded
+            acquisitions. Its parameter names are those passed to optimise(),
+            and must all be set during the replayed optimisations.
+        method : str from {"nearest", "linear"}, default "nearest"
+            "nearest" returns the recorded trace whose parameter values are
+            the nearest (each parameter being normalised by its recorded
+            range). "linear" interpolates between the traces of a complete
+            brute-force grid, values outside of the grid being clamped to
+            it.
+        exp_name : str, default "AWGTransient"
+            Name of the experiment.
+        acq_time : float, default 0
+            Duration of each experiment run (s).
+
+        Notes
+        -----
+        User parameters (starting with &) are not seen by Xepr: pass
+        ``callback=replay.callback`` to optimise() so that their values are
+        passed to the replay.
+        """
+        if isinstance(archive, str):
+            archive = ArchiveReader(archive)
+        if len(archive) == 0:
+            raise ValueError("The archive does not contain any record.")
+        if method not in ["nearest", "linear"]:
+            raise ValueError(f"Invalid method {method} specified. Allowed"
+                             " values are: ['nearest', 'linear']")
+        self.archive = archive
+        self.method = method
+        self.values = np.asarray(archive.values, dtype=float)
+        self.user_params = dict()
+        self.last_x = None
+
+        # normalisation of the distances for the nearest neighbour lookup
+        extent = np.ptp(self.values, axis=0)
+        self.extent = np.where(extent > 0, extent, 1)
+
+        if method == "linear":
+            self.axes, self.grid = grid_index(self.values)
+
+        super().__init__(self.replay, exp_name=exp_name, acq_time=acq_time)
+
+    def callback(self, pars_dict: dict, *args) -> None:
+        """
+        Callback function recording the values of the user parameters.
+        """
+        self.user_params.update({par: value for par, value
+                                 in pars_dict.items() if "&" in par})
+
+    @staticmethod
+    def key(par: str) -> str:
+        """
+        Name under which an archived parameter is found among the current
+        parameters, resolved as in param_set(): the Xepr parameter of a
+        built-in parameter (cf. parameters.BUILTIN_PARAMETERS), the name of a
+        user parameter or of a .def file variable otherwise.
+        """
+        if "&" not in par and par in BUILTIN_PARAMETERS:
+            return BUILTIN_PARAMETERS[par].path.lstrip("*")
+        return par
+
+    def point(self, params: dict) -> np.ndarray:
+        """
+        Values of the archived parameters among the current parameters.
+        """
+        keys = [self.key(par) for par in self.archive.pars]
+        if len(set(keys)) < len(keys):
+            raise ValueError(f"The archived parameters {self.archive.pars}"
+                             " do not resolve to distinct parameters.")
+        point = []
+        for par, key in zip(self.archive.pars, keys):
+            if "&" in par:
+                if par not in self.user_params:
+                    raise KeyError(f"Parameter {par} has not been passed to"
+                                   " the replay callback.")
+                point.append(self.user_params[par])
+            elif key in params:
+                point.append(params[key])
+            else:
+                raise KeyError(f"Parameter {par} ({key}) has not been set.")
+        return np.asarray(point, dtype=float)
+
+    def replay(self, params: dict) -> np.ndarray:
+        """
+        Response function: recorded trace for the current parameters.
+        """
+        point = self.point(params)
+        if self.method == "nearest":
+            i = np.argmin(np.sum(((self.values - point) / self.extent) ** 2,
+                                 axis=1))
+            data = self.archive[i]
+            self.last_x = np.array(data.X)
+            return np.array(data.O)
+
+        # multilinear interpolation between the 2**N surrounding grid points
+        lower, weights = [], []
+        for axis, value in zip(self.axes, point):
+            if axis.size == 1:
+                lower.append(0)
+                weights.append(0.)
+                continue
+            k = np.clip(np.searchsorted(axis, value) - 1, 0, axis.size - 2)
+            lower.append(k)
+            weights.append(np.clip((value - axis[k]) / (axis[k + 1] - axis[k]),
+                                   0, 1))
+        trace = 0
+        for corner in itertools.product([0, 1], repeat=len(self.axes)):
+            w = np.prod([wi if c else 1 - wi
+                         for c, wi in zip(corner, weights)])
+            if w == 0:
+                continue
+            index = tuple(min(k + c, axis.size - 1) for k, c, axis
+                          in zip(lower, corner, self.axes))
+            data = self.archive[self.grid[index]]
+            trace = trace + w * np.asarray(data.O)
+        self.last_x = np.array(data.X)
+        return trace
+
+    def XeprDataset(self) -> SimulatedDataset:
+        dataset = SimulatedDataset(self)
+        if self.last_x is not None and dataset.X is not None:
+            dataset.X = self.last_x
+        return dataset
+
+
+def grid_index(values: np.ndarray):
+    """
+    Index the records of a complete grid of parameter values.
+
+    Parameters
+    ----------
+    values : ndarray
+        Parameter values of each record, of shape (nrecords, npars).
+
+    Returns
+    -------
+    axes : list of ndarray
+        Sorted unique values of each parameter.
+    grid : ndarray of int
+        Record index for each grid point, of shape (len(axis) for axis in
+        axes).
+    """
+    axes = [np.unique(column) for column in values.T]
+    grid = np.full([axis.size for axis in axes], -1, dtype=int)
+    indices = tuple(np.searchsorted(axis, column)
+                    for axis, column in zip(axes, values.T))
+    grid[indices] = np.arange(values.shape[0])
+    if np.any(grid < 0):
+        raise ValueError("The recorded values do not form a complete grid,"
+                         " use method='nearest'.")
+    return axes, grid
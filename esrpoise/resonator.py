@@ -0,0 +1,459 @@
+"""
+resonator.py
+------------
+
+Analysis of resonator profiles recorded with nutation experiments (cf. e.g.
+scan.py and examples/xepr_link_resonator_profile): the nutation frequency is
+measured at each microwave frequency from the whole (frequency x nutation)
+matrix at once, with sub-bin peak interpolation, and the profile can be fitted
+with a Lorentzian model. The frequencies (GHz) and nutation frequencies (Hz)
+are in the format used for resonator compensation of shaped pulses (e.g. with
+mrpypulse).
+
+The fitted resonator also gives the coefficients of the first-order transfer
+function used to compensate shaped pulses (cf. examples/chorus_res_comp.py),
+and bounds around them, so that the compensation only needs a short
+optimisation polish::
+
+    profile = ResonatorProfile(f, nu1)
+    c, lb, ub = profile.compensation(fc=9.45, tres=0.625e-9)
+
+SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+
+from typing import Union
+
+import numpy as np
+
+INTERPOLATIONS = ["none", "parabolic", "sinc"]
+
+
+def nutation_frequencies(traces: np.ndarray, dt: float, window: float = 3.,
+                         zero_fill: int = 1,
+                         interpolation: str = "parabolic",
+                         oversampling: int = 16) -> np.ndarray:
+    """
+    Nutation frequency of each transient.
+
+    The transients are baseline corrected (mean removed), multiplied by an
+    exponential window and Fourier transformed together. The positive and
+    negative frequencies are added, so that the phase of the transients does
+    not matter, and the frequency of the maximum is interpolated.
+
+    Parameters
+    ----------
+    traces : ndarray
+        Nutation transients, one per row (or a single transient).
+    dt : float
+        Increment of the nutation pulse length (s).
+    window : float, default 3
+        Decay of the exponential window, exp(-window * t / t_max). 0 for no
+        window.
+    zero_fill : int, default 1
+        Zero-filling factor of the FFT.
+    interpolation : str from {"none", "parabolic", "sinc"}, default
+            "parabolic"
+        Peak interpolation: none (FFT bin of the maximum), parabola through
+        the maximum and its two neighbours, or maximum of the band-limited
+        (sinc) interpolation of the spectrum, i.e. of the Fourier transform
+        evaluated oversampling times more finely around the maximum.
+    oversampling : int, default 16
+        Oversampling of the sinc interpolation.
+
+    Returns
+    -------
+    ndarray
+        Nutation frequencies (Hz), one per transient.
+    """
+    if interpolation not in INTERPOLATIONS:
+        raise ValueError(f"Invalid interpolation {interpolation} specified."
+                         f" Allowed values are: {INTERPOLATIONS}")
+    traces = np.asarray(traces)
+    y = np.atleast_2d(traces).astype(complex)
+    n = y.shape[-1]
+    y = y - np.mean(y, axis=-1, keepdims=True)
+    if window:
+        y = y * np.exp(-window * np.linspace(0, 1, n))
+
+    # magnitude spectra, folded onto the positive frequencies
+    nfft = zero_fill * n
+    spectra = np.abs(np.fft.fft(y, nfft, axis=-1))
+    half = nfft // 2
+    folded = spectra[:, :half + 1].copy()
+    folded[:, 1:nfft - half] += spectra[:, :half:-1]
+    k = np.argmax(folded[:, 1:], axis=-1) + 1  # DC excluded
+    df = 1 / (nfft * dt)
+
+    if interpolation == "none":
+        nu = k * df
+    elif interpolation == "parabolic":
+        nu = (k + parabolic_peak(folded, k)) * df
+    else:
+        # Fourier transform evaluated around the maximum
+        offsets = np.linspace(-1, 1, 2 * oversampling + 1)
+        freqs = (k[:, None] + offsets) * df
+        t = np.arange(n) * dt
+        kernel = np.exp(-2j * np.pi * freqs[:, :, None] * t)
+        fine = np.abs(np.einsum("rfn,rn->rf", kernel, y)) \
+            + np.abs(np.einsum("rfn,rn->rf", kernel.conj(), y))
+        j = np.argmax(fine, axis=-1)
+        j = np.clip(j, 1, fine.shape[-1] - 2)
+        nu = (k + (offsets[j] + parabolic_peak(fine, j) / oversampling)) * df
+
+    return nu if traces.ndim > 1 else nu[0]
+
+
+def parabolic_peak(y: np.ndarray, k: np.ndarray) -> np.ndarray:
+    """
+    Offset (in samples, between -0.5 and 0.5) of the vertex of the parabola
+    through y[k - 1], y[k] and y[k + 1] for each row of y. The offset is 0 at
+    the edges.
+    """
+    rows = np.arange(y.shape[0])
+    inner = (k > 0) & (k < y.shape[-1] - 1)
+    km = np.where(inner, k - 1, k)
+    kp = np.where(inner, k + 1, k)
+    a, b, c = y[rows, km], y[rows, k], y[rows, kp]
+    denominator = a - 2 * b + c
+    with np.errstate(divide="ignore", invalid="ignore"):
+        offset = np.where(denominator != 0,
+                          0.5 * (a - c) / denominator, 0)
+    return np.clip(offset, -0.5, 0.5)
+
+
+def lorentzian(f: Union[float, np.ndarray], f0: float, q: float,
+               amplitude: float) -> np.ndarray:
+    """
+    Lorentzian resonator profile: nutation frequency of a resonator of
+    resonance frequency f0 and quality factor q,
+    amplitude / sqrt(1 + (2 q (f - f0) / f0)**2).
+    """
+    z = 2 * q * (np.asarray(f) - f0) / f0
+    return amplitude / np.sqrt(1 + z ** 2)
+
+
+def fit_lorentzian(f: np.ndarray, nu1: np.ndarray, maxiter: int = 50):
+    """
+    Least-squares fit of a Lorentzian resonator profile.
+
+    The initial guess comes from a quadratic fit of 1 / nu1**2, and is
+    refined with the Levenberg-Marquardt algorithm.
+
+    Parameters
+    ----------
+    f : ndarray
+        Microwave frequencies.
+    nu1 : ndarray
+        Nutation frequencies.
+    maxiter : int, default 50
+        Maximum number of Levenberg-Marquardt iterations.
+
+    Returns
+    -------
+    f0 : float
+        Resonance frequency (same unit as f).
+    q : float
+        Quality factor.
+    amplitude : float
+        Nutation frequency at f0 (same unit as nu1).
+    """
+    f = np.asarray(f, dtype=float)
+    nu1 = np.asarray(nu1, dtype=float)
+    if f.size < 3:
+        raise ValueError("At least three points are needed.")
+
+    # initial guess: 1 / nu1**2 is a parabola in f, weighted by nu1**2 so
+    # that the points near resonance dominate
+    a, b, c = np.polyfit(f, 1 / nu1 ** 2, 2, w=nu1 ** 2)
+    if a > 0:
+        f0 = -b / (2 * a)
+        amplitude = 1 / np.sqrt(max(c - b ** 2 / (4 * a), 1e-300))
+        q = np.sqrt(a) * amplitude * abs(f0) / 2
+    else:
+        f0, amplitude = f[np.argmax(nu1)], np.max(nu1)
+        q = f0 / np.ptp(f)
+    p = np.array([f0, q, amplitude], dtype=float)
+
+    def residuals(p):
+        return lorentzian(f, *p) - nu1
+
+    def jacobian(p):
+        f0, q, amplitude = p
+        z = 2 * q * (f - f0) / f0
+        u = (1 + z ** 2) ** -1.5
+        return np.stack([2 * amplitude * q * z * f / f0 ** 2 * u,
+                         -amplitude * z ** 2 / q * u,
+                         (1 + z ** 2) ** -0.5], axis=1)
+
+    damping = 1e-3
+    r = residuals(p)
+    cost = np.sum(r ** 2)
+    for _ in range(maxiter):
+        J = jacobian(p)
+        JTJ = J.T @ J
+        step = np.linalg.solve(JTJ + damping * np.diag(np.diag(JTJ)),
+                               -J.T @ r)
+        new_r = residuals(p + step)
+        new_cost = np.sum(new_r ** 2)
+        if new_cost < cost:
+            converged = cost - new_cost <= 1e-12 * cost
+            p, r, cost = p + step, new_r, new_cost
+            damping /= 10
+            if converged:
+                break
+        else:
+            damping *= 10
+    return p[0], abs(p[1]), p[2]
+
+
+def transfer_function(f: Union[float, np.ndarray], f0: float, q: float,
+                      amplitude: complex = 1.) -> np.ndarray:
+    """
+    First-order resonator transfer function at frequencies f,
+    amplitude / (1 + 2j q (f - f0) / f0), whose magnitude is lorentzian().
+    """
+    return amplitude / (1 + 2j * q * (np.asarray(f) - f0) / f0)
+
+
+def fit_transfer_function(f: np.ndarray, h: np.ndarray):
+    """
+    Least-squares fit of a first-order resonator transfer function to complex
+    responses (e.g. calibration echoes at different frequencies).
+
+    The fit is linear: h (1 + 2j q (f - f0) / f0) = amplitude is solved for
+    amplitude, 2 q / f0 and 2 q.
+
+    Parameters
+    ----------
+    f : ndarray
+        Microwave frequencies.
+    h : ndarray
+        Complex responses.
+
+    Returns
+    -------
+    f0 : float
+        Resonance frequency (same unit as f).
+    q : float
+        Quality factor.
+    amplitude : complex
+        Response at f0 (same unit as h).
+    """
+    f = np.asarray(f, dtype=float)
+    h = np.asarray(h, dtype=complex)
+    if f.size < 2:
+        raise ValueError("At least two points are needed.")
+    # h = amplitude - 1j (2 q / f0) f h + 1j (2 q) h
+    A = np.stack([np.ones_like(h), 1j * np.ones_like(h), -1j * f * h, 1j * h],
+                 axis=1)
+    A = np.concatenate([A.real, A.imag])
+    b = np.concatenate([h.real, h.imag])
+    re, im, beta, gamma = np.linalg.lstsq(A, b, rcond=None)[0]
+    return gamma / beta, abs(gamma) / 2, re + 1j * im
+
+
+def compensation_coefficients(f0: float, q: float, fc: float, tres: float,
+                              span: float = 100.) -> np.ndarray:
+    """
+    Coefficients of the resonator compensation of shaped pulses.
+
+    The response of the resonator to a pulse of carrier frequency fc,
+    normalised at fc, is modelled as
+    (1 + c3 + 1j c4) / (1 + s (c1 + 1j c2)), where s is the frequency offset
+    from fc scaled so that the bandwidth 1 / tres spans span (as in
+    compensate()).
+
+    Parameters
+    ----------
+    f0 : float
+        Resonance frequency (GHz).
+    q : float
+        Quality factor.
+    fc : float
+        Carrier frequency of the pulses (GHz).
+    tres : float
+        Time resolution of the pulses (s).
+    span : float, default 100
+        Scaled frequency range of the pulse spectra.
+
+    Returns
+    -------
+    ndarray
+        Coefficients [c1, c2, c3, c4].
+    """
+    detuning = 2 * q * (fc - f0) / f0
+    # 2j q / f0 / (1 + 1j detuning) per scaled frequency unit
+    g = 2 * q / (f0 * 1e9 * span * tres * (1 + detuning ** 2))
+    norm = np.sqrt(1 + detuning ** 2)
+    return np.array([g * detuning, g, 1 / norm - 1, -detuning / norm])
+
+
+def compensation_bounds(f0: float, q: float, fc: float, tres: float,
+                        span: float = 100., df0: float = None,
+                        q_rel: float = 0.25, npoints: int = 5):
+    """
+    Bounds of the resonator compensation coefficients, for an optimisation
+    polish around compensation_coefficients().
+
+    The bounds contain the coefficients of the resonators whose resonance
+    frequency and quality factor are within df0 and q_rel of f0 and q.
+
+    Parameters
+    ----------
+    f0, q, fc, tres, span
+        As in compensation_coefficients().
+    df0 : float, default None
+        Uncertainty of f0 (GHz). Defaults to an eighth of the resonator
+        bandwidth, f0 / (8 q).
+    q_rel : float, default 0.25
+        Relative uncertainty of q.
+    npoints : int, default 5
+        Number of values of f0 and q sampled within their uncertainties.
+
+    Returns
+    -------
+    lb : ndarray
+        Lower bounds of [c1, c2, c3, c4].
+    ub : ndarray
+        Upper bounds of [c1, c2, c3, c4].
+    """
+    if df0 is None:
+        df0 = f0 / (8 * q)
+    c = np.array([compensation_coefficients(f0_, q_, fc, tres, span)
+                  for f0_ in np.linspace(f0 - df0, f0 + df0, npoints)
+                  for q_ in np.linspace(q * (1 - q_rel), q * (1 + q_rel),
+                                        npoints)])
+    return c.min(axis=0), c.max(axis=0)
+
+
+def compensate(wfm: np.ndarray, c: Union[list, np.ndarray],
+               span: float = 100.) -> np.ndarray:
+    """
+    Compensate a pulse for the resonator response: the spectrum of the pulse
+    is divided by (1 + c3 + 1j c4) / (1 + s (c1 + 1j c2)), with s from
+    -span / 2 to span / 2 over the spectrum.
+
+    Parameters
+    ----------
+    wfm : ndarray
+        Complex waveform of the pulse (x + 1j y).
+    c : list or ndarray
+        Coefficients [c1, c2, c3, c4], e.g. from compensation_coefficients().
+    span : float, default 100
+        Scaled frequency range of the spectrum.
+
+    Returns
+    -------
+    ndarray
+        Compensated complex waveform.
+    """
+    s = np.linspace(-span / 2, span / 2, len(wfm))
+    h = (1 + c[2] + 1j * c[3]) / (1 + s * (c[0] + 1j * c[1]))
+    return np.fft.ifft(np.fft.ifftshift(np.fft.fftshift(np.fft.fft(wfm)) / h))
+
+
+class ResonatorProfile():
+    """
+    Nutation frequency as a function of the microwave frequency.
+    """
+
+    def __init__(self, f: np.ndarray, nu1: np.ndarray):
+        """
+        Initialise a ResonatorProfile object.
+
+        Parameters
+        ----------
+        f : ndarray
+            Microwave frequencies (GHz).
+        nu1 : ndarray
+            Nutation frequencies (Hz).
+        """
+        f = np.asarray(f, dtype=float)
+        order = np.argsort(f)
+        self.f = f[order]
+        self.nu1 = np.asarray(nu1, dtype=float)[order]
+        self.f0 = self.q = self.amplitude = None
+
+    @classmethod
+    def from_nutations(cls, f: np.ndarray, traces: np.ndarray, dt: float,
+                       **kwargs):
+        """
+        Resonator profile from nutation transients.
+
+        Parameters
+        ----------
+        f : ndarray
+            Microwave frequency (GHz) of each transient.
+        traces : ndarray
+            Nutation transients, one per row, e.g. from
+            archive.ArchiveReader.stack().
+        dt : float
+            Increment of the nutation pulse length (s).
+        **kwargs
+            Other arguments passed to nutation_frequencies().
+        """
+        return cls(f, nutation_frequencies(traces, dt, **kwargs))
+
+    def fit(self):
+        """
+        Fit the profile with a Lorentzian (cf. fit_lorentzian()), whose
+        parameters are stored in the attributes f0 (GHz), q and amplitude
+        (Hz).
+
+        Returns
+        -------
+        self
+        """
+        self.f0, self.q, self.amplitude = fit_lorentzian(self.f, self.nu1)
+        return self
+
+    def model(self, f: np.ndarray = None) -> np.ndarray:
+        """
+        Fitted Lorentzian profile at frequencies f (GHz), self.f if None.
+        """
+        if self.f0 is None:
+            self.fit()
+        return lorentzian(self.f if f is None else f,
+                          self.f0, self.q, self.amplitude)
+
+    def compensation(self, fc: float, tres: float, span: float = 100.,
+                     **kwargs):
+        """
+        Resonator compensation coefficients of the fitted profile and their
+        bounds (cf. compensation_coefficients() and compensation_bounds()).
+
+        Parameters
+        ----------
+        fc : float
+            Carrier frequency of the pulses (GHz).
+        tres : float
+            Time resolution of the pulses (s).
+        span : float, default 100
+            Scaled frequency range of the pulse spectra.
+        **kwargs
+            Other arguments passed to compensation_bounds().
+
+        Returns
+        -------
+        c : ndarray
+            Coefficients [c1, c2, c3, c4].
+        lb : ndarray
+            Lower bounds of the coefficients.
+        ub : ndarray
+            Upper bounds of the coefficients.
+        """
+        if self.f0 is None:
+            self.fit()
+        c = compensation_coefficients(self.f0, self.q, fc, tres, span)
+        lb, ub = compensation_bounds(self.f0, self.q, fc, tres, span,
+                                     **kwargs)
+        return c, lb, ub
+
+    def save(self, f_path: str, nu1_path: str) -> None:
+        """
+        Save the frequencies and nutation frequencies to text files (as
+        loaded for resonator compensation).
+        """
+        np.savetxt(f_path, self.f)
+        np.savetxt(nu1_path, self.nu1)
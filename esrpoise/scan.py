@@ -0,0 +1,182 @@
+"""
+scan.py
+-------
+
+Scans of Xepr parameters, e.g. resonator profiles or nutation maps: the
+experiment is run at each point of a 1D or 2D sweep, and each trace is
+streamed to an archive (cf. archive.py) as soon as it is acquired. An
+interrupted scan loses at most the point in progress, and is resumed by
+running it again with the same archive path.
+
+The parameters are set with ``param_set()``, so that any built-in, .def file
+or user parameter can be scanned, and only the parameters which changed wait
+for the hardware to settle (cf. parameters.settle())::
+
+    points = grid(np.arange(3300, 3400.1, 0.5), np.arange(0, 200, 4))
+    reader = scan(xepr, ["CenterField", "p0"], points, [0.1, 2],
+                  "nutation_map.arc", exp_file, def_file)
+    traces = reader.stack().reshape(201, 50, -1)
+
+SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+
+import itertools
+import os
+from typing import List, Union
+
+import numpy as np
+
+from . import xepr_link
+from .archive import ArchiveError, ArchiveReader, ArchiveWriter
+from .costfunctions import DatasetView
+from .main import ParamState, log_values, param_set, round2tol_str, snap2tol
+
+
+def grid(*axes) -> np.ndarray:
+    """
+    Points of a regular grid.
+
+    Parameters
+    ----------
+    *axes : list or ndarray
+        Values of each parameter.
+
+    Returns
+    -------
+    points : ndarray
+        Points of the Cartesian product of the axes, of shape (npoints,
+        len(axes)). The first axis varies the slowest.
+    """
+    return np.array(list(itertools.product(*axes)),
+                    dtype=float).reshape(-1, len(axes))
+
+
+def scan(xepr,
+         pars: List[str],
+         points: Union[list, np.ndarray],
+         tol: Union[list, np.ndarray],
+         path: str,
+         exp_file: str = None,
+         def_file: str = None,
+         acquire: callable = None,
+         cost_function: callable = None,
+         monitors: List[str] = None,
+         callback: callable = None,
+         callback_args: tuple = None,
+         param_state=None,
+         resume: bool = True) -> ArchiveReader:
+    """
+    Acquire a trace at each point of a sweep.
+
+    Parameters
+    ----------
+    xepr : instance of XeprAPI.Xepr
+        The instantiated Xepr object.
+    pars : list of str
+        Parameter names, as in optimise().
+    points : list or ndarray
+        Parameter values of each point, of shape (npoints, len(pars)), e.g.
+        from grid(). Linked sweeps (e.g. a field following the frequency)
+        are given point by point.
+    tol : list of float
+        Resolution of each parameter, to which the values are rounded.
+    path : str
+        Path of the archive file to which the points are written.
+    exp_file : str, default None
+        Experiment file (.exp) path, required to modify .def file
+        parameters.
+    def_file : str, default None
+        Definition file (.def) path, required to modify .def file
+        parameters.
+    acquire : function, default None
+        Function ``acquire(xepr)`` running the experiment and returning the
+        dataset. Defaults to xepr_link.run2getdata_exp(); use e.g.
+        ``functools.partial(xepr_link.run2getdata_exp, SignalType="Signal",
+        exp_name="nutation")`` to pass other arguments.
+    cost_function : function, default None
+        Function of the data object (a costfunctions.DatasetView) whose
+        value is archived with each trace, e.g. as a quick look at the scan.
+        NaN is archived if None.
+    monitors : list of str, default None
+        Values of the current experiment (e.g. "FrequencyMon") read after
+        setting each point, and archived as additional parameters.
+    callback : function, default None
+        User defined function called when setting up parameters, as in
+        optimise().
+    callback_args : tuple, default None
+        Arguments for callback function.
+    param_state : main.ParamState, default None
+        Record of the parameter values applied in Xepr, so that unchanged
+        values are not sent (and waited for) again. A new one is created if
+        None.
+    resume : bool, default True
+        Whether to resume the scan recorded in an existing archive at path:
+        the points already recorded are skipped. If False, an existing
+        archive is overwritten.
+
+    Returns
+    -------
+    archive.ArchiveReader
+        Reader of the archive, with the records in the order of the points.
+    """
+    points = np.asarray(points, dtype=float)
+    if points.ndim == 1 and len(pars) == 1:
+        points = points.reshape(-1, 1)
+    if points.ndim != 2 or points.shape[1] != len(pars):
+        raise ValueError("points should be of shape (npoints, len(pars)).")
+    if len(tol) != len(pars):
+        raise ValueError("pars and tol should have the same length.")
+    points = snap2tol(points, tol)
+    monitors = [] if monitors is None else list(monitors)
+    if acquire is None:
+        acquire = xepr_link.run2getdata_exp
+    if param_state is None:
+        param_state = ParamState()
+
+    # points already recorded
+    done = set()
+    if resume and os.path.exists(path):
+        reader = ArchiveReader(path)
+        if reader.pars != pars + monitors:
+            raise ArchiveError(f"{path} was recorded with parameters"
+                               f" {reader.pars}, not {pars + monitors}.")
+        done = {tuple(round2tol_str(val, tol))
+                for val in reader.values[:, :len(pars)]}
+        del reader
+
+    print("\n")
+    print("=" * 60)
+    fmt = "{:25s} - {}"
+    print(fmt.format("Scanned parameters", pars))
+    print(fmt.format("Number of points", len(points)))
+    if done:
+        print(fmt.format("Points already acquired", len(done)))
+    print(fmt.format("Archive", path))
+    print("")
+
+    if hasattr(cost_function, "reset"):
+        cost_function.reset()
+
+    with ArchiveWriter(path, pars + monitors, chunk_size=1,
+                       append=resume) as writer:
+        for val in points:
+            if tuple(round2tol_str(val, tol)) in done:
+                continue
+
+            param_set(xepr, pars, val, tol, exp_file, def_file,
+                      callback, callback_args, param_state)
+            readings = []
+            if monitors:
+                experiment = xepr.XeprExperiment()
+                readings = [float(experiment[monitor].value)
+                            for monitor in monitors]
+
+            data = acquire(xepr)
+            cf_val = np.nan if cost_function is None \
+                else cost_function(DatasetView(data))
+            writer.write(list(val) + readings, data, cf_val)
+            log_values(val, tol, cf_val)
+
+    print("=" * 60)
+    return ArchiveReader(path)
@@ -0,0 +1,405 @@
+"""
+shapes.py
+---------
+
+Management of the shapes loaded into the Xepr arbitrary waveform generator
+(AWG).
+
+Callbacks which modify pulse shapes usually write a shape file and load it
+with ``xepr_link.load_shp()`` at every evaluation. ``ShapeManager`` avoids
+re-uploading identical waveforms and keeps track of the number of shape loads,
+so that AWG memory exhaustion (typically after 114 loads on older versions of
+Xepr) can be predicted, and optionally resets the experiment automatically
+before it happens.
+
+For scans over discrete shape parameters, ``ShapeBank`` uploads the shapes of
+all the grid points at once, and then only selects the shape number for each
+evaluation.
+
+SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+
+import hashlib
+import os
+from collections import OrderedDict
+from typing import Iterable, List
+from warnings import warn
+
+import numpy as np
+
+from . import xepr_link
+
+
+def shape_body(x: np.ndarray, y: np.ndarray = None,
+               decimals: int = 5) -> str:
+    """
+    Format a waveform as the body of an Xepr shape definition.
+
+    Parameters
+    ----------
+    x : ndarray
+        Real part of the waveform, or complex waveform if y is None. Values
+        must be within [-1, 1].
+    y : ndarray, default None
+        Imaginary part of the waveform.
+    decimals : int, default 5
+        Number of decimals in the exponent notation of the values.
+
+    Returns
+    -------
+    body : str
+        One "x,y" line per point.
+    """
+    if y is None:
+        x, y = np.real(x), np.imag(x)
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    if x.shape != y.shape:
+        raise ValueError("x and y should have the same shape.")
+    if np.any(np.abs(x) > 1) or np.any(np.abs(y) > 1):
+        raise ValueError("Shape values should be within [-1, 1].")
+    fmt = f"{{:+.{decimals}e}},{{:+.{decimals}e}}"
+    return "\n".join(fmt.format(xi, yi) for xi, yi in zip(x, y)) + "\n"
+
+
+def shape_text(shp_nb: int, body: str, name: str = "esrpoise") -> str:
+    """
+    Xepr shape definition with number shp_nb.
+
+    Parameters
+    ----------
+    shp_nb : int
+        Shape number, as referred to in the PulseSPEL program.
+    body : str
+        Shape values, as returned by shape_body().
+    name : str, default "esrpoise"
+        Description of the shape.
+
+    Returns
+    -------
+    text : str
+        Shape definition, as found in a .shp file.
+    """
+    return (f'begin shape{shp_nb} "{name}"\n'
+            + body
+            + f"end shape{shp_nb}\n")
+
+
+class ShapeManager():
+    """
+    Pool of AWG shape numbers with content-based deduplication.
+
+    Each waveform is identified by a hash of its formatted values, so that
+    waveforms which are identical once written to file (e.g. synthesised from
+    parameters which are equal once rounded to tolerance) are only uploaded
+    once. Shape numbers are taken from a bounded pool, and the least recently
+    used one is reused when the pool is full.
+
+    The PulseSPEL program must refer to the shape number returned by load()
+    (e.g. through a .def file variable), since an identical waveform is
+    found in the shape number where it was first uploaded.
+
+    With auto_reset, the experiment is reset with xepr_link.reset_exp()
+    (without user interaction) when max_loads is reached, and the parameters
+    recorded in param_state are restored, so that the optimisation can
+    continue unattended. All the shapes needed by the experiment should then
+    be loaded through the manager at each evaluation, since the AWG content
+    is lost on reset.
+    """
+
+    def __init__(self, xepr, slots: Iterable[int], shp_dir: str = None,
+                 max_loads: int = 114, decimals: int = 5,
+                 auto_reset: bool = False, exp_file: str = None,
+                 def_file: str = None, param_state=None):
+        """
+        Initialise a ShapeManager object.
+
+        Parameters
+        ----------
+        xepr : instance of XeprAPI.Xepr
+            The instantiated Xepr object.
+        slots : iterable of int
+            Shape numbers which can be used by the manager.
+        shp_dir : str, default None
+            Directory where shape files are written. Defaults to the current
+            working directory.
+        max_loads : int, default 114
+            Number of shape loads after which the AWG needs to be reset.
+        decimals : int, default 5
+            Number of decimals of the shape values in the shape files.
+        auto_reset : bool, default False
+            Whether to reset the experiment automatically when max_loads is
+            reached.
+        exp_file : str, default None
+            Experiment file (.exp) loaded after an automatic reset. Required
+            if auto_reset is True.
+        def_file : str, default None
+            Definition file (.def) loaded after an automatic reset.
+        param_state : main.ParamState, default None
+            Record of the parameter values applied in Xepr (as passed to
+            optimise()), restored after an automatic reset.
+        """
+        self.xepr = xepr
+        self.slots = list(slots)
+        if len(self.slots) == 0:
+            raise ValueError("At least one shape number is required.")
+        self.shp_dir = os.getcwd() if shp_dir is None else shp_dir
+        self.max_loads = max_loads
+        self.decimals = decimals
+        if auto_reset and exp_file is None:
+            raise ValueError("exp_file is required for automatic resets.")
+        self.auto_reset = auto_reset
+        self.exp_file = exp_file
+        self.def_file = def_file
+        self.param_state = param_state
+        self.nresets = 0
+        self.resident = OrderedDict()  # slot -> hash, least recently used 1st
+        self.nloads = 0                # number of shape files loaded
+        self.nskipped = 0              # number of uploads avoided
+
+    @property
+    def loads_remaining(self) -> int:
+        """
+        Number of shape loads left before the AWG needs to be reset.
+        """
+        return max(self.max_loads - self.nloads, 0)
+
+    def reset_due(self, nloads: int = 1) -> bool:
+        """
+        Whether loading nloads more shape files would exceed max_loads.
+        """
+        return self.nloads + nloads > self.max_loads
+
+    def invalidate(self) -> None:
+        """
+        Forget the content of the AWG and reset the load counter, e.g. after
+        the experiment has been reset with xepr_link.reset_exp().
+        """
+        self.resident.clear()
+        self.nloads = 0
+
+    def reset(self) -> None:
+        """
+        Reset the experiment (without user interaction) to free the AWG
+        memory, and restore the parameters recorded in param_state.
+        """
+        if self.exp_file is None:
+            raise ValueError("exp_file is required to reset the experiment.")
+        xepr_link.reset_exp(self.xepr, self.exp_file, self.def_file)
+        self.invalidate()
+        self.nresets += 1
+        if self.param_state is not None:
+            self.param_state.restore(self.xepr)
+
+    def lookup(self, digest: str) -> int:
+        """
+        Shape number holding the waveform with hash digest, or None.
+        """
+        for slot, resident_digest in self.resident.items():
+            if resident_digest == digest:
+                return slot
+        return None
+
+    def load(self, x: np.ndarray, y: np.ndarray = None) -> int:
+        """
+        Make sure that a waveform is loaded in the AWG.
+
+        Parameters
+        ----------
+        x : ndarray
+            Real part of the waveform, or complex waveform if y is None.
+        y : ndarray, default None
+            Imaginary part of the waveform.
+
+        Returns
+        -------
+        shp_nb : int
+            Shape number holding the waveform.
+        """
+        return self.load_many([x if y is None else (x, y)])[0]
+
+    def load_many(self, waveforms: List[np.ndarray]) -> List[int]:
+        """
+        Make sure that several waveforms are loaded in the AWG. Waveforms
+        which are not loaded yet are written to a single shape file, so that
+        only one shape load is needed.
+
+        Parameters
+        ----------
+        waveforms : list
+            Complex waveforms, or (x, y) tuples of their real and imaginary
+            parts.
+
+        Returns
+        -------
+        shp_nbs : list of int
+            Shape numbers holding each waveform.
+        """
+        bodies = []
+        for wfm in waveforms:
+            if isinstance(wfm, tuple):
+                bodies.append(shape_body(*wfm, decimals=self.decimals))
+            else:
+                bodies.append(shape_body(wfm, decimals=self.decimals))
+        digests = [hashlib.sha1(body.encode()).hexdigest() for body in bodies]
+        if len(set(digests)) > len(self.slots):
+            raise ValueError("Not enough shape numbers for the waveforms.")
+
+        shp_nbs = [self.lookup(digest) for digest in digests]
+        if (self.auto_reset and None in shp_nbs and self.reset_due()):
+            self.reset()
+            shp_nbs = [None] * len(digests)
+        # Mark the waveforms already loaded as recently used, so that they
+        # are not evicted by the new ones.
+        for shp_nb in shp_nbs:
+            if shp_nb is not None:
+                self.resident.move_to_end(shp_nb)
+
+        new_text = []
+        for i, (body, digest) in enumerate(zip(bodies, digests)):
+            if shp_nbs[i] is not None:
+                self.nskipped += 1
+                continue
+            shp_nb = self.lookup(digest)  # duplicate within waveforms
+            if shp_nb is None:
+                shp_nb = self.free_slot()
+                self.resident[shp_nb] = digest
+                new_text.append(shape_text(shp_nb, body))
+            else:
+                self.nskipped += 1
+            self.resident.move_to_end(shp_nb)
+            shp_nbs[i] = shp_nb
+
+        if new_text:
+            if self.reset_due():
+                warn(f"{self.nloads} shape loads since the last AWG reset:"
+                     " the AWG memory may be exhausted. Reset the experiment"
+                     " with xepr_link.reset_exp().")
+            shp_file = os.path.join(self.shp_dir,
+                                    f"{shp_nbs[0]}_esrpoise.shp")
+            with open(shp_file, "w") as f:
+                f.write("".join(new_text))
+            xepr_link.load_shp(self.xepr, shp_file)
+            self.nloads += 1
+
+        return shp_nbs
+
+    def free_slot(self) -> int:
+        """
+        Shape number to use for a new waveform: an unused one if possible,
+        otherwise the least recently used one.
+        """
+        for slot in self.slots:
+            if slot not in self.resident:
+                return slot
+        slot, _ = self.resident.popitem(last=False)
+        return slot
+
+
+class ShapeBank():
+    """
+    Shapes precomputed for a grid of shape parameter values.
+
+    For scans over waveform parameters (e.g. with the brute-force optimiser),
+    the waveforms of all grid points are synthesised in a single (vectorised)
+    call and uploaded as one merged shape file. The instance can then be
+    passed as the callback of optimise(): for each evaluation, it only
+    selects the shape number of the grid point nearest to the requested
+    values, by setting a .def file variable without compilation.
+    """
+
+    def __init__(self, xepr, pars: List[str], values: List[np.ndarray],
+                 synthesise: callable, first_shp_nb: int, def_var: str,
+                 def_file: str = None, shp_dir: str = None,
+                 decimals: int = 5):
+        """
+        Initialise a ShapeBank object and synthesise the waveforms.
+
+        Parameters
+        ----------
+        xepr : instance of XeprAPI.Xepr
+            The instantiated Xepr object.
+        pars : list of str
+            Names of the shape parameters, as passed to optimise() (e.g.
+            ["&bw"]).
+        values : list of ndarray
+            Values of each parameter. The grid is their Cartesian product.
+        synthesise : function
+            Function ``synthesise(points)`` which takes an array of shape
+            (npoints, len(pars)) of parameter values and returns the complex
+            waveforms as an array of shape (npoints, nsamples).
+        first_shp_nb : int
+            Shape number of the first grid point. The grid points use
+            consecutive shape numbers.
+        def_var : str
+            Name of the .def file variable holding the shape number used by
+            the PulseSPEL program (e.g. "as0").
+        def_file : str, default None
+            Definition file (.def) in which def_var is also updated, so that
+            a later compilation keeps the selected shape.
+        shp_dir : str, default None
+            Directory where the shape file is written. Defaults to the
+            current working directory.
+        decimals : int, default 5
+            Number of decimals of the shape values in the shape file.
+        """
+        self.xepr = xepr
+        self.pars = list(pars)
+        self.axes = [np.asarray(v, dtype=float) for v in values]
+        if len(self.axes) != len(self.pars):
+            raise ValueError("pars and values should have the same length.")
+        self.points = np.array(np.meshgrid(*self.axes, indexing="ij")) \
+            .reshape(len(self.pars), -1).T
+        self.first_shp_nb = first_shp_nb
+        self.def_var = def_var
+        self.def_file = def_file
+        self.shp_dir = os.getcwd() if shp_dir is None else shp_dir
+        self.waveforms = np.asarray(synthesise(self.points))
+        if self.waveforms.shape[0] != self.points.shape[0]:
+            raise ValueError("synthesise() should return one waveform per"
+                             " grid point.")
+        self.decimals = decimals
+        self.uploaded = False
+        self.selected = None
+
+    def upload(self) -> None:
+        """
+        Upload all the waveforms to Xepr as a single shape file.
+        """
+        text = "".join(shape_text(self.first_shp_nb + i,
+                                  shape_body(wfm, decimals=self.decimals))
+                       for i, wfm in enumerate(self.waveforms))
+        shp_file = os.path.join(self.shp_dir,
+                                f"{self.first_shp_nb}_bank.shp")
+        with open(shp_file, "w") as f:
+            f.write(text)
+        xepr_link.load_shp(self.xepr, shp_file)
+        self.uploaded = True
+
+    def shp_nb(self, pars_dict: dict) -> int:
+        """
+        Shape number of the grid point nearest to the parameter values in
+        pars_dict.
+        """
+        x = np.array([pars_dict[par] for par in self.pars], dtype=float)
+        # Distances relative to the grid extent in each dimension.
+        extent = np.array([np.ptp(axis) if np.ptp(axis) > 0 else 1
+                           for axis in self.axes])
+        dist = np.sum(((self.points - x) / extent) ** 2, axis=1)
+        return self.first_shp_nb + int(np.argmin(dist))
+
+    def __call__(self, pars_dict: dict, *args) -> None:
+        """
+        Callback selecting the shape for the parameter values in pars_dict.
+        """
+        if not self.uploaded:
+            self.upload()
+        shp_nb = self.shp_nb(pars_dict)
+        if shp_nb == self.selected:
+            return
+        if self.def_file is not None:
+            xepr_link.modif_def(None, self.def_file, [self.def_var],
+                                [str(shp_nb)])
+        xepr_link.modif_def_PlsSPELGlbTxt(self.xepr, self.def_file,
+                                          [self.def_var], [str(shp_nb)])
+        self.selected = shp_nb
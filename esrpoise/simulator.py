@@ -0,0 +1,295 @@
+"""
+simulator.py
+------------
+
+Simulated Xepr backend, which can be passed instead of the XeprAPI.Xepr
+object to ``optimise()`` and to the functions of ``xepr_link``.
+
+It implements the subset of XeprAPI used by esrpoise, and returns data
+computed by a user-defined response function of the parameters set (built-in
+parameters set with ``aqParSet`` and variables of the loaded .def file). The
+AWG memory exhaustion after a number of sequential shape loads, and the loss
+of the hidden parameters when the experiment is reset, are simulated so that
+unattended optimisations can be tested without a spectrometer.
+
+SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+
+import numpy as np
+
+from .clock import get_clock
+
+
+class SimulationError(RuntimeError):
+    pass
+
+
+class SimulatedParam():
+    """
+    Xepr parameter, whose value is stored in the SimulatedXepr object.
+    """
+
+    def __init__(self, sim, name: str):
+        self.sim = sim
+        self.name = name
+
+    @property
+    def value(self):
+        if self.name == "PlsSPELGlbTxt":
+            # text of the compiled definitions
+            return "\n".join(f"{name} = {value}"
+                             for name, value in self.sim.defs.items())
+        return self.sim.params.get(self.name)
+
+    @value.setter
+    def value(self, value):
+        if self.name == "ftEPR.PlsSPELSetVar":
+            # direct modification of a compiled definition
+            name, _, value = value.partition("=")
+            self.sim.defs[name.strip()] = value.strip()
+            return
+        self.sim.params[self.name] = self.sim.quantise(self.name, value)
+
+
+class SimulatedExperiment():
+    """
+    Xepr experiment (as returned by XeprAPI.Xepr.XeprExperiment()).
+    """
+
+    def __init__(self, sim, name: str):
+        self.sim = sim
+        self.name = name
+
+    def aqGetExpName(self) -> str:
+        return self.name
+
+    def aqExpRunAndWait(self) -> None:
+        self.sim.run()
+        get_clock().sleep(self.sim.acq_time)
+
+    def aqExpRun(self) -> None:
+        self.sim.run()
+        self.sim.run_end = get_clock().time() + self.sim.acq_time
+
+    @property
+    def isRunning(self) -> bool:
+        return get_clock().time() < self.sim.run_end
+
+    def getParam(self, name: str) -> SimulatedParam:
+        return SimulatedParam(self.sim, name.lstrip("*"))
+
+    def __getitem__(self, name: str) -> SimulatedParam:
+        return self.getParam(name)
+
+    def __setitem__(self, name: str, value) -> None:
+        self.getParam(name).value = value
+
+
+class SimulatedDataset():
+    """
+    Xepr dataset (as returned by XeprAPI.Xepr.XeprDataset()), holding the
+    data of the last run.
+    """
+
+    def __init__(self, sim):
+        # setattr() as pycodestyle objects to the XeprAPI attribute name
+        setattr(self, "O", sim.data)
+        self.X = None if sim.data is None else \
+            np.arange(np.size(sim.data), dtype=float)
+
+    def datasetAvailable(self) -> bool:
+        return self.X is not None
+
+
+class SimulatedCmds():
+    """
+    Xepr commands (XeprAPI.Xepr.XeprCmds).
+    """
+
+    def __init__(self, sim):
+        self.sim = sim
+
+    def __getattr__(self, cmd: str):
+        # Commands which only affect the display are accepted and logged.
+        if not cmd.startswith("aq"):
+            raise AttributeError(cmd)
+
+        def log_only(*args):
+            self.sim.log.append((cmd,) + args)
+        return log_only
+
+    def aqParSet(self, layer: str, par: str, value: str) -> None:
+        self.sim.log.append(("aqParSet", layer, par, value))
+        self.sim.params[par.lstrip("*")] = self.sim.quantise(par.lstrip("*"),
+                                                             value)
+
+    def aqPgLoad(self, exp_file: str) -> None:
+        self.sim.log.append(("aqPgLoad", exp_file))
+        self.sim.exp_file = exp_file
+
+    def aqPgDefLoad(self, def_file: str) -> None:
+        self.sim.log.append(("aqPgDefLoad", def_file))
+        self.sim.def_file = def_file
+
+    def aqPgShpLoad(self, shp_file: str) -> None:
+        self.sim.log.append(("aqPgShpLoad", shp_file))
+        self.sim.shape_loads += 1
+
+    def aqPgCompile(self) -> None:
+        self.sim.log.append(("aqPgCompile",))
+        self.sim.compile()
+
+    def aqExpCut(self, name: str) -> None:
+        self.sim.log.append(("aqExpCut", name))
+        self.sim.cut()
+
+    def aqExpPaste(self) -> None:
+        self.sim.log.append(("aqExpPaste",))
+
+
+class SimulatedXepr():
+    """
+    Simulated replacement for the XeprAPI.Xepr object.
+    """
+
+    def __init__(self, response: callable, exp_name: str = "AWGTransient",
+                 hidden_defaults: dict = None, max_shape_loads: int = None,
+                 acq_time: float = 0, quantisers: dict = None):
+        """
+        Initialise a SimulatedXepr object.
+
+        Parameters
+        ----------
+        response : function
+            Function ``response(params)`` which takes a dictionary of the
+            current parameter values and returns the complex-valued trace to
+            be acquired. Built-in parameters are keyed by their Xepr name
+            (e.g. "ftBridge.Attenuation") and .def file variables by their
+            name (e.g. "p0"). Numerical values are converted to float.
+        exp_name : str, default "AWGTransient"
+            Name of the experiment.
+        hidden_defaults : dict, default None
+            Values of the built-in parameters when the simulation starts and
+            after the experiment is reset.
+        max_shape_loads : int, default None
+            Number of shape loads after which running the experiment fails,
+            until the experiment is reset. None for no limit.
+        acq_time : float, default 0
+            Duration of each experiment run (s), measured with the clock in
+            use (cf. clock.VirtualClock to simulate it instantly).
+        quantisers : dict, default None
+            Rounding applied by the hardware to built-in parameters, keyed by
+            Xepr name (e.g. "ftBridge.BrXAmp"). Each value is either a step
+            (the value is rounded to the closest multiple) or a function of
+            the float value returning the applied value.
+        """
+        self.response = response
+        self.exp_name = exp_name
+        self.hidden_defaults = dict() if hidden_defaults is None \
+            else dict(hidden_defaults)
+        self.max_shape_loads = max_shape_loads
+        self.acq_time = acq_time
+        self.quantisers = dict() if quantisers is None else dict(quantisers)
+        self.run_end = 0
+        self.params = dict(self.hidden_defaults)
+        self.exp_file = None
+        self.def_file = None
+        self.defs = dict()
+        self.compiled = True
+        self.shape_loads = 0
+        self.nruns = 0
+        self.data = None
+        self.log = []
+        self.XeprCmds = SimulatedCmds(self)
+
+    def XeprExperiment(self, name: str = None) -> SimulatedExperiment:
+        return SimulatedExperiment(self, self.exp_name
+                                   if name is None else name)
+
+    def XeprDataset(self) -> SimulatedDataset:
+        return SimulatedDataset(self)
+
+    def quantise(self, name: str, value):
+        """
+        Value applied by the hardware when value is set for parameter name.
+        """
+        quantiser = self.quantisers.get(name)
+        if quantiser is None:
+            return value
+        if not callable(quantiser):
+            step = quantiser
+
+            def quantiser(v):
+                return step * np.round(v / step)
+        return f"{float(quantiser(float(value))):.10g}"
+
+    def compile(self) -> None:
+        """
+        Compile the loaded PulseSPEL files, i.e. read the .def file
+        variables.
+        """
+        self.defs = dict()
+        if self.def_file is not None:
+            self.defs = read_defs(self.def_file)
+        self.compiled = True
+
+    def cut(self) -> None:
+        """
+        Replace the experiment with a new copy: the AWG memory is freed, the
+        built-in parameters are reset and the PulseSPEL program needs to be
+        compiled again.
+        """
+        self.params = dict(self.hidden_defaults)
+        self.shape_loads = 0
+        self.compiled = False
+
+    def current_params(self) -> dict:
+        """
+        Current values of all parameters, as passed to the response function.
+        """
+        params = dict()
+        for name, value in list(self.params.items()) + list(self.defs.items()):
+            try:
+                params[name] = float(value)
+            except (TypeError, ValueError):
+                params[name] = value
+        return params
+
+    def run(self) -> None:
+        """
+        Run the experiment and store the simulated data.
+        """
+        if not self.compiled:
+            raise SimulationError("PulseSPEL program not compiled.")
+        if (self.max_shape_loads is not None
+                and self.shape_loads > self.max_shape_loads):
+            raise SimulationError("AWG memory exhausted, the experiment needs"
+                                  " to be reset.")
+        self.data = np.asarray(self.response(self.current_params()),
+                               dtype=complex)
+        self.nruns += 1
+
+
+def read_defs(def_file: str) -> dict:
+    """
+    Read the variables of a .def file.
+
+    Parameters
+    ----------
+    def_file : str
+        Name of the Xepr definition file (full path with .def extension).
+
+    Returns
+    -------
+    defs : dict
+        Variable names and values (as strings).
+    """
+    defs = dict()
+    with open(def_file, 'r') as def_f:
+        for line in def_f:
+            line = line.partition(";")[0]
+            name, equal, value = line.partition("=")
+            if equal and name.strip() and " " not in name.strip():
+                defs[name.strip()] = value.strip()
+    return defs
@@ -16,14 +16,17 @@ It applies pauses of lengths:
 
  - ``2*COMPILATION_TIME`` before and after Xepr reset
 
+The pauses are taken with the clock in use (cf. clock.py), so that they take
+no time with a virtual clock.
+
 SPDX-License-Identifier: GPL-3.0-or-later
 
 """
 
-import time
-import XeprAPI         # load the Xepr API module
 from typing import List
 
+from .clock import get_clock
+
 
 # global variable to control Xepr files compilation time
 COMPILATION_TIME = 1  # (s)
@@ -43,11 +46,32 @@ def load_xepr():
         The instantiated Xepr object, used for communication with
         Xepr-the-programme.
     """
+    # XeprAPI is imported on first use, so that esrpoise can be used without
+    # it (e.g. with simulator.SimulatedXepr)
+    try:
+        import XeprAPI
+    except ImportError as e:
+        raise ImportError("XeprAPI is required to control the spectrometer, "
+                          "install it with 'python -m pip install "
+                          "esrpoise[xepr]'") from e
+
     xepr = XeprAPI.Xepr()  # start Xepr API module
 
     return xepr
 
 
+def experiment_error():
+    """
+    Return the exception raised by XeprAPI when an experiment fails, or an
+    empty tuple (which catches nothing) if XeprAPI is not installed.
+    """
+    try:
+        import XeprAPI
+    except ImportError:
+        return ()
+    return XeprAPI.ExperimentError
+
+
 def load_exp(xepr, exp_file: str) -> None:
     """
     Load and compile an Xepr experiment file.
@@ -70,7 +94,7 @@ def load_exp(xepr, exp_file: str) -> None:
         xepr.XeprCmds.aqPgCompile()
 
         # wait for Xepr to finish compiling
-        time.sleep(COMPILATION_TIME)
+        get_clock().sleep(COMPILATION_TIME)
     except Exception:
         raise RuntimeError("Error loading and compiling experiment file")
 
@@ -130,7 +154,7 @@ def load_def(xepr, def_file: str) -> None:
         xepr.XeprCmds.aqPgCompile()
 
         # wait for Xepr to finish compiling
-        time.sleep(COMPILATION_TIME)
+        get_clock().sleep(COMPILATION_TIME)
     except Exception:
         raise RuntimeError("Error loading and compiling definition file")
 
@@ -211,8 +235,8 @@ def modif_def(xepr, def_file: str,
     None
     """
     with open(def_file, 'r') as def_f:
-        fullDefs = def_f.read()
-    fullDefs = fullDefs.split("\n")
+        origDefs = def_f.read()
+    fullDefs = origDefs.split("\n")
 
     for name, value in zip(var_name, var_value):
 
@@ -228,9 +252,12 @@ def modif_def(xepr, def_file: str,
                 if comment_partition[1] == ";":
                     fullDefs[j] += " " ";" + comment_partition[-1]
 
-    # replace definition file with modifications
-    with open(def_file, 'w') as def_f:
-        def_f.write('\n'.join(fullDefs))
+    # replace definition file with modifications (unless they are already in
+    # the file, e.g. written in advance by pipeline.PipelinedEvaluator)
+    fullDefs = '\n'.join(fullDefs)
+    if fullDefs != origDefs:
+        with open(def_file, 'w') as def_f:
+            def_f.write(fullDefs)
 
     if xepr is not None:  # to allow test without Xepr
         load_def(xepr, def_file)
@@ -257,7 +284,7 @@ def load_shp(xepr, shp_file: str) -> None:
         xepr.XeprCmds.aqPgCompile()
 
         # wait for Xepr to finish compiling
-        time.sleep(COMPILATION_TIME*0.25)
+        get_clock().sleep(COMPILATION_TIME*0.25)
     except Exception:
         raise RuntimeError("Error loading and compiling Xepr shape file")
 
@@ -318,7 +345,7 @@ def run2getdata_exp(xepr, SignalType: str = None, exp_name: str = None):
         try:
             print("Trying to run current experiment to create some data...")
             xepr.XeprExperiment().aqExpRunAndWait()
-        except XeprAPI.ExperimentError:
+        except experiment_error():
             raise RuntimeError("No dataset available and no (working)"
                                " experiment to run; aborting")
     if not data.datasetAvailable():
@@ -327,7 +354,82 @@ def run2getdata_exp(xepr, SignalType: str = None, exp_name: str = None):
     return data
 
 
-def reset_exp(xepr) -> None:
+def run_exp(xepr) -> None:
+    """
+    Start the current experiment without waiting for it to finish.
+
+    Parameters
+    ----------
+    xepr : instance of XeprAPI.Xepr
+        The instantiated Xepr object.
+
+    Returns
+    -------
+    None
+    """
+    try:
+        xepr.XeprExperiment().aqExpRun()
+    except Exception:
+        raise RuntimeError("Error running current experiment")
+
+
+def exp_running(xepr) -> bool:
+    """
+    Check whether the current experiment is running.
+
+    Parameters
+    ----------
+    xepr : instance of XeprAPI.Xepr
+        The instantiated Xepr object.
+
+    Returns
+    -------
+    bool
+        True if the experiment is still running.
+    """
+    return bool(xepr.XeprExperiment().isRunning)
+
+
+def wait_exp(xepr, poll_interval: float = 0.01) -> None:
+    """
+    Wait for the current experiment to finish.
+
+    Parameters
+    ----------
+    xepr : instance of XeprAPI.Xepr
+        The instantiated Xepr object.
+    poll_interval : float, default 0.01
+        Time between two checks of the experiment state (s).
+
+    Returns
+    -------
+    None
+    """
+    while exp_running(xepr):
+        get_clock().sleep(poll_interval)
+
+
+def get_data(xepr):
+    """
+    Get the data of the last experiment run.
+
+    Parameters
+    ----------
+    xepr : instance of XeprAPI.Xepr
+        The instantiated Xepr object.
+
+    Returns
+    -------
+    data : XeprAPI.Dataset
+        The data retrieved from Xepr (cf. run2getdata_exp()).
+    """
+    data = xepr.XeprDataset()
+    if not data.datasetAvailable():
+        raise RuntimeError("No dataset available; aborting")
+    return data
+
+
+def reset_exp(xepr, exp_file: str = None, def_file: str = None) -> None:
     """
     Copy the current experiment and use it to replace the current experiment.
 
@@ -337,13 +439,20 @@ def reset_exp(xepr) -> None:
     ----------
     xepr : instance of XeprAPI.Xepr
         The instantiated Xepr object.
+    exp_file : str, default None
+        Experiment file (.exp) loaded in the new experiment. If None, the user
+        is asked to load it by hand in Xepr, and the reset waits for the user
+        to press enter.
+    def_file : str, default None
+        Definition file (.def) loaded in the new experiment before the
+        experiment file, if exp_file is given.
 
     Returns
     -------
     None
     """
     # wait for Xepr to be ready to reset the experiment
-    time.sleep(2*COMPILATION_TIME)
+    get_clock().sleep(2*COMPILATION_TIME)
 
     # get current experiment name
     curr_exp = xepr.XeprExperiment()
@@ -368,14 +477,21 @@ def reset_exp(xepr) -> None:
     # open parameter panel
     xepr.XeprCmds.aqParOpen()
 
-    # ask user to allow .exp file to be loaded
-    print('Experiment reset')
-    print('clik twice the PulseSPEL button to load the .exp file')
-    print('(located at the bottom of FT EPR parameters window)')
-    input('when done, press enter in python console to continue:')
+    if exp_file is None:
+        # ask user to allow .exp file to be loaded
+        print('Experiment reset')
+        print('clik twice the PulseSPEL button to load the .exp file')
+        print('(located at the bottom of FT EPR parameters window)')
+        input('when done, press enter in python console to continue:')
+    else:
+        # load and compile the PulseSPEL files in the new experiment
+        if def_file is not None:
+            load_def(xepr, def_file)
+        load_exp(xepr, exp_file)
+        print(f'Experiment reset, <{exp_file}> loaded')
 
     # wait for Xepr to reset the experiment
-    time.sleep(2*COMPILATION_TIME)
+    get_clock().sleep(2*COMPILATION_TIME)
 
     # prevent Xepr from reseting high power attenuation value
     xepr.XeprCmds.aqParStep("AcqHidden", "ftBridge.Attenuation", "Fine 1")
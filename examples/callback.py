@@ -65,12 +65,19 @@ def shape_bw(callback_pars_dict, shp_nb):
     # send shape to Xepr
     xepr_link.load_shp(xepr, path)
 
+    # NB: shapes.ShapeManager can be used instead of the two steps above to
+    # avoid re-uploading identical shapes and to count shape loads. With
+    # auto_reset=True (and the same main.ParamState passed to the manager and
+    # to optimise()), it also resets the experiment without user interaction
+    # when the AWG memory is about to be exhausted.
+
     # NB: AWG memory overloading
     # If a bug with shape loading is encountered after a certain number
     # of iterations (typically 114 on older version of Xepr), it can be solved
     # by reseting Xepr. Uncomment the following lines:
     # # Xepr reset needed for 114 sequential shape load and run
-    # if acquire_esr.calls % 114 == 0 and acquire_esr.calls != 0:
+    # calls = current_run().calls
+    # if calls % 114 == 0 and calls != 0:
     #     print('reset required')
     #     xepr_link.reset_exp(Xepr)
 
@@ -94,3 +101,28 @@ xbest0, fbest, message = optimise(xepr,
 
 # NB: callback_args needs to be input as a tupple
 # '(7770,)' is equivalent to 'tuple([7770])'
+
+# NB: shape synthesis and upload can be separated so that, with the
+# Nelder-Mead optimisers, the shapes for the likely next points are
+# synthesised while Xepr is acquiring the current one:
+#
+# from esrpoise.callbacks import PrefetchCallback
+#
+# def synthesise_bw(callback_pars_dict, shp_nb):
+#     return pulse.Parametrized(bw=callback_pars_dict["&bw"], tp=80e-9, Q=5,
+#                               tres=0.625e-9, delta_f=-65e6,
+#                               AM="sech", FM="sech")
+#
+# def upload_bw(p, callback_pars_dict, shp_nb):
+#     p.xepr_file(shp_nb)
+#     xepr_link.load_shp(xepr, os.path.join(os.getcwd(), str(shp_nb) + '.shp'))
+#
+# prefetching_bw = PrefetchCallback(synthesise_bw, upload_bw)
+# xbest0, fbest, message = optimise(xepr, pars=['&bw'], init=[80e6],
+#                                   lb=[30e6], ub=[120e6], tol=[1e6],
+#                                   cost_function=maxabsint_echo,
+#                                   optimiser="nm", maxfev=120, nfactor=5,
+#                                   callback=prefetching_bw,
+#                                   callback_args=(7770,))
+# # stop the worker thread
+# prefetching_bw.close()
@@ -5,6 +5,10 @@ chorus_res_comp.py
 Optimisation of resonator compensation for CHORUS. Use chorus.exp, chorus.def,
 (experiment and phase cycle automatically selected).
 
+The compensation coefficients are initialised from the fit of a resonator
+profile (cf. xepr_link_resonator_profile), so that the optimisation is only a
+short polish within bounds around them.
+
 SPDX-License-Identifier: GPL-3.0-or-later
 
 """
@@ -13,11 +17,15 @@ import os
 import copy
 import numpy as np
 import matplotlib.pyplot as plt
-from esrpoise.costfunctions import maxabsint
+from esrpoise.costfunctions import maxabsint, reference_cost
 from esrpoise import optimise, xepr_link
+from esrpoise.resonator import compensate, ResonatorProfile
 from mrpypulse import sequence
 
 
+TRES = 0.625e-9  # time resolution of the pulses (s)
+
+
 def chorus_pulses():
     """
     Returns
@@ -28,8 +36,7 @@ def chorus_pulses():
     t90min = 80e-9
     t180min = 240e-9
     bw = 350e6
-    tres = 0.625e-9
-    chorus = sequence.Exc_3fs(t90min, t180min, bw, tres, polyfit=True,
+    chorus = sequence.Exc_3fs(t90min, t180min, bw, TRES, polyfit=True,
                               pulse_args={"delta_f": 0, "sm": 12.5},
                               polyfit_args={"deg": 4})
     return chorus
@@ -107,17 +114,8 @@ def shape_impulse(callback_pars_dict, seq):
     # pulse modification
     for p in seq0.pulses:
 
-        # create impulse
-        frq = 100
-        s = np.linspace(-frq/2, frq/2, p.ns)
-        H_numer = 1 + c[2] + 1j * c[3]
-        H_denom = 1 + s*(c[0] + 1j * c[1])
-        wfm = H_numer/H_denom
-
-        # modify pulse with impulse
-        gg = p.x + 1j * p.y
-        aa = np.fft.fftshift(np.fft.fft(gg))/wfm
-        new_pulse_g = np.fft.ifft(np.fft.ifftshift(aa))
+        # modify pulse with the inverse of the resonator response
+        new_pulse_g = compensate(p.x + 1j * p.y, c)
         p.x = np.real(new_pulse_g)
         p.y = np.imag(new_pulse_g)
 
@@ -126,15 +124,16 @@ def shape_impulse(callback_pars_dict, seq):
     return None
 
 
-def min_diff_FS(data):
+def load_FS(FS_path):
     """
-    Cost function for chorus on the fly resonator compensation
-
-    Minimises the difference between the spectrum and the field sweep data.
+    Load the field sweep used as target spectrum for the resonator
+    compensation.
 
+    Returns
+    -------
+    FS : ndarray
+        frequency offsets (Hz) and normalised intensities of the field sweep
     """
-    FS_path = os.path.join(os.getcwd(), 'FS_inverted.txt')
-
     # read FS
     FS = np.loadtxt(FS_path, delimiter=' ')
     FS[:, 0] = FS[:, 0] * 1e9  # GHz to Hz
@@ -143,38 +142,14 @@ def min_diff_FS(data):
     FS[:, 1] = FS[:, 1] - FS[1, 1]  # baseline
     FS[:, 1] = FS[:, 1]/np.max(FS[:, 1])
 
-    # echo data
-    echo = data.O.real + 1j * data.O.imag
-    # echo interpolation for better precision on 1st order phase correction
-    echo = np.interp(np.linspace(1, len(echo), 8*len(echo)),
-                     np.linspace(1, len(echo), len(echo)),
-                     echo)
-    # find echo centre
-    imax = np.argmax(np.abs(echo))
-    # chop the echo for 1st order phase correction
-    echo = echo[imax:]
-    # adjust intensity of first point to avoid baseline error
-    echo[1] = echo[1]/2
-
-    # spectrum
-    spec = np.fft.fftshift(np.fft.fft(echo, n=8*len(echo)))
-
-    # automatic 0th order phase correction
-    spec_ph = spec
-    for phi0 in np.linspace(-180, 180, 4*360+1):
-        spec_phi0 = spec * np.exp(-1j * phi0 * np.pi/180)
-        if sum(np.real(spec_phi0)) > sum(np.real(spec_ph)):
-            spec_ph = spec_phi0
-    spec = np.real(spec_ph)
-    spec = spec/np.max(spec)
+    return FS
 
-    sf = 1 / (0.5e-9/8)  # 0.5ns echo resolution * 8 for interpolation
-    x_spec = np.linspace(-sf / 2, sf / 2, len(spec))  # + 1.5*82.82e6
 
-    # interpolate spectrum with xaxis of field sweep
-    spec = np.interp(FS[:, 0], x_spec, spec)
-
-    return np.linalg.norm(FS[:, 1] - spec)
+# Cost function for chorus on the fly resonator compensation: minimises the
+# difference between the spectrum and the field sweep data. The field sweep is
+# loaded and processed only once (0.5ns echo resolution).
+FS = load_FS(os.path.join(os.getcwd(), 'FS_inverted.txt'))
+min_diff_FS = reference_cost(FS, dt=0.5e-9)
 
 
 xepr = xepr_link.load_xepr()
@@ -208,66 +183,33 @@ xbest1, fbest1, msg1 = optimise(xepr, pars=['aa0', 'aa1', 'aa2'],
                                 exp_file=exp_f, def_file=def_f,
                                 optimiser="bobyqa", maxfev=100, nfactor=75)
 
-init = [51.5, np.finfo(float).eps, np.finfo(float).eps,
-        np.finfo(float).eps, np.finfo(float).eps]
+# initial compensation coefficients and bounds from the resonator profile
+profile = ResonatorProfile(
+    np.loadtxt('xepr_link_resonator_profile/resonator_profile_f_211210.txt'),
+    np.loadtxt('xepr_link_resonator_profile/resonator_profile_H_f_211210.txt'))
+fc = float(curr_exp["FrequencyMon"].value)  # carrier frequency (GHz)
+c0, c_lb, c_ub = profile.compensation(fc, TRES)
+
+init = [51.5] + list(c0)
 pars = ['aa0', '&c1', '&c2', '&c3', '&c4']
 tol = [0.5, 0.005, 0.005, 0.005, 0.005]
 xbest0, fbest, message = optimise(xepr, pars=pars,
                                   init=init,
-                                  lb=[10, -1.2, -1.2, -1.2, -1.2],
-                                  ub=[60, 1.2, 1.2, 1.2, 1.2],
+                                  lb=[10] + list(c_lb),
+                                  ub=[60] + list(c_ub),
                                   tol=tol,
                                   cost_function=min_diff_FS,
                                   exp_file=exp_f, def_file=def_f,
                                   optimiser='bobyqa',
-                                  maxfev=400, nfactor=80,
+                                  maxfev=40, nfactor=80,
                                   callback=shape_impulse,
                                   callback_args=(chorus,))
 
 # run experiment with optimal parameters
 data = xepr_link.run2getdata_exp(xepr)
 
-# result
-FS_path = os.path.join(os.getcwd(), 'FS_inverted.txt')
-
-# read FS
-FS = np.loadtxt(FS_path, delimiter=' ')
-FS[:, 0] = FS[:, 0] * 1e9  # GHz to Hz
-
-# FS normalisation
-FS[:, 1] = FS[:, 1] - FS[1, 1]  # baseline
-FS[:, 1] = FS[:, 1]/np.max(FS[:, 1])
-
-# echo data
-echo = data.O.real + 1j * data.O.imag
-# echo interpolation for better precision on 1st order phase correction
-echo = np.interp(np.linspace(1, len(echo), 8*len(echo)),
-                 np.linspace(1, len(echo), len(echo)),
-                 echo)
-# find echo centre
-imax = np.argmax(np.abs(echo))
-# chop the echo for 1st order phase correction
-echo = echo[imax:]
-# adjust intensity of first point to avoid baseline error
-echo[1] = echo[1]/2
-
-# spectrum
-spec = np.fft.fftshift(np.fft.fft(echo, n=8*len(echo)))
-
-# automatic 0th order phase correction
-spec_ph = spec
-for phi0 in np.linspace(-180, 180, 4*360+1):
-    spec_phi0 = spec * np.exp(-1j * phi0 * np.pi/180)
-    if sum(np.real(spec_phi0)) > sum(np.real(spec_ph)):
-        spec_ph = spec_phi0
-spec = np.real(spec_ph)
-spec = spec/np.max(spec)
-
-sf = 1 / (0.5e-9/8)  # 0.5ns echo resolution * 8 for interpolation
-x_spec = np.linspace(-sf / 2, sf / 2, len(spec))
-
-# interpolate spectrum with xaxis of field sweep
-spec = np.interp(FS[:, 0], x_spec, spec)
+# result: spectrum interpolated with xaxis of field sweep
+spec = min_diff_FS.process(data)
 
 plt.figure()
 plt.plot(FS[:, 0], spec)
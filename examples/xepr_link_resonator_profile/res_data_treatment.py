@@ -1,48 +1,27 @@
 import numpy as np
-import matplotlib.pyplot as plt 
+import matplotlib.pyplot as plt
 
-nut = np.loadtxt('nutation_ydata.txt', dtype=np.complex64)
-
-n_res = nut.shape[0]
-n_nut = nut.shape[1]
-
-zero_fill = 4
-
-t = 1e-9*np.arange(12, 320+12, 2)  # only for indication, not used
-# 12ns -> first length of the nutation pulse
-
-# nutation experiments frequency axis
-sf = 1 / 2e-9  # the pulse length increase by 2ns
-x = np.linspace(sf / 2, -sf / 2, zero_fill*n_nut)
-
-# need to implement baseline correction
-
-res = np.empty(n_res)
+from esrpoise.resonator import ResonatorProfile
 
-for i in range(n_res):
-    nut[i,:] = nut[i,:] - np.mean(nut[i,:])
-
-    t = np.linspace(0,1,n_nut)
-
-    # exponential window
-    nut[i,:] = nut[i,:] * np.exp(-3*t)
-
-    # spectra and zero-filling
-    spec = np.abs(np.fft.fftshift(
-                  np.fft.fft(nut[i,:], zero_fill*n_nut)))
-
-    imax = np.argmax(spec)
-
-    # find maximum and its frequency
-    res[i] = np.abs(x[imax])
+nut = np.loadtxt('nutation_ydata.txt', dtype=np.complex64)
 
 # resonator frequency axis
 freq = np.loadtxt('nutation_freq.txt')
 
-np.savetxt('resonator_profile_f_211210.txt', freq)
-np.savetxt('resonator_profile_H_f_211210.txt', res)
+# the pulse length increases by 2 ns (first length of the nutation pulse:
+# 12 ns); all nutations are processed at once (baseline correction,
+# exponential window, FFT and parabolic interpolation of the maximum)
+profile = ResonatorProfile.from_nutations(freq, nut, 2e-9)
+profile.save('resonator_profile_f_211210.txt',
+             'resonator_profile_H_f_211210.txt')
+
+# Lorentzian fit
+profile.fit()
+print(f"f0 = {profile.f0:.4f} GHz, Q = {profile.q:.0f},"
+      f" nu1max = {profile.amplitude / 1e6:.1f} MHz")
 
 plt.figure()
-plt.plot(freq, res)
+plt.plot(profile.f, profile.nu1, '.')
+plt.plot(profile.f, profile.model())
 plt.ylim(bottom=0)
 plt.show()
@@ -1,9 +1,10 @@
 # record resonator profile
 
-import os
-import time
+import functools
 import numpy as np
 from esrpoise import xepr_link, param_set
+from esrpoise.parameters import settle
+from esrpoise.scan import scan
 
 xepr = xepr_link.load_xepr()
 
@@ -28,35 +29,47 @@ end_freq = start_freq + nb_pts*nb_steps*0.003
 print('Start frequency: ' + str(start_freq) + ' GHz')
 print('Final frequency: ' + str(end_freq) + ' GHz')
 
-nut = np.empty((nb_pts, 160), dtype=np.complex64)
-freq = np.empty(nb_pts)
-for i in range(nb_pts):
+# index of the point the bridge frequency was last stepped to
+last_point = []
 
-    # read carrier frequency
-    cur_exp = xepr.XeprExperiment()
-    new_freq = cur_exp.getParam("FrequencyMon").value
-    freq[i] = new_freq
 
-    # modify field accordingly
+def step_frequency(callback_pars_dict):
+    """
+    Step the carrier frequency to the point to acquire and set the field from
+    the measured frequency (as the bridge is stepped rather than set, the
+    frequency of each point is only known once measured).
+    """
+    point = int(callback_pars_dict["&point"])
+    if last_point:
+        # carrier frequency stepping
+        for j in range(nb_steps * (point - last_point[-1])):
+            xepr.XeprCmds.aqParStep("AcqHidden", "*cwBridge.Frequency",
+                                    "Coarse 1")
+        # wait until the frequency counter is stable
+        settle(xepr, ["Frequency"])
+    last_point.append(point)
+
+    # read carrier frequency and modify field accordingly
+    new_freq = xepr.XeprExperiment().getParam("FrequencyMon").value
     new_field = new_freq * start_field / start_freq
-    param_set(xepr, ["CenterField"], [new_field], [0.1], exp_f, def_f)
-    time.sleep(1)
+    # (waits for the field to settle)
+    param_set(xepr, ["CenterField"], [new_field], [0.1])
 
     print("")
     print(str(new_freq)+'GHz')
     print(str(new_field)+'G')
 
-    # run experiment
-    data = xepr_link.run2getdata_exp(xepr, "Signal", exp_f)
-
-    # store nutation transient
-    nut[i,:] = data.O.real + 1j * data.O.imag
 
-    # carrier frequency stepping
-    for j in range(nb_steps):
-        xepr.XeprCmds.aqParStep("AcqHidden", "*cwBridge.Frequency", "Coarse 1")
-    time.sleep(3)
+# each nutation transient is saved as soon as it is recorded, with the
+# measured frequency (FrequencyMon): if the scan is interrupted, running this
+# script again resumes it from the first point not acquired. The bridge is
+# not stepped before that point, as it was left at its frequency.
+reader = scan(xepr, ["&point"], np.arange(nb_pts), [1],
+              'nutation.arc', exp_f, def_f,
+              acquire=functools.partial(xepr_link.run2getdata_exp,
+                                        SignalType="Signal", exp_name=exp_f),
+              monitors=["FrequencyMon"], callback=step_frequency)
 
 # save data
-np.savetxt('nutation_freq.txt', freq)
-np.savetxt('nutation_ydata.txt', nut)
+np.savetxt('nutation_freq.txt', reader.values[:, 1])
+np.savetxt('nutation_ydata.txt', reader.stack().astype(np.complex64))
@@ -21,18 +21,22 @@ setup(
     url="https://github.com/foroozandehgroup/esrpoise",
     packages=find_packages(exclude=["tests"]),
     classifiers=[
-        "Programming Language :: Python :: 3.6",
         "Programming Language :: Python :: 3.7",
         "Programming Language :: Python :: 3.8",
         "Programming Language :: Python :: 3.9",
         "License :: OSI Approved :: GNU General Public License v3 or later (GPLv3+)",
         "Operating System :: OS Independent",
     ],
-    python_requires=">=3.6",
+    python_requires=">=3.7",
     install_requires=[
         "numpy>=1.17.0",
-        "XeprAPI",
-        "Py-BOBYQA",
-    ]
+    ],
+    # XeprAPI is only needed to control the spectrometer, and Py-BOBYQA for
+    # the "bobyqa" optimiser: esrpoise[all] installs both
+    extras_require={
+        "xepr": ["XeprAPI"],
+        "bobyqa": ["Py-BOBYQA"],
+        "all": ["XeprAPI", "Py-BOBYQA"],
+    },
 
 )
@@ -0,0 +1,17 @@
+import pytest
+
+from esrpoise import parameters, xepr_link
+
+
+@pytest.fixture(autouse=True)
+def no_settle_time(monkeypatch):
+    # the simulated hardware does not need to settle
+    monkeypatch.setattr(parameters, "BUILTIN_PARAMETERS", {
+        name: par._replace(settle_time=0, monitor=None)
+        for name, par in parameters.BUILTIN_PARAMETERS.items()})
+
+
+@pytest.fixture(autouse=True)
+def no_compilation_time(monkeypatch):
+    # the simulated experiments are not compiled
+    monkeypatch.setattr(xepr_link, "COMPILATION_TIME", 0)
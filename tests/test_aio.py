@@ -0,0 +1,88 @@
+import asyncio
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from esrpoise import aio
+from esrpoise.costfunctions import (maxrealint_echo, minabsmax_echo,
+                                    MultiObjective)
+from esrpoise.simulator import SimulatedXepr
+
+
+def response(params):
+    return np.full(4, -(params["ftBridge.Attenuation"] - 3) ** 2)
+
+
+def test_io_wrappers():
+    sim = SimulatedXepr(lambda params: np.arange(4))
+
+    async def acquire():
+        data = await aio.run2getdata_exp(sim)
+        thread = await aio.run_io(threading.current_thread)
+        return data, thread
+
+    data, thread = asyncio.run(acquire())
+    assert np.allclose(data.O, np.arange(4))
+    assert thread is not threading.current_thread()
+    assert thread.name.startswith("xepr-io")
+
+
+def test_optimise_async():
+    sim = SimulatedXepr(response, acq_time=0.001)
+    ticks = []
+
+    async def ticker():
+        while True:
+            ticks.append(time.monotonic())
+            await asyncio.sleep(0.005)
+
+    async def main():
+        tick_task = asyncio.create_task(ticker())
+        result = await aio.optimise_async(
+            sim, ["Attenuation"], [10], [0], [20], [0.5], maxrealint_echo,
+            optimiser="nm")
+        tick_task.cancel()
+        return result
+
+    xbest, fbest, message = asyncio.run(main())
+    assert np.isclose(xbest[0], 3, atol=0.5)
+    # the event loop kept running during the optimisation
+    assert len(ticks) > 2
+
+
+def test_optimise_async_cancel():
+    sim = SimulatedXepr(response, acq_time=0.02)
+    nruns = []
+
+    async def main():
+        task = asyncio.create_task(aio.optimise_async(
+            sim, ["Attenuation"], [10], [0], [20], [0.5], maxrealint_echo,
+            optimiser="nm"))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        nruns.append(sim.nruns)
+        # the optimisation has stopped and the I/O thread is available
+        await aio.run2getdata_exp(sim)
+
+    asyncio.run(main())
+    assert 0 < nruns[0] < 20
+    assert sim.nruns == nruns[0] + 1
+
+
+def test_optimise_async_multiobjective():
+    sim = SimulatedXepr(response)
+    multiobjective = MultiObjective([maxrealint_echo, minabsmax_echo])
+
+    async def main():
+        return await aio.optimise_async(
+            sim, ["Attenuation"], [10], [0], [20], [0.5], multiobjective,
+            optimiser="nm")
+
+    xbest, fbest, message = asyncio.run(main())
+    assert np.isclose(xbest[0], 3, atol=0.5)
+    assert len(multiobjective.points) == sim.nruns
+    assert len(multiobjective.pareto_front()) > 0
@@ -0,0 +1,125 @@
+import os
+import time
+
+import numpy as np
+import pytest
+
+from esrpoise import optimise
+from esrpoise.archive import ArchiveError, ArchiveReader, ArchiveWriter
+from esrpoise.costfunctions import maxabsint, maxabsint_echo, maxrealint_echo
+from esrpoise.simulator import SimulatedXepr
+
+
+class Data():
+    def __init__(self, y):
+        setattr(self, "O", y)
+        self.X = np.arange(np.size(y), dtype=float)
+
+
+def test_write_read(tmp_path):
+    path = os.path.join(tmp_path, "run.arc")
+    traces = [np.arange(5) * (1 + 1j) * k for k in range(40)]
+    with ArchiveWriter(path, ["p0", "p1"], chunk_size=8,
+                       max_pending=4) as writer:
+        for k, trace in enumerate(traces):
+            writer.write([k, 2 * k], Data(trace), -k)
+        writer.write([0, 0], Data(np.ones(3)), 1.5)  # real-valued trace
+    assert writer.nrecords == 41
+
+    reader = ArchiveReader(path)
+    assert reader.pars == ["p0", "p1"]
+    assert len(reader) == 41
+    assert np.allclose(reader.values[:40, 1], 2 * np.arange(40))
+    assert np.allclose(reader.costs[:40], -np.arange(40))
+    assert np.all(np.diff(reader.timestamps) >= 0)
+    assert isinstance(reader[3].O, np.memmap)
+    assert np.allclose(reader[3].O, traces[3])
+    assert np.allclose(reader[3].X, np.arange(5))
+    assert not np.iscomplexobj(reader[40].O)
+    assert np.allclose(reader[40].O, 1)
+    cf_vals = reader.reanalyse(lambda data: np.sum(data.X))
+    assert np.allclose(cf_vals, [10] * 40 + [3])
+
+
+def test_interrupted_record(tmp_path):
+    path = os.path.join(tmp_path, "run.arc")
+    with ArchiveWriter(path, ["p0"]) as writer:
+        for k in range(3):
+            writer.write([k], Data(np.ones(100)), k)
+    # simulate a crash in the middle of the last record
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) - 10)
+    reader = ArchiveReader(path)
+    assert len(reader) == 2
+    assert np.allclose(reader.costs, [0, 1])
+
+    # appending overwrites the interrupted record
+    with ArchiveWriter(path, ["p0"], append=True) as writer:
+        writer.write([5], Data(np.arange(4)), 5)
+    reader = ArchiveReader(path)
+    assert np.allclose(reader.costs, [0, 1, 5])
+    assert np.allclose(reader[2].O, np.arange(4))
+    assert reader.end == os.path.getsize(path)
+    with pytest.raises(ArchiveError):
+        ArchiveWriter(path, ["p1"], append=True)
+
+
+def test_2d_dataset(tmp_path):
+    # the abscissa of a 2D dataset has one point per column
+    path = os.path.join(tmp_path, "run.arc")
+    data = Data(np.arange(12).reshape(3, 4) * 1j)
+    data.X = np.arange(4, dtype=float)
+    with ArchiveWriter(path, ["p0"]) as writer:
+        writer.write([0], data, 0)
+        writer.write([1], Data(np.ones(5)), 1)
+    reader = ArchiveReader(path)
+    assert np.allclose(reader[0].O, np.arange(12) * 1j)
+    assert np.allclose(reader[0].X, np.arange(4))
+    assert np.allclose(reader[1].O, 1)
+    assert reader[1].X.size == 5
+
+
+def test_empty_archive(tmp_path):
+    # e.g. a scan interrupted before its first point
+    path = os.path.join(tmp_path, "run.arc")
+    ArchiveWriter(path, ["p0"]).close()
+    reader = ArchiveReader(path)
+    assert len(reader) == 0
+    assert reader.stack().shape == (0, 0)
+    assert reader.reanalyse(maxabsint).size == 0
+
+
+def test_optimise_archive(tmp_path):
+    path = os.path.join(tmp_path, "run.arc")
+    sim = SimulatedXepr(lambda params: np.full(
+        4, -(params["ftBridge.Attenuation"] - 3) ** 2 + 1j))
+    with ArchiveWriter(path, ["Attenuation"]) as writer:
+        optimise(sim, ["Attenuation"], [10], [0], [20], [0.5],
+                 maxrealint_echo, optimiser="nm", archive=writer)
+    reader = ArchiveReader(path)
+    assert len(reader) == sim.nruns
+    # same run, other cost function, without acquiring again
+    cf_vals = reader.reanalyse(maxabsint_echo)
+    assert np.allclose(cf_vals, [maxabsint_echo(data) for data in reader])
+    assert np.allclose(reader.reanalyse(maxrealint_echo), reader.costs)
+
+
+def test_batch_reanalyse(tmp_path):
+    path = os.path.join(tmp_path, "scan.arc")
+    rng = np.random.default_rng(0)
+    traces = rng.standard_normal((10000, 64)) + 0.5j
+    with ArchiveWriter(path, ["p0"], chunk_size=1000,
+                       max_pending=1000) as writer:
+        for k, trace in enumerate(traces):
+            writer.write([k], Data(trace), 0)
+    reader = ArchiveReader(path)
+    stacked = reader.stack()
+    assert np.shares_memory(stacked, reader.buffer)
+    assert np.allclose(stacked, traces)
+
+    tic = time.perf_counter()
+    cf_vals = reader.reanalyse(maxabsint, chunk_size=3000)
+    batch_time = time.perf_counter() - tic
+    assert np.allclose(cf_vals[:100],
+                       [maxabsint(Data(trace)) for trace in traces[:100]])
+    assert batch_time < 0.5
@@ -0,0 +1,75 @@
+import os
+
+import numpy as np
+import pytest
+
+from esrpoise.benchmark import (FieldOffsetProblem, NutationProblem,
+                                Problem, PulseProblem, default_problems,
+                                run_trial, run_benchmark, summarise,
+                                save_results, load_results, compare)
+from esrpoise.parameters import register_parameter
+
+
+def test_problems():
+    for problem in default_problems(noise=0):
+        assert np.isclose(problem.response(problem.xopt), -1)
+        assert problem.within_tol(problem.xopt + 0.9 * problem.tol)
+        assert not problem.within_tol(problem.xopt + 1.1 * problem.tol)
+        x0 = problem.initial_point(np.random.default_rng(0))
+        assert np.all(x0 >= problem.lb) and np.all(x0 <= problem.ub)
+    # quantisation
+    problem = NutationProblem(noise=0)
+    rng = np.random.default_rng(0)
+    assert problem.cost(np.array([20.0]), rng) == \
+        problem.cost(np.array([20.01]), rng)
+
+    # a problem without response() cannot be instantiated
+    class IncompleteProblem(Problem):
+        pass
+
+    with pytest.raises(TypeError):
+        IncompleteProblem([0], [1], [0.1], [0.5])
+
+
+def test_run_trial():
+    trial = run_trial(PulseProblem(2), "nm", seed=1)
+    assert trial["success"]
+    assert 0 < trial["fevals_to_tol"] <= trial["nfev"]
+    # no compilation (cf. conftest.py), out of bounds points not acquired
+    assert 0 < trial["wall_time"] <= trial["nfev"]
+    # reproducible
+    assert run_trial(PulseProblem(2), "nm", seed=1) == trial
+
+    # the settle and compilation waits are included
+    trial = run_trial(NutationProblem(), "bobyqa", seed=1)
+    assert trial["wall_time"] == trial["nfev"]
+    register_parameter("CenterField", "fieldCtrl.CenterField", layer=None,
+                       settle_time=1)  # removed by conftest.py
+    trial = run_trial(FieldOffsetProblem(), "bobyqa", seed=1)
+    assert trial["nfev"] < trial["wall_time"] <= 2 * trial["nfev"]
+    problem = PulseProblem(2)
+    problem.compilation_time = 1
+    assert problem.setup_time([0, 1]) == 2
+    trial = run_trial(problem, "bobyqa", seed=1)
+    assert trial["nfev"] < trial["wall_time"] <= 3 * trial["nfev"]
+
+
+def test_benchmark(tmp_path):
+    problems = [NutationProblem(), PulseProblem(2)]
+    trials = run_benchmark(problems, ["nm", "bobyqa"], range(4),
+                           max_workers=2)
+    assert len(trials) == 16
+    assert trials == run_benchmark(problems, ["nm", "bobyqa"], range(4),
+                                   max_workers=0)
+    summary = summarise(trials)
+    assert summary["pulse2d/nm"]["ntrials"] == 4
+    assert summary["pulse2d/nm"]["median_fevals_to_tol"] <= \
+        summary["pulse2d/nm"]["tail_fevals_to_tol"]
+
+    path = os.path.join(tmp_path, "results.json")
+    save_results(trials, path)
+    reference = load_results(path)
+    assert compare(trials, reference) == []
+    worse = [dict(trial, fevals_to_tol=None) for trial in trials]
+    regressions = compare(worse, reference)
+    assert any(r.startswith("nutation/nm: median") for r in regressions)
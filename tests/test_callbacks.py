@@ -0,0 +1,70 @@
+import threading
+
+import numpy as np
+import pytest
+
+from esrpoise import optimise
+from esrpoise.callbacks import PrefetchCallback
+from esrpoise.simulator import SimulatedXepr
+
+
+def test_prefetch_callback():
+    synthesised, applied = [], []
+    main_thread = threading.get_ident()
+
+    def synthesise(pars_dict, offset):
+        synthesised.append((pars_dict["&a"], threading.get_ident()))
+        return pars_dict["&a"] + offset
+
+    def apply(artefacts, pars_dict, offset):
+        applied.append(artefacts)
+
+    cb = PrefetchCallback(synthesise, apply)
+    # not prefetched: synthesised synchronously
+    cb({"&a": 1.0}, 10)
+    assert applied == [11.0]
+    assert synthesised[-1][1] == main_thread
+    assert (cb.hits, cb.misses) == (0, 1)
+
+    # prefetched: synthesised on the worker thread
+    cb.prefetch([{"&a": 2.0}, {"&a": 3.0}], 10)
+    cb({"&a": 3.0}, 10)
+    assert applied == [11.0, 13.0]
+    assert (cb.hits, cb.misses) == (1, 1)
+    assert all(thread != main_thread for _, thread in synthesised[1:])
+
+    # stale predictions are discarded by the next prefetch
+    cb.prefetch([{"&a": 4.0}], 10)
+    assert list(cb.pending) == [cb.key({"&a": 4.0})]
+    cb.close()
+    assert cb.pending == {}
+
+
+def test_prefetch_callback_error():
+    def synthesise(pars_dict):
+        raise ValueError("bad shape")
+
+    cb = PrefetchCallback(synthesise, lambda *args: None)
+    cb.prefetch([{"&a": 1.0}])
+    with pytest.raises(ValueError, match="bad shape"):
+        cb({"&a": 1.0})
+    cb.close()
+
+
+def test_prefetch_callback_optimise():
+    state = {}
+
+    def apply(artefacts, pars_dict):
+        state["a"] = artefacts
+
+    sim = SimulatedXepr(lambda params: np.full(4, -(state["a"] - 3) ** 2))
+    cb = PrefetchCallback(lambda pars_dict: pars_dict["&a"], apply)
+    xbest, _, _ = optimise(sim, ["&a"], [10], [0], [20], [0.5],
+                           lambda data: -np.sum(data.O.real),
+                           optimiser="nm", callback=cb)
+    assert abs(xbest[0] - 3) <= 0.5
+    # every point acquired had been prefetched (the final setting of the
+    # best values excepted), and nothing is left pending after the run
+    assert cb.misses <= 1
+    assert cb.pending == {}
+    cb.close()
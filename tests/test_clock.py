@@ -0,0 +1,77 @@
+import asyncio
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+
+from esrpoise import aio, optimise, xepr_link
+from esrpoise.clock import Clock, VirtualClock, get_clock, use_clock
+from esrpoise.costfunctions import maxrealint_echo
+from esrpoise.simulator import SimulatedXepr
+
+
+def test_virtual_clock():
+    clock = VirtualClock(start=1000)
+    clock.sleep(3600)
+    clock.advance(-1)  # time never goes backwards
+    assert clock.time() == 4600
+    assert clock.elapsed == 3600
+    assert clock.now().timestamp() == 4600
+
+    assert type(get_clock()) is Clock
+    with use_clock(clock):
+        assert get_clock() is clock
+        xepr_link.wait_exp(SimulatedXepr(lambda params: np.ones(2)))
+    assert type(get_clock()) is Clock
+
+
+def test_virtual_optimise(tmp_path, capsys, monkeypatch):
+    # real compilation waits and 1 min acquisitions, simulated instantly
+    monkeypatch.setattr(xepr_link, "COMPILATION_TIME", 1)
+    def_file = str(tmp_path / "test.def")
+    exp_file = str(tmp_path / "test.exp")
+    shutil.copy(os.path.join(os.getcwd(), 'tests', 'def_file_test.def'),
+                def_file)
+    shutil.copy(os.path.join(os.getcwd(), 'tests', 'exp_file_test.exp'),
+                exp_file)
+    sim = SimulatedXepr(lambda params: np.full(4, -(params["p1"] - 50) ** 2),
+                        acq_time=60)
+    tic = time.time()
+    with use_clock(VirtualClock()) as clock:
+        xbest, fbest, message = optimise(
+            sim, ["p1"], [40], [20], [80], [1], maxrealint_echo,
+            exp_file=exp_file, def_file=def_file, optimiser="nm")
+    assert time.time() - tic < 5
+    assert np.isclose(xbest[0], 50, atol=1)
+    # acquisitions plus .def and .exp compilation waits
+    assert clock.elapsed >= sim.nruns * 62
+    hours = int(clock.elapsed // 3600)
+    assert f"Total time taken            - {hours}:" in capsys.readouterr().out
+
+
+def test_clock_per_thread():
+    # a clock installed in one thread does not affect the others
+    installed, release = threading.Event(), threading.Event()
+    clocks = []
+
+    def run():
+        with use_clock(VirtualClock()):
+            installed.set()
+            release.wait(5)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    installed.wait(5)
+    clocks.append(get_clock())
+    release.set()
+    thread.join()
+    assert type(clocks[0]) is Clock
+
+    # the clock is passed on to the I/O thread of aio
+    async def io_clock():
+        return await aio.run_io(get_clock)
+
+    with use_clock(VirtualClock()) as clock:
+        assert asyncio.run(io_clock()) is clock
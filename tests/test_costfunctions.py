@@ -0,0 +1,235 @@
+import numpy as np
+import pytest
+
+from esrpoise import costfunctions
+from esrpoise.costfunctions import DatasetView, as_view
+
+
+class CountingDataset():
+    # counts the accesses to O, like XeprAPI fetching the data each time
+    def __init__(self, y):
+        self.y = y
+        self.X = np.arange(y.size, dtype=float)
+        self.fetches = 0
+        self.Y = "other attribute"
+
+    def fetch(self):
+        self.fetches += 1
+        return self.y
+
+
+# setattr() as pycodestyle objects to the XeprAPI attribute name
+setattr(CountingDataset, "O", property(CountingDataset.fetch))
+
+
+def trace():
+    t = np.linspace(-1, 1, 64)
+    return np.exp(-t ** 2 / 0.1) * (np.cos(3 * t) + 0.4j * np.sin(5 * t))
+
+
+def test_dataset_view():
+    data = CountingDataset(trace())
+    view = DatasetView(data)
+    assert data.fetches == 1
+    assert view.trace.flags.c_contiguous
+    assert np.shares_memory(view.real, view.trace)
+    assert view.Y == "other attribute"
+    assert view.spectrum is view.spectrum
+    assert np.allclose(view.spectrum, np.fft.fft(trace()))
+    assert np.allclose(view.magnitude, np.abs(trace()))
+    with pytest.raises(ValueError):
+        view.magnitude[0] = 0
+    assert np.isclose(view.baseline,
+                      np.mean(np.r_[trace()[:6], trace()[-6:]]))
+    assert as_view(view) is view
+    assert data.fetches == 1
+
+    # O is left as given by XeprAPI for user cost functions
+    real_view = DatasetView(CountingDataset(np.arange(4.)))
+    assert np.sum(real_view.O) == 6.0
+    assert not np.iscomplexobj(np.sum(real_view.O))
+    assert np.iscomplexobj(real_view.trace)
+    real_view.O -= 1.5  # e.g. baseline subtraction in place
+    assert real_view.O[0] == -1.5
+
+
+def test_cost_functions_view():
+    names = [name for name in dir(costfunctions)
+             if (name.startswith("min") or name.startswith("max")
+                 or name.startswith("zero"))]
+    assert len(names) > 20
+    view = DatasetView(CountingDataset(trace()))
+    for name in names:
+        cf = getattr(costfunctions, name)
+        data = CountingDataset(trace())
+        assert np.isclose(cf(data), cf(view)), name
+    # real-valued traces
+    real_data = CountingDataset(trace().real)
+    assert np.isclose(costfunctions.minimagint_echo(real_data), 0)
+
+
+def test_batch():
+    rng = np.random.default_rng(0)
+    traces = rng.standard_normal((50, 64)) + 1j * rng.standard_normal((50,
+                                                                       64))
+    names = [name for name in dir(costfunctions)
+             if (name.startswith("min") or name.startswith("max")
+                 or name.startswith("zero"))]
+    for name in names:
+        cf = getattr(costfunctions, name)
+        expected = [cf(CountingDataset(trace)) for trace in traces]
+        assert np.allclose(costfunctions.batch(cf)(traces), expected), name
+    # list of datasets
+    datasets = [CountingDataset(trace) for trace in traces[:3]]
+    assert np.allclose(costfunctions.batch(costfunctions.maxabsint)(datasets),
+                       [costfunctions.maxabsint(data) for data in datasets])
+
+
+def test_register_batch():
+    def my_cf(data):
+        return -np.max(data.O.real)
+
+    # not registered: evaluated trace by trace
+    traces = np.arange(12).reshape(3, 4)
+    assert np.allclose(costfunctions.batch(my_cf)(traces), [-3, -7, -11])
+
+    @costfunctions.register_batch(my_cf)
+    def my_cf_batch(traces):
+        return -np.max(traces.real, axis=1)
+    assert costfunctions.BATCH_COST_FUNCTIONS[my_cf] is my_cf_batch
+    assert np.allclose(costfunctions.batch(my_cf)(traces), [-3, -7, -11])
+    del costfunctions.BATCH_COST_FUNCTIONS[my_cf]
+
+
+def min_diff_FS(data, FS):
+    # previous per-evaluation implementation (examples/chorus_res_comp.py)
+    echo = data.O.real + 1j * data.O.imag
+    echo = np.interp(np.linspace(1, len(echo), 8*len(echo)),
+                     np.linspace(1, len(echo), len(echo)),
+                     echo)
+    imax = np.argmax(np.abs(echo))
+    echo = echo[imax:]
+    echo[1] = echo[1]/2
+    spec = np.fft.fftshift(np.fft.fft(echo, n=8*len(echo)))
+    spec_ph = spec
+    for phi0 in np.linspace(-180, 180, 4*360+1):
+        spec_phi0 = spec * np.exp(-1j * phi0 * np.pi/180)
+        if sum(np.real(spec_phi0)) > sum(np.real(spec_ph)):
+            spec_ph = spec_phi0
+    spec = np.real(spec_ph)
+    spec = spec/np.max(spec)
+    sf = 1 / (0.5e-9/8)
+    x_spec = np.linspace(-sf / 2, sf / 2, len(spec))
+    spec = np.interp(FS[:, 0], x_spec, spec)
+    return np.linalg.norm(FS[:, 1] - spec)
+
+
+def test_reference_spectrum():
+    FS = np.loadtxt("examples/FS_inverted.txt", delimiter=' ')
+    FS[:, 0] = FS[:, 0] * 1e9
+    FS[:, 1] = FS[:, 1] - FS[1, 1]
+    FS[:, 1] = FS[:, 1]/np.max(FS[:, 1])
+    cf = costfunctions.reference_cost(FS, dt=0.5e-9)
+
+    t = np.arange(256) * 0.5e-9
+    for phase in [2]:
+        echo = (np.exp(-((t - 40e-9) / 15e-9) ** 2 + 1j * phase)
+                * np.exp(2j * np.pi * 20e6 * t))
+        data = CountingDataset(echo)
+        assert np.isclose(cf(data), min_diff_FS(data, FS), rtol=1e-3)
+    assert cf.process(data).shape == FS[:, 1].shape
+
+
+def test_reference_echo():
+    echo = trace()
+    cf = costfunctions.reference_cost(3 * echo)
+    assert np.isclose(cf(CountingDataset(0.2j * echo)), 0)
+    assert cf(CountingDataset(echo + 0.1)) > 0.1
+    with pytest.raises(ValueError):
+        cf(CountingDataset(echo[:10]))
+
+
+def noisy_echoes(n, amplitude=1, seed=0):
+    rng = np.random.default_rng(seed)
+    t = np.arange(512)
+    echo = amplitude * np.exp(-((t - 300) / 10) ** 2)
+    noise = rng.standard_normal((n, 512)) + 1j * rng.standard_normal(
+        (n, 512))
+    return echo + 0.2 * noise
+
+
+def test_detect_echo_window():
+    t = np.arange(512)
+    echo = np.exp(-((t - 300) / 10) ** 2 * np.log(2))  # FWHM of 20 points
+    window = costfunctions.detect_echo_window(echo, margin=0.5)
+    assert window.start == 279 and window.stop == 322
+    window = costfunctions.detect_echo_window(echo[:305], margin=0)
+    assert window.stop == 305
+
+
+def test_echo_window_snr():
+    traces = noisy_echoes(200)
+    cf = costfunctions.EchoWindowIntegral("real")
+    values = costfunctions.batch(cf)(traces)
+    assert cf.window == costfunctions.detect_echo_window(traces[0])
+    assert np.allclose(values[:5], [cf(CountingDataset(trace))
+                                    for trace in traces[:5]])
+    full = costfunctions.batch(costfunctions.maxrealint_echo)(traces)
+    # same signal, much less noise
+    assert np.isclose(np.mean(values), np.mean(full), rtol=0.1)
+    assert np.std(values) < 0.5 * np.std(full)
+
+    # a new run detects the window again
+    cf.reset()
+    assert cf.window is None
+    cf(CountingDataset(np.roll(traces[0], -100)))
+    assert cf.window.start == costfunctions.detect_echo_window(
+        traces[0]).start - 100
+
+    cf = costfunctions.EchoWindowIntegral("abs", window=slice(0, 10))
+    cf.reset()
+    assert cf.window == slice(0, 10)
+
+
+def test_matched_filter():
+    t = np.arange(512)
+    echo = np.exp(-((t - 300) / 10) ** 2)
+    cf = costfunctions.MatchedFilter(reference=echo)
+    assert np.isclose(np.linalg.norm(cf.template), 1)
+    values = costfunctions.batch(cf)(noisy_echoes(200))
+    assert np.isclose(cf(CountingDataset(echo)), -np.linalg.norm(echo))
+    # the output is proportional to the echo amplitude
+    weaker = costfunctions.batch(cf)(noisy_echoes(200, amplitude=0.5))
+    assert np.isclose(np.mean(weaker) / np.mean(values), 0.5, rtol=0.1)
+    # template from the first acquisition, phase-insensitive
+    cf = costfunctions.MatchedFilter(phase_sensitive=False)
+    value = cf(CountingDataset(1j * echo))
+    assert cf.template is not None
+    assert np.isclose(value, -np.linalg.norm(echo), rtol=1e-3)
+    cf.reset()
+    assert cf.template is None
+    cf = costfunctions.MatchedFilter(reference=echo)
+    template = cf.template
+    cf.reset()
+    assert cf.template is template
+    with pytest.raises(ValueError):
+        costfunctions.MatchedFilter(reference=np.zeros(512))
+
+
+def test_multiobjective():
+    mo = costfunctions.MultiObjective(
+        {"real": costfunctions.maxrealint_echo,
+         "imag": costfunctions.zeroimagint_echo}, weights=[1, 2])
+    data = CountingDataset(np.array([1 + 1j, 2 - 3j]))
+    assert np.isclose(mo(data), -3 + 2 * 2)
+    assert data.fetches == 1
+    assert np.allclose(mo.last_scores, [-3, 2])
+
+    scores = [[0, 3], [1, 1], [2, 2], [3, 0], [1, 1], [0, 4]]
+    for k, score in enumerate(scores):
+        mo.last_scores = np.array(score, dtype=float)
+        mo.record([k])
+    points, front = mo.pareto_front()
+    assert sorted(points[:, 0]) == [0, 1, 3, 4]
+    assert mo.best("imag")[0] == 3
+    assert mo.best(0)[0] in [0, 5]
@@ -0,0 +1,34 @@
+import subprocess
+import sys
+
+
+def run(code):
+    return subprocess.run([sys.executable, "-c", code], check=True,
+                          capture_output=True, text=True).stdout
+
+
+def test_import_time():
+    # esrpoise itself (numpy excluded) loads in less than 100 ms, without
+    # importing the hardware interface or the optimiser backends
+    out = run("import time, sys\n"
+              "import numpy\n"
+              "tic = time.perf_counter()\n"
+              "import esrpoise, esrpoise.costfunctions, esrpoise.optpoise\n"
+              "print(time.perf_counter() - tic)\n"
+              "print(' '.join(sorted(m for m in ['XeprAPI', 'pybobyqa',"
+              " 'scipy'] if m in sys.modules)))\n")
+    import_time, loaded = out.split("\n")[:2]
+    assert float(import_time) < 0.1
+    assert loaded == ""
+
+
+def test_import_without_xeprapi():
+    out = run("import sys\n"
+              "sys.modules['XeprAPI'] = None  # not installed\n"
+              "from esrpoise import xepr_link, optimise\n"
+              "print(xepr_link.experiment_error())\n"
+              "try:\n"
+              "    xepr_link.load_xepr()\n"
+              "except ImportError:\n"
+              "    print('ImportError')\n")
+    assert out.split("\n")[:2] == ["()", "ImportError"]
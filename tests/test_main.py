@@ -1,5 +1,16 @@
+import os
+import shutil
+import threading
+
 import numpy as np
-from esrpoise import round2tol_str
+import pytest
+
+from esrpoise import (optimise, round2tol_str, param_set, ParamState,
+                      current_run, snap2tol, ParameterSpace)
+from esrpoise.optpoise import scale, unscale
+from esrpoise.costfunctions import (maxrealint_echo, zeroimagint_echo,
+                                    EchoWindowIntegral, MultiObjective)
+from esrpoise.simulator import SimulatedXepr
 
 
 def test_round2tol_str():
@@ -18,3 +29,152 @@ def test_round2tol_str():
     expected_rounded_value = ['56.04']
     rounded_value = round2tol_str(value_list, tol)
     assert rounded_value == expected_rounded_value
+
+    # decimals of the tolerances, including exponent notation
+    assert round2tol_str([0.15, 2.6e6, 1.23e-5, -0.01],
+                         [0.049, 1e6, 1e-5, 0.1]) == \
+        ['0.147', '3000000', '0.00001', '0.0']
+
+
+def test_parameter_space():
+    lb, ub, tol = [0, -5, 1e6], [1, 5, 5e7], [0.049, 0.2, 1e6]
+    space = ParameterSpace(["a", "b", "c"], lb, ub, tol)
+    val = [0.3, 1.23, 2.2e7]
+    x = scale(val, lb, ub, tol, scaleby="tols")[0]
+    assert np.allclose(space.scale(val), x)
+    assert np.allclose(space.unscale(x), unscale(x, lb, ub, tol,
+                                                 scaleby="tols"))
+    # several points at once
+    xs = np.array([x, 2 * x])
+    assert np.allclose(space.unscale(xs)[1], unscale(2 * x, lb, ub, tol,
+                                                     scaleby="tols"))
+    assert list(space.in_bounds(space.unscale(xs))) == [True, False]
+    # snapped values are the floats closest to the decimal multiples
+    assert list(space.snap(val)) == [0.294, 1.2, 2.2e7]
+    assert np.array_equal(snap2tol([val, val], tol), [space.snap(val)] * 2)
+    assert space.format(val) == ['0.294', '1.2', '22000000']
+
+
+def test_param_set_dirty_tracking(tmp_path):
+    def_file = tmp_path / "test.def"
+    exp_file = tmp_path / "test.exp"
+    shutil.copy(os.path.join(os.getcwd(), 'tests', 'def_file_test.def'),
+                def_file)
+    shutil.copy(os.path.join(os.getcwd(), 'tests', 'exp_file_test.exp'),
+                exp_file)
+    sim = SimulatedXepr(lambda params: np.ones(4))
+    state = ParamState()
+    pars, tol = ["Attenuation", "p1"], [0.1, 2]
+    param_set(sim, pars, [10, 50], tol, str(exp_file), str(def_file),
+              param_state=state)
+    assert len(sim.log) > 0
+    # nothing changed once rounded: nothing sent to Xepr
+    sim.log.clear()
+    param_set(sim, pars, [10.01, 50.2], tol, str(exp_file),
+              str(def_file), param_state=state)
+    assert sim.log == []
+    # only the built-in parameter changed: no compilation
+    param_set(sim, pars, [10.2, 50.2], tol, str(exp_file),
+              str(def_file), param_state=state)
+    assert sim.log == [("aqParSet", "AcqHidden", "ftBridge.Attenuation",
+                        "10.2")]
+    # reset: built-in parameters restored
+    sim.cut()
+    state.restore(sim)
+    assert sim.params["ftBridge.Attenuation"] == "10.2"
+    state.invalidate()
+    sim.log.clear()
+    param_set(sim, pars, [10.2, 50.2], tol, str(exp_file),
+              str(def_file), param_state=state)
+    assert ("aqPgDefLoad", str(def_file)) in sim.log
+
+
+def test_param_set_failure():
+    sim = SimulatedXepr(lambda params: np.ones(4))
+    state = ParamState()
+    # .def file parameter without def_file: nothing is recorded as applied
+    with pytest.raises(ValueError):
+        param_set(sim, ["p0"], [10], [1], param_state=state)
+    assert state.applied == {}
+
+    # failing callback: the built-in parameter set before it is recorded
+    def callback(pars_dict):
+        raise RuntimeError("shape synthesis failed")
+
+    with pytest.raises(RuntimeError):
+        param_set(sim, ["Attenuation", "&x"], [10, 1], [1, 1],
+                  callback=callback, param_state=state)
+    assert state.applied == {"Attenuation": "10"}
+
+
+def test_optimise_multiobjective():
+    def response(params):
+        phase = np.radians(params["cwBridge.SignalPhase"] - 40)
+        return np.full(8, np.exp(1j * phase))
+
+    sim = SimulatedXepr(response)
+    xbest, fbest, message = optimise(
+        sim, ["SignalPhase"], [20], [0], [90], [1],
+        [maxrealint_echo, zeroimagint_echo], optimiser="nm")
+    assert np.isclose(xbest[0], 40, atol=1)
+
+    # the scores of the run are available from the MultiObjective passed
+    mo = MultiObjective([maxrealint_echo, zeroimagint_echo])
+    mo.points.append(np.zeros(1))  # point of a previous run
+    sim = SimulatedXepr(response)
+    xbest, fbest, message = optimise(
+        sim, ["SignalPhase"], [20], [0], [90], [1], mo, optimiser="nm")
+    assert np.isclose(xbest[0], 40, atol=1)
+    assert len(mo.points) == sim.nruns
+    assert np.isclose(mo.best("maxrealint_echo")[0], 40, atol=1)
+    points, scores = mo.pareto_front()
+    assert scores.shape[1] == 2
+    assert np.all(np.abs(points[:, 0] - 40) <= 15)
+
+
+def test_optimise_resets_cost_function():
+    # the echo window detected in a previous run is not reused
+    def response(params):
+        amplitude = 1 - (params["ftBridge.Attenuation"] - 3) ** 2 / 100
+        return amplitude * np.exp(-((np.arange(64) - 40) / 4) ** 2)
+
+    cf = EchoWindowIntegral("real")
+    cf.window = slice(0, 8)  # window of a previous run, without the echo
+    sim = SimulatedXepr(response)
+    xbest, _, _ = optimise(sim, ["Attenuation"], [10], [0], [20], [0.5], cf,
+                           optimiser="nm")
+    assert cf.window.start <= 40 < cf.window.stop
+    assert np.isclose(xbest[0], 3, atol=0.5)
+
+
+def test_optimise_concurrent_runs():
+    # two optimisations in threads: each has its own count and budget
+    def response(params):
+        phase = np.radians(params["cwBridge.SignalPhase"] - 40)
+        return np.full(8, np.exp(1j * phase))
+
+    def run(maxfev, results):
+        sim = SimulatedXepr(response, acq_time=0.001)
+        calls = []
+
+        def callback(pars_dict):
+            run = current_run()
+            calls.append(None if run is None else run.calls)
+
+        optimise(sim, ["SignalPhase"], [20], [0], [90], [1],
+                 maxrealint_echo, optimiser="brute", maxfev=maxfev,
+                 callback=callback)
+        results[maxfev] = (sim.nruns, calls)
+
+    results = {}
+    threads = [threading.Thread(target=run, args=(maxfev, results))
+               for maxfev in (10, 25)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for maxfev, (nruns, calls) in results.items():
+        assert nruns == maxfev
+        # the last call sets the best values, after the run
+        assert calls == list(range(maxfev)) + [None]
+    assert current_run() is None
@@ -2,12 +2,15 @@ import numpy as np
 import pytest
 
 from esrpoise.optpoise import (nelder_mead,
+                               surrogate_nelder_mead,
                                multid_search,
                                pybobyqa_interface,
                                brute_force,
-                               deco_count,
+                               RunContext,
+                               MaxFevalsReached,
                                scale,
                                unscale,
+                               QuadraticSurrogate,
                                MESSAGE_OPT_SUCCESS,
                                MESSAGE_OPT_MAXFEV_REACHED,
                                MESSAGE_OPT_MAXITER_REACHED)
@@ -72,18 +75,29 @@ def test_scale_unscale():
         scale(val, lb, ub, tol, scaleby="bounds")
 
 
-def test_deco_count():
-    @deco_count
-    def peep():
-        print("PEEP")
+def test_run_context():
+    def bounded(x):
+        return np.inf if x[0] < 0 else float(x[0] ** 2)
+
+    run1, run2 = RunContext(bounded, maxfev=3), RunContext(bounded)
+    assert run1.__name__ == "bounded"
+    run1(np.array([-1.]))  # out of bounds, not counted
+    run1(np.array([1.]))
+    run2(np.array([2.]))
+    run1.record(np.array([3.]), 9.)
+    assert (run1.calls, run2.calls) == (2, 1)
+    assert [f for _, f in run1.history] == [1., 9.]
+    run1(np.array([4.]))
+    assert run1.exhausted and not run2.exhausted
+    with pytest.raises(MaxFevalsReached):
+        run1(np.array([5.]))
+    # an optimiser counting its own evaluations of a run
+    outer = RunContext(run2, maxfev=1)
+    assert (outer.calls, outer.maxfev, outer.history) == (0, 1, [])
+    outer(np.array([1.]))
+    assert (outer.calls, run2.calls) == (1, 2)
 
-    n = 10
-    for i in range(n):
-        peep()
-    assert peep.calls == n
 
-
-@deco_count
 def rosenbrock(x, arg1=None, arg2=None):
     # Using scipy's definition. We have a couple of dummy arguments because
     # because PyBOBYQA *requires* optimargs and then passes them to the cost
@@ -92,7 +106,6 @@ def rosenbrock(x, arg1=None, arg2=None):
     return sum(100.0*(x[1:] - x[:-1]**2.0)**2.0 + (1 - x[:-1])**2.0)
 
 
-@deco_count
 def quadratic(x):
     return np.sum(x ** 2)
 
@@ -122,7 +135,6 @@ def test_errors():
 
 def test_NM_accuracy():
     for method in ["spendley", "axis", "random"]:
-        quadratic.calls = 0  # reset fevals
         optResult = nelder_mead(cf=quadratic, x0=x0, xtol=xtol,
                                 scaled_lb=lb, scaled_ub=ub,
                                 simplex_method=method, seed=RNG_SEED)
@@ -131,7 +143,6 @@ def test_NM_accuracy():
 
 def test_NM_niters_fevals():
     for method in ["spendley", "axis", "random"]:
-        quadratic.calls = 0  # reset fevals
         optResult = nelder_mead(cf=quadratic, x0=x0, xtol=xtol,
                                 scaled_lb=lb, scaled_ub=ub,
                                 simplex_method=method, seed=RNG_SEED)
@@ -143,9 +154,56 @@ def test_NM_niters_fevals():
         assert optResult.nfev < 850
 
 
+def test_surrogate_predict():
+    rng = np.random.default_rng(RNG_SEED)
+    model = QuadraticSurrogate(2)
+    # Not enough points to fit a quadratic yet.
+    mean, sigma = model.predict(np.zeros(2))
+    assert np.isnan(mean) and sigma == np.inf
+    for x in rng.uniform(low=-1, high=1, size=(20, 2)):
+        model.add(x, np.sum((x - 0.5) ** 2))
+    model.add(np.array([2, 2]), np.inf)  # not used for fitting
+    mean, sigma = model.predict(np.zeros(2))
+    assert np.isclose(mean, 0.5)
+    assert sigma < 1e-6
+
+
+def test_SNM_accuracy_fevals():
+    nm_result = nelder_mead(cf=quadratic, x0=x0, xtol=xtol,
+                            scaled_lb=lb, scaled_ub=ub)
+    assert nm_result.nskip == 0
+    snm_result = surrogate_nelder_mead(cf=quadratic, x0=x0, xtol=xtol,
+                                       scaled_lb=lb, scaled_ub=ub)
+    assert np.allclose(snm_result.xbest, np.zeros(len(x0)), atol=2e-2)
+    assert snm_result.nskip > 0
+    assert snm_result.nfev < nm_result.nfev
+    # An infinite confidence threshold never skips anything.
+    snm_result = surrogate_nelder_mead(cf=quadratic, x0=x0, xtol=xtol,
+                                       scaled_lb=lb, scaled_ub=ub,
+                                       confidence=np.inf)
+    assert snm_result.nskip == 0
+    assert snm_result.nfev == nm_result.nfev
+
+
+def test_NM_prefetch():
+    announced, evaluated = [], []
+
+    def recorded_quadratic(x):
+        evaluated.append(tuple(x))
+        return np.sum(x ** 2)
+
+    def prefetch(xs):
+        announced.extend(tuple(x) for x in xs)
+
+    optResult = nelder_mead(cf=recorded_quadratic, x0=x0, xtol=xtol,
+                            scaled_lb=lb, scaled_ub=ub, prefetch=prefetch)
+    assert np.allclose(optResult.xbest, np.zeros(len(x0)), atol=2e-2)
+    # every point evaluated has been announced
+    assert set(evaluated) <= set(announced)
+
+
 def test_MDS_accuracy():
     for method in ["spendley", "axis"]:
-        quadratic.calls = 0  # reset fevals
         optResult = multid_search(cf=quadratic, x0=x0, xtol=xtol,
                                   scaled_lb=lb, scaled_ub=ub,
                                   simplex_method=method,
@@ -155,7 +213,6 @@ def test_MDS_accuracy():
 
 def test_MDS_iters_fevals():
     for method in ["spendley", "axis"]:
-        quadratic.calls = 0  # reset fevals
         optResult = multid_search(cf=quadratic, x0=x0, xtol=xtol,
                                   scaled_lb=lb, scaled_ub=ub,
                                   simplex_method=method, seed=RNG_SEED)
@@ -164,7 +221,6 @@ def test_MDS_iters_fevals():
 
 
 def test_bobyqa_accuracy():
-    quadratic.calls = 0  # reset fevals
     sval, slb, sub, stol = scale(x0, lb, ub, xtol, scaleby="tols")
     sbest, _, _, _ = scale(np.zeros(len(x0)), lb, ub, xtol, scaleby="tols")
 
@@ -180,19 +236,16 @@ def test_bobyqa_accuracy():
 def test_maxfevals_reached():
     MAXFEV = 10
 
-    quadratic.calls = 0
     optResult = nelder_mead(cf=quadratic, x0=x0, xtol=([1e-6] * len(x0)),
                             scaled_lb=lb, scaled_ub=ub, maxfev=MAXFEV)
     assert optResult.message == MESSAGE_OPT_MAXFEV_REACHED
     assert optResult.nfev == MAXFEV
 
-    quadratic.calls = 0
     optResult = multid_search(cf=quadratic, x0=x0, xtol=([1e-6] * len(x0)),
                               scaled_lb=lb, scaled_ub=ub, maxfev=MAXFEV)
     assert optResult.message == MESSAGE_OPT_MAXFEV_REACHED
     assert optResult.nfev == MAXFEV
 
-    quadratic.calls = 0
     optResult = brute_force(cf=quadratic, x0=x0, xtol=([1e-6] * len(x0)),
                             scaled_lb=lb, scaled_ub=ub, maxfev=MAXFEV)
     assert optResult.message == MESSAGE_OPT_MAXFEV_REACHED
@@ -202,7 +255,6 @@ def test_maxfevals_reached():
 def test_brute_force_accuracy():
     # Note that for this test we need to set xtol much larger so that it
     # completes in a reasonable amount of time...
-    quadratic.calls = 0  # reset fevals
     optResult = brute_force(cf=quadratic, x0=x0, xtol=xtol*100,
                             scaled_lb=lb, scaled_ub=ub)
     assert np.allclose(optResult.xbest, np.zeros(len(x0)), atol=xtol[0]*100)
@@ -211,7 +263,6 @@ def test_brute_force_accuracy():
 def test_brute_force_warning():
     # Ensure that a warning is raised when ub-lb isn't cleanly divisible by
     # xtol.
-    quadratic.calls = 0  # reset fevals
     with pytest.warns(UserWarning, match="spacing between values"):
         optResult = brute_force(cf=quadratic, x0=x0, xtol=xtol*105,
                                 scaled_lb=lb, scaled_ub=ub)
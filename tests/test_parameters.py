@@ -0,0 +1,142 @@
+import numpy as np
+import pytest
+
+from esrpoise import optimise, param_set, ParamState, parameters
+from esrpoise.clock import use_clock, VirtualClock
+from esrpoise.parameters import (register_parameter, is_builtin,
+                                 set_parameters, read_parameters,
+                                 Quantisation, POLL_INTERVAL)
+from esrpoise.simulator import SimulatedXepr
+
+
+class CountingXepr(SimulatedXepr):
+    # counts the queries of the current experiment
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.nqueries = 0
+
+    def XeprExperiment(self, name=None):
+        if name is None:
+            self.nqueries += 1
+        return super().XeprExperiment(name)
+
+
+def test_builtin_registry():
+    assert is_builtin("Attenuation") and not is_builtin("p1")
+    par = parameters.BUILTIN_PARAMETERS["TMLevel"]
+    assert (par.path, par.layer, par.min_step) == \
+        ("ftBridge.TMLevel", "AcqHidden", 0.049)
+    assert parameters.BUILTIN_PARAMETERS["CenterField"].layer is None
+
+
+def test_register_parameter():
+    # the registry is restored after each test (cf. conftest.py)
+    register_parameter("ELDORFreqStart", "ftEpr.ELDORFreqStart",
+                       layer=None, min_step=1e-6)
+    assert parameters.BUILTIN_PARAMETERS["ELDORFreqStart"].min_step == 1e-6
+    with pytest.raises(ValueError):
+        register_parameter("&amp", "ftEpr.Amp")
+
+    sim = SimulatedXepr(lambda params: np.ones(4))
+    param_set(sim, ["ELDORFreqStart", "&x"], [9.5, 1], [1e-6, 1],
+              callback=lambda pars_dict: None)
+    assert sim.log == [("aqParSet", "AWGTransient", "ftEpr.ELDORFreqStart",
+                        "9.500000")]
+
+
+def test_set_parameters():
+    sim = CountingXepr(lambda params: np.ones(4))
+    exp_name = set_parameters(sim, {"Attenuation": "10.5",
+                                    "CenterField": "3400.05",
+                                    "SignalPhase": "12"})
+    assert exp_name == "AWGTransient" and sim.nqueries == 1
+    assert sim.params["fieldCtrl.CenterField"] == "3400.05"
+    # one aqParSet per parameter, in the layer of each parameter
+    assert [entry[:2] for entry in sim.log] == \
+        [("aqParSet", "AcqHidden"), ("aqParSet", "AWGTransient"),
+         ("aqParSet", "AcqHidden")]
+    with pytest.raises(ValueError):
+        set_parameters(sim, {"p1": "2"})
+
+    # the experiment name is cached by ParamState
+    state = ParamState()
+    for field in [3400, 3401, 3402]:
+        param_set(sim, ["CenterField", "Attenuation"], [field, 10], [1, 1],
+                  param_state=state)
+    assert sim.nqueries == 2
+    assert sim.params["fieldCtrl.CenterField"] == "3402"
+
+
+def test_quantisation():
+    q = Quantisation()
+    assert q.predict("BrXAmp", 0.5) is None
+    q.learn("BrXAmp", 0.50, 0.49)
+    q.learn("BrXAmp", 0.52, 0.49)
+    q.learn("BrXAmp", 0.53, 0.539)
+    assert q.predict("BrXAmp", 0.51) == 0.49        # monotonic quantiser
+    assert q.predict("BrXAmp", 0.525) is None
+    assert q.snap({"BrXAmp": 0.53}) == {"BrXAmp": 0.539}
+    assert q.setting(["BrXAmp", "p1"], ["0.53", "10"], {"BrXAmp": 0.539}) \
+        == (0.539, "10")
+    assert q.setting(["BrXAmp"], ["0.6"], {"BrXAmp": None}) is None
+
+    sim = SimulatedXepr(lambda params: np.ones(4),
+                        quantisers={"ftBridge.BrXAmp": 0.049,
+                                    "fieldCtrl.CenterField": np.floor})
+    set_parameters(sim, {"BrXAmp": "0.52", "CenterField": "3400.7"})
+    assert read_parameters(sim, ["BrXAmp", "CenterField"]) == \
+        {"BrXAmp": 0.539, "CenterField": 3400.}
+
+
+def test_optimise_readback():
+    def response(params):
+        return np.full(8, 1 - (params["ftBridge.BrXAmp"] - 0.6) ** 2)
+
+    # 101 requested values, 21 hardware settings
+    sim = SimulatedXepr(response, quantisers={"ftBridge.BrXAmp": 0.049})
+    q = Quantisation()
+    xbest, fbest, _ = optimise(sim, ["BrXAmp"], [0.5], [0], [1], [0.01],
+                               lambda data: -np.sum(data.O.real),
+                               optimiser="brute", readback=q)
+    assert sim.nruns == 21
+    assert q.hits == 101 - 21
+    assert np.isclose(fbest, -8 * (1 - 0.012 ** 2))
+
+
+def test_settle():
+    class FrequencyCounter():
+        # frequency counter converging after a frequency change
+        def __init__(self):
+            self.readings = iter([9.40, 9.43, 9.4349, 9.435])
+
+        @property
+        def value(self):
+            return next(self.readings)
+
+    class DriftingXepr(SimulatedXepr):
+        def XeprExperiment(self, name=None):
+            experiment = super().XeprExperiment(name)
+            get_param = experiment.getParam
+            experiment.getParam = lambda par: self.counter \
+                if par == "FrequencyMon" else get_param(par)
+            return experiment
+
+    register_parameter("Frequency", "cwBridge.Frequency", settle_time=1,
+                       monitor="FrequencyMon", monitor_tol=1e-3)
+    register_parameter("Attenuation", "ftBridge.Attenuation",
+                       settle_time=0.1)
+    with use_clock(VirtualClock()) as clock:
+        sim = DriftingXepr(lambda params: np.ones(4))
+        sim.counter = FrequencyCounter()
+        set_parameters(sim, {"Attenuation": "10"})
+        assert clock.elapsed == pytest.approx(0.1)
+        # the parameters settle simultaneously, then the monitor is polled
+        set_parameters(sim, {"Attenuation": "11", "Frequency": "9.435"})
+        assert clock.elapsed == pytest.approx(0.1 + 1 + 3 * POLL_INTERVAL)
+
+        # only the parameters which changed are waited for
+        state = ParamState()
+        start = clock.elapsed
+        for att in [12, 12, 13]:
+            param_set(sim, ["Attenuation"], [att], [1], param_state=state)
+        assert clock.elapsed - start == pytest.approx(0.2)
@@ -0,0 +1,99 @@
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from esrpoise import optimise, xepr_link
+from esrpoise.costfunctions import maxrealint_echo
+from esrpoise.optpoise import OptimisationCancelled
+from esrpoise.pipeline import PipelinedEvaluator
+from esrpoise.simulator import SimulatedXepr
+
+
+def response(params):
+    return np.full(4, params["ftBridge.Attenuation"] - 3)
+
+
+def test_run_poll():
+    sim = SimulatedXepr(lambda params: np.ones(4), acq_time=0.05)
+    xepr_link.run_exp(sim)
+    assert xepr_link.exp_running(sim)
+    xepr_link.wait_exp(sim)
+    assert not xepr_link.exp_running(sim)
+    assert np.allclose(xepr_link.get_data(sim).O, 1)
+
+
+def test_pipelined_evaluator():
+    acq_time, cf_time = 0.05, 0.05
+    sim = SimulatedXepr(response, acq_time=acq_time)
+    order, staged = [], []
+
+    def setup(point):
+        sim.XeprCmds.aqParSet("AcqHidden", "ftBridge.Attenuation",
+                              str(point[0]))
+
+    def slow_cf(data):
+        time.sleep(cf_time)
+        return float(np.abs(data.O[0]))
+
+    evaluator = PipelinedEvaluator(sim, setup, slow_cf,
+                                   stage=lambda point: staged.append(point),
+                                   record=lambda point, data, f:
+                                   order.append(point[0]))
+    points = [np.array([a]) for a in np.arange(10)]
+    tic = time.monotonic()
+    cf_vals = evaluator.evaluate(points)
+    elapsed = time.monotonic() - tic
+    assert cf_vals == [abs(a - 3) for a in range(10)]
+    assert order == list(range(10))
+    assert len(staged) == 9
+    # sequential evaluation would take 10 * (acq_time + cf_time)
+    assert elapsed < 10 * (acq_time + cf_time) * 0.85
+
+
+def test_pipelined_brute_force(tmp_path):
+    exp_file = tmp_path / "test.exp"
+    def_file = tmp_path / "test.def"
+    shutil.copy(os.path.join(os.getcwd(), 'tests', 'exp_file_test.exp'),
+                exp_file)
+    shutil.copy(os.path.join(os.getcwd(), 'tests', 'def_file_test.def'),
+                def_file)
+
+    def response(params):
+        return np.full(4, -(params["ftBridge.Attenuation"] - 3) ** 2
+                       - (params["p1"] - 50) ** 2)
+
+    results = []
+    for pipeline in [False, True]:
+        sim = SimulatedXepr(response)
+        results.append(optimise(sim, pars=["Attenuation", "p1"],
+                                init=[0, 40], lb=[0, 40], ub=[5, 60],
+                                tol=[1, 5], cost_function=maxrealint_echo,
+                                exp_file=str(exp_file),
+                                def_file=str(def_file), optimiser="brute",
+                                pipeline=pipeline))
+        assert sim.nruns == 6 * 5
+    assert np.allclose(results[0][0], [3, 50])
+    assert np.allclose(results[1][0], [3, 50])
+    assert results[0][1] == results[1][1]
+
+
+def test_pipelined_brute_force_cancel():
+    cancel = threading.Event()
+
+    def response(params):
+        # cancelled during the third acquisition
+        if sim.nruns == 2:
+            cancel.set()
+        return np.full(4, -(params["ftBridge.Attenuation"] - 3) ** 2)
+
+    sim = SimulatedXepr(response)
+    with pytest.raises(OptimisationCancelled):
+        optimise(sim, pars=["Attenuation"], init=[0], lb=[0], ub=[20],
+                 tol=[1], cost_function=maxrealint_echo, optimiser="brute",
+                 pipeline=True, cancel=cancel)
+    # the grid is not acquired to the end
+    assert sim.nruns == 3
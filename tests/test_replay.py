@@ -0,0 +1,87 @@
+import os
+
+import numpy as np
+import pytest
+
+from esrpoise import optimise, xepr_link
+from esrpoise.archive import ArchiveReader, ArchiveWriter
+from esrpoise.costfunctions import maxrealint_echo
+from esrpoise.replay import ReplayXepr, grid_index
+from esrpoise.simulator import SimulatedXepr
+
+
+def response(params):
+    att, user = params["ftBridge.Attenuation"], params["&x"]
+    return np.full(4, -(att - 3) ** 2 - (user - 1) ** 2 + 0.5j)
+
+
+@pytest.fixture
+def grid_archive(tmp_path):
+    # dense brute-force map recorded with the simulated spectrometer
+    path = os.path.join(tmp_path, "map.arc")
+    user = dict()
+    sim = SimulatedXepr(lambda params: response({**params, **user}))
+    with ArchiveWriter(path, ["Attenuation", "&x"]) as writer:
+        optimise(sim, ["Attenuation", "&x"], [0, -2], [0, -2], [6, 3],
+                 [0.5, 0.5], maxrealint_echo, optimiser="brute",
+                 callback=lambda pars_dict: user.update(pars_dict),
+                 archive=writer)
+    return path
+
+
+def test_grid_index():
+    values = np.array([[0, 0], [0, 1], [1, 0], [1, 1]])
+    axes, grid = grid_index(values[::-1])
+    assert np.allclose(axes[0], [0, 1])
+    assert grid[0, 1] == 2
+    with pytest.raises(ValueError):
+        grid_index(values[:3])
+
+
+def test_replay_nearest(grid_archive):
+    replay = ReplayXepr(grid_archive)
+    reader = ArchiveReader(grid_archive)
+    replay.callback({"&x": 1.1})
+    replay.XeprCmds.aqParSet("AcqHidden", "ftBridge.Attenuation", "3.9")
+    data = xepr_link.run2getdata_exp(replay)
+    assert np.allclose(data.O, response({"ftBridge.Attenuation": 4,
+                                         "&x": 1}))
+    assert np.allclose(data.X, reader[0].X)
+
+
+def test_replay_parameter_names(grid_archive, tmp_path):
+    replay = ReplayXepr(grid_archive)
+    assert replay.key("Attenuation") == "ftBridge.Attenuation"
+    assert replay.key("&x") == "&x"
+    assert replay.key("d1") == "d1"
+    # a .def file variable is not matched with a built-in parameter
+    replay.callback({"&x": 1})
+    replay.XeprCmds.aqParSet("AcqHidden", "myBridge.Attenuation", "3")
+    with pytest.raises(KeyError):
+        replay.point(replay.current_params())
+
+    # two names for the same Xepr parameter
+    path = os.path.join(tmp_path, "twice.arc")
+    with ArchiveWriter(path, ["SignalPhase", "cwBridge.SignalPhase"]) as w:
+        w.write([0, 0], ArchiveReader(grid_archive)[0], 0)
+    replay = ReplayXepr(path)
+    with pytest.raises(ValueError):
+        replay.point({"cwBridge.SignalPhase": 0})
+
+
+def test_replay_linear(grid_archive):
+    replay = ReplayXepr(grid_archive, method="linear")
+    replay.callback({"&x": 1})
+    replay.XeprCmds.aqParSet("AcqHidden", "ftBridge.Attenuation", "3.25")
+    data = xepr_link.run2getdata_exp(replay)
+    expected = 0.5 * (response({"ftBridge.Attenuation": 3, "&x": 1})
+                      + response({"ftBridge.Attenuation": 3.5, "&x": 1}))
+    assert np.allclose(data.O, expected)
+
+
+def test_replay_optimise(grid_archive):
+    replay = ReplayXepr(grid_archive)
+    xbest, fbest, message = optimise(
+        replay, ["Attenuation", "&x"], [5, -1], [0, -2], [6, 3], [0.5, 0.5],
+        maxrealint_echo, optimiser="nm", callback=replay.callback)
+    assert np.allclose(xbest, [3, 1], atol=0.5)
@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+
+from esrpoise.resonator import (compensate, compensation_bounds,
+                                compensation_coefficients, fit_lorentzian,
+                                fit_transfer_function, lorentzian,
+                                nutation_frequencies, ResonatorProfile,
+                                transfer_function)
+
+
+DT = 2e-9
+
+
+def nutations(nu1, n=160, noise=0.02, seed=0):
+    rng = np.random.default_rng(seed)
+    t = np.arange(n) * DT
+    return np.exp(1j * 0.3) * np.cos(2 * np.pi * np.outer(nu1, t)) \
+        * np.exp(-t / 300e-9) + noise * rng.standard_normal((len(nu1), n))
+
+
+def test_nutation_frequencies():
+    nu1 = np.linspace(10e6, 40e6, 25)
+    traces = nutations(nu1)
+    df = 1 / (160 * DT)
+    errors = {interpolation: np.max(np.abs(
+        nutation_frequencies(traces, DT, interpolation=interpolation) - nu1))
+        for interpolation in ["none", "parabolic", "sinc"]}
+    assert errors["none"] <= df / 2
+    # sub-bin accuracy without zero-filling
+    assert errors["parabolic"] < df / 3
+    assert errors["sinc"] < df / 8
+    # one transient
+    assert nutation_frequencies(traces[3], DT) == \
+        pytest.approx(nu1[3], abs=df / 3)
+    with pytest.raises(ValueError):
+        nutation_frequencies(traces, DT, interpolation="cubic")
+
+
+def test_fit_lorentzian():
+    f = np.linspace(9.2, 9.8, 41)
+    nu1 = lorentzian(f, 9.5, 80, 30e6)
+    assert np.allclose(fit_lorentzian(f, nu1), (9.5, 80, 30e6))
+    noisy = nu1 * (1 + 0.02 * np.random.default_rng(1).standard_normal(41))
+    f0, q, amplitude = fit_lorentzian(f, noisy)
+    assert f0 == pytest.approx(9.5, abs=1e-3)
+    assert q == pytest.approx(80, rel=0.05)
+    assert amplitude == pytest.approx(30e6, rel=0.02)
+
+
+def test_resonator_profile(tmp_path):
+    f = np.linspace(9.8, 9.2, 31)
+    nu1 = lorentzian(f, 9.5, 80, 30e6)
+    profile = ResonatorProfile.from_nutations(f, nutations(nu1), DT,
+                                              interpolation="sinc")
+    assert np.all(np.diff(profile.f) > 0)
+    assert np.allclose(profile.nu1, nu1[::-1], atol=0.5e6)
+    assert np.allclose(profile.model(), profile.nu1, atol=0.5e6)
+    assert profile.f0 == pytest.approx(9.5, abs=2e-3)
+
+    profile.save(tmp_path / "f.txt", tmp_path / "H_f.txt")
+    assert np.allclose(np.loadtxt(tmp_path / "H_f.txt"), profile.nu1)
+
+
+def test_fit_transfer_function():
+    f = np.linspace(9.3, 9.7, 5)
+    h = transfer_function(f, 9.5, 80, 3 * np.exp(1j))
+    f0, q, amplitude = fit_transfer_function(f, h)
+    assert (f0, q) == pytest.approx((9.5, 80))
+    assert amplitude == pytest.approx(3 * np.exp(1j))
+    assert np.allclose(np.abs(h), lorentzian(f, 9.5, 80, 3))
+
+
+def test_compensation():
+    f0, q, fc, tres = 9.5, 80, 9.45, 0.625e-9
+    c = compensation_coefficients(f0, q, fc, tres)
+    # compensated pulse = pulse / resonator response normalised at fc
+    ns = 256
+    wfm = np.exp(1j * np.pi * np.linspace(-1, 1, ns) ** 2 * 40)
+    df = np.fft.fftshift(np.fft.fftfreq(ns, tres))
+    response = transfer_function(fc + df / 1e9, f0, q) \
+        / abs(transfer_function(fc, f0, q))
+    expected = np.fft.ifft(np.fft.ifftshift(
+        np.fft.fftshift(np.fft.fft(wfm)) / response))
+    # (up to the half-bin offset of the scaled frequency axis)
+    error = np.abs(compensate(wfm, c) - expected)
+    assert np.max(error) < 0.02 * np.max(np.abs(expected))
+    # no compensation on resonance with an infinite bandwidth
+    assert np.allclose(compensate(wfm, [0, 0, 0, 0]), wfm)
+
+    lb, ub = compensation_bounds(f0, q, fc, tres)
+    assert np.all(lb <= c) and np.all(c <= ub) and np.all(lb < ub)
+    narrow = compensation_bounds(f0, q, fc, tres, q_rel=0.05)
+    assert np.all(narrow[0] >= lb) and np.all(narrow[1] <= ub)
+
+    profile = ResonatorProfile(np.linspace(9.2, 9.8, 31),
+                               lorentzian(np.linspace(9.2, 9.8, 31),
+                                          f0, q, 30e6))
+    c_fit, c_lb, c_ub = profile.compensation(fc, tres)
+    assert np.allclose(c_fit, c)
+    assert np.allclose(c_lb, lb) and np.allclose(c_ub, ub)
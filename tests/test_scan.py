@@ -0,0 +1,74 @@
+import os
+
+import numpy as np
+import pytest
+
+from esrpoise import xepr_link
+from esrpoise.archive import ArchiveReader
+from esrpoise.clock import use_clock, VirtualClock
+from esrpoise.parameters import register_parameter
+from esrpoise.scan import grid, scan
+from esrpoise.simulator import SimulatedXepr
+
+
+def response(params):
+    return np.full(4, params["ftBridge.Attenuation"]
+                   + 1j * params["cwBridge.SignalPhase"])
+
+
+def test_grid():
+    points = grid([1, 2], [10, 20, 30])
+    assert points.shape == (6, 2)
+    assert np.allclose(points[:3], [[1, 10], [1, 20], [1, 30]])
+    assert grid(np.arange(3)).shape == (3, 1)
+
+
+def test_scan(tmp_path):
+    path = os.path.join(tmp_path, "scan.arc")
+    sim = SimulatedXepr(response, hidden_defaults={"FrequencyMon": "9.7"})
+    register_parameter("Attenuation", "ftBridge.Attenuation", settle_time=1)
+    points = grid([10, 11.5, 13], [0, 30, 60, 90.04])
+    with use_clock(VirtualClock()) as clock:
+        reader = scan(sim, ["Attenuation", "SignalPhase"], points, [0.5, 1],
+                      path, cost_function=lambda data: data.real.sum(),
+                      monitors=["FrequencyMon"])
+        # the outer parameter only changes three times
+        assert clock.elapsed == pytest.approx(3)
+    assert sim.nruns == 12
+    assert reader.pars == ["Attenuation", "SignalPhase", "FrequencyMon"]
+    assert np.allclose(reader.values[:, :2],
+                       grid([10, 11.5, 13], [0, 30, 60, 90]))
+    assert np.allclose(reader.values[:, 2], 9.7)
+    traces = reader.stack().reshape(3, 4, -1)
+    assert np.allclose(traces[1, 2], 11.5 + 60j)
+    assert np.allclose(reader.costs, 4 * reader.values[:, 0])
+
+
+def test_scan_resume(tmp_path):
+    path = os.path.join(tmp_path, "scan.arc")
+    points = grid([10, 11, 12], [0, 30])
+
+    class Crash(Exception):
+        pass
+
+    def crashing_acquire(xepr):
+        if xepr.nruns == 4:
+            raise Crash
+        return xepr_link.run2getdata_exp(xepr)
+
+    sim = SimulatedXepr(response)
+    with pytest.raises(Crash):
+        scan(sim, ["Attenuation", "SignalPhase"], points, [1, 1], path,
+             acquire=crashing_acquire)
+    assert len(ArchiveReader(path)) == 4
+
+    sim = SimulatedXepr(response)
+    reader = scan(sim, ["Attenuation", "SignalPhase"], points, [1, 1], path)
+    assert sim.nruns == 2
+    assert np.allclose(reader.values, points)
+    assert np.allclose(reader[5].O, 12 + 30j)
+
+    # restart from scratch
+    reader = scan(sim, ["Attenuation", "SignalPhase"], points[:2], [1, 1],
+                  path, resume=False)
+    assert len(reader) == 2
@@ -0,0 +1,168 @@
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+from esrpoise import shapes, xepr_link, optimise, ParamState
+from esrpoise.costfunctions import maxrealint_echo
+from esrpoise.simulator import SimulatedXepr, read_defs
+
+
+@pytest.fixture
+def loaded(monkeypatch):
+    """
+    Record the content of the shape files loaded instead of sending them to
+    Xepr.
+    """
+    loaded = []
+
+    def load_shp(xepr, shp_file):
+        with open(shp_file) as f:
+            loaded.append(f.read())
+
+    monkeypatch.setattr(xepr_link, "load_shp", load_shp)
+    return loaded
+
+
+def test_shape_text():
+    body = shapes.shape_body(np.array([0.5, -1j]), decimals=2)
+    assert body == "+5.00e-01,+0.00e+00\n-0.00e+00,-1.00e+00\n"
+    text = shapes.shape_text(7770, body)
+    assert text.startswith('begin shape7770 "esrpoise"\n')
+    assert text.endswith("end shape7770\n")
+    with pytest.raises(ValueError, match="within"):
+        shapes.shape_body(np.array([2, 0]))
+
+
+def test_shape_manager_dedup(loaded, tmp_path):
+    manager = shapes.ShapeManager(None, slots=[10, 11], shp_dir=tmp_path)
+    wfm = np.exp(1j * np.linspace(0, np.pi, 8)) / 2
+    assert manager.load(wfm) == 10
+    # identical once formatted: not uploaded again
+    assert manager.load(wfm + 1e-9) == 10
+    assert len(loaded) == 1
+    assert manager.nskipped == 1
+    assert manager.load(wfm.real, wfm.imag) == 10
+
+    # new waveforms fill the pool, then replace the least recently used
+    assert manager.load(wfm / 2) == 11
+    assert manager.load(wfm) == 10
+    assert manager.load(wfm / 4) == 11
+    assert len(loaded) == 3
+    assert "begin shape11" in loaded[-1]
+
+
+def test_shape_manager_load_many(loaded, tmp_path):
+    manager = shapes.ShapeManager(None, slots=range(100, 104),
+                                  shp_dir=tmp_path)
+    wfms = [np.full(4, a) for a in (0.1, 0.2, 0.1)]
+    assert manager.load_many(wfms) == [100, 101, 100]
+    # single merged file
+    assert len(loaded) == 1
+    assert loaded[0].count("begin shape") == 2
+    assert manager.load_many(wfms[:2] + [np.full(4, 0.3)]) == [100, 101, 102]
+    assert len(loaded) == 2
+    assert loaded[1].count("begin shape") == 1
+    with pytest.raises(ValueError, match="Not enough"):
+        manager.load_many([np.full(4, a) for a in np.linspace(0, 1, 5)])
+
+
+def test_shape_manager_loads_counter(loaded, tmp_path):
+    manager = shapes.ShapeManager(None, slots=[1], shp_dir=tmp_path,
+                                  max_loads=2)
+    manager.load(np.full(4, 0.1))
+    assert manager.loads_remaining == 1
+    assert not manager.reset_due()
+    manager.load(np.full(4, 0.2))
+    assert manager.reset_due()
+    with pytest.warns(UserWarning, match="AWG"):
+        manager.load(np.full(4, 0.3))
+    manager.invalidate()
+    assert manager.loads_remaining == 2
+    manager.load(np.full(4, 0.3))
+    assert len(loaded) == 4
+
+
+def test_unattended_reset(monkeypatch, tmp_path):
+    # Whole flow on the simulated backend: the AWG is exhausted several times
+    # during the optimisation, and the experiment is reset without user
+    # interaction, with its parameters restored.
+    monkeypatch.setattr("builtins.input", pytest.fail)
+    exp_file = tmp_path / "test.exp"
+    def_file = tmp_path / "test.def"
+    shutil.copy(os.path.join(os.getcwd(), 'tests', 'exp_file_test.exp'),
+                exp_file)
+    shutil.copy(os.path.join(os.getcwd(), 'tests', 'def_file_test.def'),
+                def_file)
+
+    def response(params):
+        # Attenuation is reset to 0 dB by a reset, outside of the bounds
+        att = params["ftBridge.Attenuation"]
+        assert 5 <= att <= 15
+        return np.full(8, 1 - (att - 8) ** 2 - (params["p1"] - 60) ** 2)
+
+    sim = SimulatedXepr(response,
+                        hidden_defaults={"ftBridge.Attenuation": "0"},
+                        max_shape_loads=6)
+    state = ParamState()
+    manager = shapes.ShapeManager(sim, slots=[7770], shp_dir=tmp_path,
+                                  max_loads=6, auto_reset=True,
+                                  exp_file=str(exp_file),
+                                  def_file=str(def_file),
+                                  param_state=state)
+
+    def callback(pars_dict):
+        manager.load(np.full(8, pars_dict["&a"]))
+
+    xbest, fbest, message = optimise(sim, pars=["Attenuation", "p1", "&a"],
+                                     init=[10, 50, 0.5], lb=[5, 40, 0],
+                                     ub=[15, 80, 1], tol=[0.5, 1, 0.05],
+                                     cost_function=maxrealint_echo,
+                                     exp_file=str(exp_file),
+                                     def_file=str(def_file),
+                                     optimiser="nm", maxfev=40,
+                                     callback=callback, param_state=state)
+    assert manager.nresets >= 2
+    assert sim.nruns > 2 * 6
+    # best values set up after the optimisation
+    assert np.isclose(float(sim.params["ftBridge.Attenuation"]), xbest[0],
+                      atol=0.25)
+    assert np.isclose(float(read_defs(def_file)["p1"]), xbest[1], atol=0.5)
+
+
+def test_shape_bank(tmp_path):
+    def_file = tmp_path / "test.def"
+    def_file.write_text("as0 = 0 ; shape\np0 = 16\n")
+    synthesised = []
+
+    def synthesise(points):
+        synthesised.append(len(points))
+        # one call for all grid points
+        t = np.linspace(-1, 1, 16)
+        return np.exp(1j * np.outer(points[:, 0], t ** 2)) * points[:, [1]]
+
+    sim = SimulatedXepr(lambda params: np.full(4, params["as0"]))
+    bank = shapes.ShapeBank(sim, pars=["&bw", "&amp"],
+                            values=[np.linspace(0, 1, 5), [0.5, 1]],
+                            synthesise=synthesise, first_shp_nb=100,
+                            def_var="as0", def_file=str(def_file),
+                            shp_dir=tmp_path)
+    assert synthesised == [10]
+    xepr_link.load_def(sim, str(def_file))
+    # grid in the same order as the brute-force optimiser
+    assert bank.shp_nb({"&bw": 0, "&amp": 0.5}) == 100
+    assert bank.shp_nb({"&bw": 0, "&amp": 1}) == 101
+    assert bank.shp_nb({"&bw": 0.24, "&amp": 0.9}) == 103
+
+    sim.log.clear()
+    for bw in [0.5, 0.75, 0.75]:
+        bank({"&bw": bw, "&amp": 1, "p0": 16})
+    loads = [cmd for cmd in sim.log if cmd[0] == "aqPgShpLoad"]
+    assert len(loads) == 1
+    with open(loads[0][1]) as f:
+        assert f.read().count("begin shape") == 10
+    assert read_defs(def_file)["as0"] == "107"
+    assert xepr_link.run2getdata_exp(sim).O[0] == 107
+    # no compilation needed to switch shapes, apart from the shape upload
+    assert sim.log.count(("aqPgCompile",)) == 1
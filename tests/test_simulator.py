@@ -0,0 +1,57 @@
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+from esrpoise import xepr_link
+from esrpoise.simulator import SimulatedXepr, SimulationError, read_defs
+
+
+def test_read_defs():
+    def_file = os.path.join(os.getcwd(), 'tests', 'def_file_test.def')
+    defs = read_defs(def_file)
+    assert defs["p1"] == "92"
+    assert defs["aa2"] == "92"
+    assert "; p0" not in defs
+
+
+def test_simulated_run(tmp_path):
+    def_file = tmp_path / "test.def"
+    shutil.copy(os.path.join(os.getcwd(), 'tests', 'def_file_test.def'),
+                def_file)
+
+    def response(params):
+        return np.full(4, params["p1"] + 1j * params["ftBridge.Attenuation"])
+
+    sim = SimulatedXepr(response,
+                        hidden_defaults={"ftBridge.Attenuation": "10"})
+    with pytest.raises(RuntimeError):
+        # .def file not loaded yet: KeyError in response()
+        xepr_link.run2getdata_exp(sim)
+    xepr_link.modif_def(sim, str(def_file), ["p1"], ["50"])
+    sim.XeprCmds.aqParSet("AcqHidden", "ftBridge.Attenuation", "12.5")
+    data = xepr_link.run2getdata_exp(sim)
+    assert np.allclose(data.O, 50 + 12.5j)
+    assert np.allclose(data.X, np.arange(4))
+
+
+def test_simulated_awg_exhaustion(tmp_path):
+    exp_file = tmp_path / "test.exp"
+    shutil.copy(os.path.join(os.getcwd(), 'tests', 'exp_file_test.exp'),
+                exp_file)
+    sim = SimulatedXepr(lambda params: np.ones(4),
+                        hidden_defaults={"ftBridge.Attenuation": "10"},
+                        max_shape_loads=2)
+    sim.XeprCmds.aqParSet("AcqHidden", "ftBridge.Attenuation", "12.5")
+    for _ in range(3):
+        xepr_link.load_shp(sim, "shape.shp")
+    with pytest.raises(RuntimeError):
+        xepr_link.run2getdata_exp(sim)
+    xepr_link.reset_exp(sim, exp_file=str(exp_file))
+    # hidden parameters are lost on reset
+    assert sim.params["ftBridge.Attenuation"] == "10"
+    xepr_link.run2getdata_exp(sim)
+    assert ("aqPgLoad", str(exp_file)) in sim.log
+    assert sim.nruns == 1
+    assert issubclass(SimulationError, RuntimeError)